@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Benchmark reproducible del actualizador y la tienda, sin root y sin red.
+
+Monta en un directorio temporal todo lo que los scripts esperan encontrar en el sistema:
+  - un repositorio git "bare" local (a partir de src/ de este árbol) como remoto,
+  - un dpkg/status sintético con miles de paquetes,
+  - apt-get, apt-cache, notify-send, zenity, sudo... de prueba (bench/stubs),
+y mide:
+  - actualizador: tiempo total de un inicio de sesión sin cambios (con y sin consulta al
+    remoto), con cambios en el repositorio (scripts / módulo, que obliga a reiniciar),
+    con apps obligatorias que faltan y el primer clon;
+  - tienda (requiere GTK y una pantalla; si no hay DISPLAY se usa Xvfb si está
+    instalado): tiempo hasta la primera ventana, hasta tener los estados cargados y
+    latencia de refresco, con catálogos de 30, 300 y 3000 apps; y el modo por línea de
+    comandos (--install/--remove --json), que no necesita pantalla.
+
+El resultado es JSON. Con --comparar se contrasta con un resultado anterior y el proceso
+sale con código 1 si alguna mediana empeora más de la tolerancia.
+
+    python3 bench/benchmark.py > resultado.json
+    python3 bench/benchmark.py --repeticiones 3 --comparar base.json
+"""
+import argparse
+import getpass
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+RAIZ_REPO = os.path.dirname(BENCH)
+HIJO = os.path.join(BENCH, "hijo.py")
+STUBS = os.path.join(BENCH, "stubs")
+
+TAMANOS_CATALOGO = (30, 300, 3000)
+PAQUETES_DPKG = 4000
+REFRESCOS_POR_VENTANA = 5
+# Mismas apps que APPS_OBLIGATORIAS del actualizador: deben figurar como instaladas
+APPS_BASE = ("zram-tools", "openboard", "screen")
+
+# ==============================================================================
+# PREPARACIÓN DEL ENTORNO
+# ==============================================================================
+def bloque_dpkg(paquete, instalado):
+    estado = "install ok installed" if instalado else "deinstall ok config-files"
+    return (f"Package: {paquete}\nStatus: {estado}\nPriority: optional\nSection: misc\n"
+            f"Installed-Size: {random.randint(10, 50000)}\nMaintainer: Bench <bench@example.org>\n"
+            f"Architecture: amd64\nVersion: 1.{random.randint(0, 9)}-1\n"
+            f"Depends: libc6 (>= 2.34), libbench{random.randint(0, 99)}\n"
+            f"Description: paquete sintético {paquete}\n Descripción larga del paquete\n en varias líneas.\n")
+
+def escribir_dpkg_status(ruta):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    bloques = [bloque_dpkg(f"bench-base-{i:05d}", i % 10 != 0) for i in range(PAQUETES_DPKG)]
+    bloques += [bloque_dpkg(app, True) for app in APPS_BASE]
+    # Las apps de los catálogos: la mitad instaladas
+    bloques += [bloque_dpkg(f"bench-app-{i:04d}", i % 2 == 0) for i in range(max(TAMANOS_CATALOGO))]
+    with open(ruta, "w") as f: f.write("\n".join(bloques) + "\n")
+
+def escribir_catalogo(ruta, tamano):
+    secciones = []
+    for inicio in range(0, tamano, 10):
+        secciones.append({"categoria": f"Sección {inicio // 10 + 1}", "apps": [
+            {"id": f"bench-app-{i:04d}", "nombre": f"App {i}", "desc": "Aplicación sintética del benchmark",
+             "icono": "applications-other"} for i in range(inicio, min(inicio + 10, tamano))]})
+    with open(ruta, "w") as f: json.dump(secciones, f)
+
+def git(*argumentos, cwd):
+    subprocess.run(["git", "-c", "user.name=bench", "-c", "user.email=bench@example.org"] + list(argumentos),
+                   cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def crear_remoto(raiz):
+    """Repositorio de trabajo con src/ y el icono de este árbol, publicado en un bare local."""
+    trabajo = os.path.join(raiz, "trabajo")
+    os.makedirs(os.path.join(trabajo, "images"))
+    shutil.copytree(os.path.join(RAIZ_REPO, "src"), os.path.join(trabajo, "src"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copy(os.path.join(RAIZ_REPO, "images", "guadamintuz.svg"), os.path.join(trabajo, "images"))
+    git("init", "-q", "-b", "main", cwd=trabajo)
+    git("add", "-A", cwd=trabajo)
+    git("commit", "-q", "-m", "Estado inicial", cwd=trabajo)
+    remoto = os.path.join(raiz, "remoto.git")
+    git("clone", "-q", "--bare", trabajo, remoto, cwd=raiz)
+    git("config", "uploadpack.allowFilter", "true", cwd=remoto)
+    git("remote", "add", "bench", remoto, cwd=trabajo)
+    return trabajo, remoto
+
+def publicar_cambio(trabajo, archivo):
+    with open(os.path.join(trabajo, archivo), "a") as f: f.write(f"\n# cambio del benchmark {time.time()}\n")
+    git("commit", "-q", "-am", f"Cambio en {archivo}", cwd=trabajo)
+    git("push", "-q", "bench", "main", cwd=trabajo)
+
+def preparar(raiz):
+    trabajo, remoto = crear_remoto(raiz)
+    escribir_dpkg_status(os.path.join(raiz, "dpkg", "status"))
+    for tamano in TAMANOS_CATALOGO: escribir_catalogo(os.path.join(raiz, f"catalogo-{tamano}.json"), tamano)
+    with open(os.path.join(raiz, "guadamint.conf"), "w") as f:
+        f.write(f"[actualizador]\njitter_max = 0\n\n[fuentes]\nurls = file://{remoto} 5\n")
+    entorno = os.environ.copy()
+    entorno.update(PATH=STUBS + os.pathsep + entorno.get("PATH", ""), SUDO_USER=getpass.getuser(),
+                   GUADAMINT_BENCH_DIR=raiz, GUADAMINT_BENCH_DPKG=os.path.join(raiz, "dpkg", "status"),
+                   GIT_CONFIG_NOSYSTEM="1")
+    return trabajo, entorno
+
+def iniciar_pantalla(entorno):
+    """Devuelve el proceso Xvfb lanzado (o None) y un motivo si no hay pantalla posible."""
+    if entorno.get("DISPLAY") or entorno.get("WAYLAND_DISPLAY"): return None, None
+    if not shutil.which("Xvfb"): return None, "sin DISPLAY y sin Xvfb"
+    lectura, escritura = os.pipe()
+    xvfb = subprocess.Popen(["Xvfb", "-displayfd", str(escritura), "-nolisten", "tcp", "-screen", "0", "1280x1024x24"],
+                            pass_fds=(escritura,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(escritura)
+    with os.fdopen(lectura) as f: pantalla = f.readline().strip()
+    if not pantalla: return None, "Xvfb no ha arrancado"
+    entorno["DISPLAY"] = f":{pantalla}"
+    return xvfb, None
+
+# ==============================================================================
+# MEDICIONES
+# ==============================================================================
+def estadisticas(caso, muestras, **extra):
+    muestras = [round(m, 4) for m in muestras]
+    resultado = {"caso": caso, "unidad": "s", "n": len(muestras), "muestras": muestras}
+    if muestras:
+        resultado.update(mediana=round(statistics.median(muestras), 4), min=min(muestras), max=max(muestras))
+    resultado.update(extra)
+    return resultado
+
+def ejecutar_actualizador(raiz, entorno, argumentos, detalle):
+    inicio = time.perf_counter()
+    subprocess.run([sys.executable, HIJO, "actualizador", raiz] + argumentos, env=entorno, check=True,
+                   stdout=None if detalle else subprocess.DEVNULL, stderr=None if detalle else subprocess.DEVNULL)
+    return time.perf_counter() - inicio
+
+def medir_actualizador(raiz, trabajo, entorno, repeticiones, detalle):
+    sistema = os.path.join(raiz, "sistema")
+    status = os.path.join(raiz, "dpkg", "status")
+    casos = [
+        # (nombre, preparación antes de cada repetición, argumentos)
+        ("actualizador.primer_clon", lambda: shutil.rmtree(sistema, ignore_errors=True), []),
+        ("actualizador.sin_cambios", None, []),
+        ("actualizador.sin_cambios_remoto", None, ["--force"]),
+        ("actualizador.cambio_scripts", lambda: publicar_cambio(trabajo, "src/scripts/instalar_chrome.sh"), ["--force"]),
+        ("actualizador.cambio_modulo", lambda: publicar_cambio(trabajo, "src/guadamint_config.py"), ["--force"]),
+        ("actualizador.apps_faltantes", lambda: marcar_instalado(status, APPS_BASE[0], False), []),
+    ]
+    resultados = []
+    for nombre, preparacion, argumentos in casos:
+        muestras = []
+        for _ in range(repeticiones):
+            if preparacion: preparacion()
+            muestras.append(ejecutar_actualizador(raiz, entorno, argumentos, detalle))
+        resultados.append(estadisticas(nombre, muestras))
+        print(f"  {nombre}: mediana {resultados[-1]['mediana']:.3f}s", file=sys.stderr)
+    return resultados
+
+def marcar_instalado(status, paquete, instalado):
+    with open(status) as f: contenido = f.read()
+    estados = [f"Package: {paquete}\nStatus: install ok installed", f"Package: {paquete}\nStatus: deinstall ok config-files"]
+    if instalado: estados.reverse()
+    with open(status + ".nuevo", "w") as f: f.write(contenido.replace(estados[0], estados[1]))
+    os.replace(status + ".nuevo", status)
+
+def medir_cli(raiz, entorno, repeticiones, detalle):
+    """Orden completa de la tienda sin interfaz: instala una app y desinstala otra."""
+    status = os.path.join(raiz, "dpkg", "status")
+    muestras = []
+    for _ in range(repeticiones):
+        marcar_instalado(status, "bench-app-0001", False)
+        marcar_instalado(status, "bench-app-0002", True)
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, HIJO, "cli", raiz, os.path.join(raiz, "catalogo-30.json"),
+                        "--install", "bench-app-0001", "--remove", "bench-app-0002", "--json"], env=entorno, check=True,
+                       stdout=None if detalle else subprocess.DEVNULL, stderr=None if detalle else subprocess.DEVNULL)
+        muestras.append(time.perf_counter() - inicio)
+    resultado = estadisticas("tienda.cli", muestras)
+    print(f"  tienda.cli: mediana {resultado['mediana']:.3f}s", file=sys.stderr)
+    return [resultado]
+
+def medir_tienda(raiz, entorno, repeticiones, motivo_omision):
+    resultados = []
+    for tamano in TAMANOS_CATALOGO:
+        prefijo = f"tienda.catalogo_{tamano}"
+        if motivo_omision:
+            resultados.append({"caso": prefijo, "omitido": motivo_omision})
+            continue
+        marcas = {"importar": [], "primera_ventana": [], "poblada": [], "refrescos": []}
+        for _ in range(repeticiones):
+            entorno_hijo = dict(entorno, GUADAMINT_BENCH_INICIO=repr(time.time()))
+            salida = subprocess.run([sys.executable, HIJO, "tienda", raiz, os.path.join(raiz, f"catalogo-{tamano}.json"),
+                                     str(REFRESCOS_POR_VENTANA)], env=entorno_hijo, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True).stdout
+            # La tienda también escribe su log por stdout: el resultado es la última línea JSON
+            lineas = [l for l in salida.splitlines() if l.startswith("{")]
+            datos = json.loads(lineas[-1]) if lineas else {"omitido": "la tienda no ha devuelto resultados"}
+            if "omitido" in datos:
+                motivo_omision = datos["omitido"]
+                break
+            for clave in ("importar", "primera_ventana", "poblada"):
+                if clave in datos: marcas[clave].append(datos[clave])
+            marcas["refrescos"].extend(datos.get("refrescos", []))
+        if motivo_omision:
+            resultados.append({"caso": prefijo, "omitido": motivo_omision})
+            continue
+        for clave, muestras in marcas.items():
+            resultados.append(estadisticas(f"{prefijo}.{clave}", muestras, apps=tamano))
+        print(f"  {prefijo}: primera ventana {statistics.median(marcas['primera_ventana'] or [0]):.3f}s, "
+              f"refresco {statistics.median(marcas['refrescos'] or [0]):.3f}s", file=sys.stderr)
+    return resultados
+
+# ==============================================================================
+# COMPARACIÓN CON UN RESULTADO ANTERIOR
+# ==============================================================================
+def comparar(actual, ruta_base, tolerancia):
+    with open(ruta_base) as f: base = {r["caso"]: r for r in json.load(f)["resultados"] if "mediana" in r}
+    regresiones = []
+    for resultado in actual["resultados"]:
+        anterior = base.get(resultado["caso"])
+        if not anterior or "mediana" not in resultado or not anterior["mediana"]: continue
+        cambio = resultado["mediana"] / anterior["mediana"] - 1
+        if cambio > tolerancia:
+            regresiones.append(f"{resultado['caso']}: {anterior['mediana']:.3f}s -> {resultado['mediana']:.3f}s (+{cambio:.0%})")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del actualizador y la tienda de GuadaMint (sin root ni red).")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Ejecuciones por caso (5 por defecto)")
+    parser.add_argument("--solo", choices=("actualizador", "tienda"), help="Medir solo una de las dos partes")
+    parser.add_argument("--salida", help="Escribir el JSON en este archivo en lugar de stdout")
+    parser.add_argument("--comparar", metavar="BASE.json", help="Resultado anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Empeoramiento admitido de la mediana (0.25 = 25%%)")
+    parser.add_argument("--conservar", action="store_true", help="No borrar el directorio de trabajo")
+    parser.add_argument("--detalle", action="store_true", help="Mostrar la salida del actualizador")
+    args = parser.parse_args()
+
+    random.seed(0)
+    raiz = tempfile.mkdtemp(prefix="guadamint-bench-")
+    broker = xvfb = None
+    try:
+        print(f">>> Preparando entorno en {raiz}...", file=sys.stderr)
+        trabajo, entorno = preparar(raiz)
+        # El broker de avisos ya está en marcha en una sesión normal: se arranca antes de medir
+        broker = subprocess.Popen([sys.executable, HIJO, "broker", raiz], env=entorno,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        resultado = {
+            "version": 1,
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": subprocess.run(["git", "rev-parse", "HEAD"], cwd=RAIZ_REPO, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, text=True).stdout.strip() or None,
+            "python": platform.python_version(),
+            "equipo": platform.node(),
+            "repeticiones": args.repeticiones,
+            "paquetes_dpkg": PAQUETES_DPKG + len(APPS_BASE) + max(TAMANOS_CATALOGO),
+            "resultados": [],
+        }
+        if args.solo != "tienda":
+            print(">>> Actualizador", file=sys.stderr)
+            resultado["resultados"] += medir_actualizador(raiz, trabajo, entorno, args.repeticiones, args.detalle)
+        if args.solo != "actualizador":
+            print(">>> Tienda", file=sys.stderr)
+            resultado["resultados"] += medir_cli(raiz, entorno, args.repeticiones, args.detalle)
+            xvfb, motivo = iniciar_pantalla(entorno)
+            resultado["resultados"] += medir_tienda(raiz, entorno, args.repeticiones, motivo)
+
+        texto = json.dumps(resultado, indent=1, ensure_ascii=False)
+        if args.salida:
+            with open(args.salida, "w") as f: f.write(texto + "\n")
+        else:
+            print(texto)
+        if args.comparar:
+            regresiones = comparar(resultado, args.comparar, args.tolerancia)
+            for linea in regresiones: print(f"!!! Regresión: {linea}", file=sys.stderr)
+            if regresiones: sys.exit(1)
+    finally:
+        for proceso in (broker, xvfb):
+            if proceso: proceso.terminate()
+        if args.conservar: print(f">>> Directorio conservado: {raiz}", file=sys.stderr)
+        else: shutil.rmtree(raiz, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Proceso hijo del benchmark: carga el actualizador o la tienda desde src/ con todas las
+rutas del sistema redirigidas al directorio de trabajo del benchmark, sin root ni red.
+
+    hijo.py actualizador <dir> [argumentos del actualizador...]
+    hijo.py tienda <dir> <catalogo.json> <refrescos>
+    hijo.py cli <dir> <catalogo.json> [argumentos de apps-guadamint.py --install/--remove...]
+    hijo.py broker <dir>
+
+Lo lanza benchmark.py; no está pensado para usarse a mano.
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(os.path.dirname(BENCH), "src")
+sys.path.insert(0, SRC)
+
+def cargar(nombre, archivo):
+    spec = importlib.util.spec_from_file_location(nombre, os.path.join(SRC, archivo))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+def redirigir(raiz):
+    """Apunta las rutas de los módulos compartidos a <raiz>/sistema en lugar de /."""
+    import guadamint_apt, guadamint_config, guadamint_despliegue, guadamint_sesion, guadamint_sync
+    sistema = os.path.join(raiz, "sistema")
+    guadamint_config.CONFIG_FILE = os.path.join(raiz, "guadamint.conf")
+    guadamint_apt.DPKG_STATUS = os.path.join(raiz, "dpkg", "status")
+    guadamint_apt.APT_LISTS_DIR = os.path.join(raiz, "apt", "lists")
+    guadamint_apt.APT_UPDATE_STAMP = os.path.join(raiz, "apt", "update-success-stamp")
+    guadamint_apt.DPKG_LOCKS = [os.path.join(raiz, "dpkg", "lock-frontend"), os.path.join(raiz, "dpkg", "lock")]
+    guadamint_apt.CACHE_DISPONIBLES = os.path.join(raiz, "disponibles.json")
+    guadamint_sync.REPO_DIR = sistema + "/opt/guadamint"
+    guadamint_sync.ESTADO_DIR = sistema + "/var/lib/guadamint"
+    guadamint_sync.ESTADO_REMOTO = guadamint_sync.ESTADO_DIR + "/estado-remoto.json"
+    guadamint_sync.ULTIMA_SYNC = guadamint_sync.ESTADO_DIR + "/ultima-sync.json"
+    guadamint_sync.LOCK_SYNC = os.path.join(raiz, "guadamint-sync.lock")
+    guadamint_despliegue.MANIFIESTO = guadamint_sync.ESTADO_DIR + "/manifiesto.json"
+    guadamint_sesion.ruta_socket = lambda uid: os.path.join(raiz, "avisos.sock")
+    return sistema
+
+def actualizador(raiz):
+    sistema = redirigir(raiz)
+    import guadamint_sync
+    m = cargar("guadamint_update", "guadamint-update.py")
+    m.REPO_DIR = guadamint_sync.REPO_DIR
+    m.LOG_FILE = os.path.join(raiz, "actualizador.log")
+    m.TIEMPOS_FILE = os.path.join(raiz, "actualizador-tiempos.jsonl")
+    m.SCRIPT_BIN_PATH = sistema + m.SCRIPT_BIN_PATH
+    m.PUNTO_CONTROL = guadamint_sync.ESTADO_DIR + "/reinicio.json"
+    for item in m.ARCHIVOS_A_SINCRONIZAR:
+        item["destino"] = sistema + item["destino"]
+        item.pop("propietario", None)  # Sin root no se puede cambiar el dueño
+    # Estas dos tareas escriben directamente en /etc: se sustituyen por tareas vacías
+    for tarea in m.TAREAS:
+        if tarea["nombre"] in ("login", "bienvenida"): tarea["funcion"] = lambda: None
+    # main() exige root; con las rutas redirigidas nada de lo que ejecuta lo necesita
+    os.geteuid = lambda: 0
+    m.main()
+
+def tienda(raiz, catalogo, num_refrescos):
+    inicio = float(os.environ["GUADAMINT_BENCH_INICIO"])
+    redirigir(raiz)
+    import guadamint_apt
+    try:
+        m = cargar("apps_guadamint", "apps-guadamint.py")
+        from gi.repository import GLib, Gtk
+    except (ImportError, ValueError) as e:
+        print(json.dumps({"omitido": f"GTK no disponible: {e}"}))
+        return
+    importado = time.time()
+    m.DPKG_STATUS = guadamint_apt.DPKG_STATUS
+    with open(catalogo) as f: m.CATALOGO = json.load(f)
+    # Sin vigilancia de dpkg: cada refresco del benchmark debe ser el único que actualice las filas
+    m.GuadaStoreWindow.vigilar_dpkg = lambda self: None
+
+    marcas = {"importar": importado - inicio}
+    refrescos = []
+    pendiente = {}
+
+    def siguiente_refresco():
+        if len(refrescos) >= num_refrescos:
+            Gtk.main_quit()
+            return False
+        os.utime(m.DPKG_STATUS)  # Como si dpkg acabara de escribir: obliga a releer el índice
+        pendiente["t0"] = time.time()
+        win.refresh_all(None)
+        return False
+
+    def quizas_empezar():
+        if "primera_ventana" in marcas and "poblada" in marcas and not pendiente.get("empezado"):
+            pendiente["empezado"] = True
+            GLib.idle_add(siguiente_refresco)
+
+    aplicar_original = m.GuadaStoreWindow.aplicar_estados
+    def aplicar_estados(self, instalados, completo=False):
+        resultado = aplicar_original(self, instalados, completo)
+        ahora = time.time()
+        if "poblada" not in marcas:
+            marcas["poblada"] = ahora - inicio
+            quizas_empezar()
+        elif "t0" in pendiente:
+            refrescos.append(ahora - pendiente.pop("t0"))
+            GLib.idle_add(siguiente_refresco)
+        return resultado
+    m.GuadaStoreWindow.aplicar_estados = aplicar_estados
+
+    def al_dibujar(widget, cr):
+        if "primera_ventana" not in marcas:
+            marcas["primera_ventana"] = time.time() - inicio
+            quizas_empezar()
+        return False
+
+    win = m.GuadaStoreWindow()
+    win.connect("draw", al_dibujar)
+    win.connect("destroy", Gtk.main_quit)
+    win.show_all()
+    GLib.timeout_add_seconds(120, Gtk.main_quit)  # Red de seguridad si algo no llega
+    Gtk.main()
+    marcas["refrescos"] = refrescos
+    print(json.dumps(marcas))
+
+def cli(raiz, catalogo, argumentos):
+    redirigir(raiz)
+    import guadamint_tienda
+    with open(catalogo) as f: guadamint_tienda.CATALOGO = json.load(f)
+    guadamint_tienda.APT_GET = ["apt-get", "-y"]  # El de bench/stubs, por el PATH
+    guadamint_tienda.LOG_FILE = os.path.join(raiz, "tienda.log")
+    guadamint_tienda.TIEMPOS_FILE = os.path.join(raiz, "tienda-tiempos.jsonl")
+    os.geteuid = lambda: 0
+    codigo = guadamint_tienda.main_cli(argumentos)
+    if "gi" in sys.modules:
+        print("!!! El modo por línea de comandos ha cargado GTK", file=sys.stderr)
+        codigo = 3
+    sys.exit(codigo)
+
+def broker(raiz):
+    redirigir(raiz)
+    import guadamint_sesion
+    guadamint_sesion.servir_avisos()
+
+if __name__ == "__main__":
+    modo, raiz = sys.argv[1], sys.argv[2]
+    if modo == "actualizador": actualizador(raiz)
+    elif modo == "tienda": tienda(raiz, sys.argv[3], int(sys.argv[4]))
+    elif modo == "cli": cli(raiz, sys.argv[3], sys.argv[4:])
+    elif modo == "broker": broker(raiz)
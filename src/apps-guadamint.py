@@ -1,115 +1,52 @@
 #!/usr/bin/env python3
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, GLib, GdkPixbuf
-import subprocess
 import os
 import sys
+
+# Módulos compartidos de GuadaMint (guadamint_*.py): junto al script, instalados o en el repositorio
+for _ruta in ("/opt/guadamint/src", "/usr/lib/guadamint", os.path.dirname(os.path.realpath(__file__))):
+    if _ruta not in sys.path: sys.path.insert(0, _ruta)
+
+# Modo por línea de comandos (--install/--remove): se atiende antes de cargar GTK
+if __name__ == "__main__" and any(arg.split("=")[0] in ("--install", "--remove") for arg in sys.argv[1:]):
+    from guadamint_tienda import main_cli
+    sys.exit(main_cli())
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gdk, GLib, GdkPixbuf, Gio
 import threading
-import shutil
 import grp
-import time
-import datetime
+
+from guadamint_sync import REPO_DIR, sincronizar_repositorio
+from guadamint_despliegue import manifiesto_bloqueado, desplegar, expandir, retirar_obsoletos
+from guadamint_apt import DPKG_STATUS, firma_dpkg, paquetes_instalados, paquetes_disponibles, lanzar_precarga, nombre_proceso
+from guadamint_tienda import CATALOGO, LOG_FILE, TIEMPOS_FILE, ERROR_CANCELADO, log, aplicar_cambios
+from guadamint_sesion import enviar_aviso
+import guadamint_perfil
+from guadamint_perfil import fase
+from guadamint_log import configurar_log, cerrar_log
 
 # ==============================================================================
 # CONFIGURACIÓN
 # ==============================================================================
 ICONO_APP = "/usr/share/icons/guadamintuz.svg"
 TITULO_APP = "Centro de Software GuadaMint"
+SUBTITULO_APP = "Instalador de Software Escolar (Modo Admin)"
 
-# Configuración de Logs
-if os.geteuid() == 0:
-    LOG_FILE = "/var/log/guadamint/tienda.log"
-else:
-    LOG_FILE = f"/tmp/guadamint-tienda-{os.getuid()}.log"
-
-# Asegurar directorio de logs si somos root
-if os.geteuid() == 0 and not os.path.exists(os.path.dirname(LOG_FILE)):
-    try: os.makedirs(os.path.dirname(LOG_FILE))
-    except: pass
-
-# --- CATÁLOGO DE APLICACIONES ---
-CATALOGO = [
-    {
-        "categoria": "Educación Infantil y Primaria",
-        "apps": [
-            {"id": "gcompris-qt", "nombre": "GCompris", "desc": "Suite educativa (2-10 años)", "icono": "gcompris-qt"},
-            {"id": "tuxtype", "nombre": "Tux Typing", "desc": "Mecanografía infantil", "icono": "tuxtype"},
-            {"id": "tuxmath", "nombre": "Tux Math", "desc": "Matemáticas arcade", "icono": "tuxmath"},
-            {"id": "tuxpaint", "nombre": "Tux Paint", "desc": "Dibujo para niños", "icono": "tuxpaint"},
-            {"id": "kanagram", "nombre": "Kanagram", "desc": "Anagramas y vocabulario", "icono": "kanagram"},
-            {"id": "khangman", "nombre": "KHangMan", "desc": "Juego del ahorcado", "icono": "khangman"},
-        ]
-    },
-    {
-        "categoria": "Educación Secundaria y Bachillerato",
-        "apps": [
-            {"id": "geogebra", "nombre": "GeoGebra", "desc": "Matemáticas dinámicas", "icono": "geogebra"},
-            {"id": "stellarium", "nombre": "Stellarium", "desc": "Planetario virtual", "icono": "stellarium"},
-            {"id": "kalzium", "nombre": "Kalzium", "desc": "Tabla periódica", "icono": "kalzium"},
-            {"id": "step", "nombre": "Step", "desc": "Simulador físico", "icono": "step"},
-            {"id": "marble", "nombre": "Marble", "desc": "Globo terráqueo virtual", "icono": "marble"},
-            {"id": "kgeography", "nombre": "KGeography", "desc": "Geografía mundial", "icono": "kgeography"},
-            {"id": "kwordquiz", "nombre": "KWordQuiz", "desc": "Tarjetas de vocabulario", "icono": "kwordquiz"},
-            {"id": "celestia", "nombre": "Celestia", "desc": "Simulador espacial 3D", "icono": "celestia"},
-            {"id": "klavaro", "nombre": "Klavaro", "desc": "Curso de mecanografía", "icono": "klavaro"},
-            {"id": "gbrainy", "nombre": "GBrainy", "desc": "Juegos de lógica", "icono": "gbrainy"},
-        ]
-    },
-    {
-        "categoria": "Programación y Robótica",
-        "apps": [
-            {"id": "scratch", "nombre": "Scratch", "desc": "Programación visual", "icono": "scratch"},
-            {"id": "kturtle", "nombre": "KTurtle", "desc": "Programación Logo", "icono": "kturtle"},
-            {"id": "thonny", "nombre": "Thonny", "desc": "Python para principiantes", "icono": "thonny"},
-            {"id": "minetest", "nombre": "Minetest", "desc": "Mundo abierto (Minecraft libre)", "icono": "minetest"},
-            {"id": "fritzing", "nombre": "Fritzing", "desc": "Diseño de circuitos", "icono": "fritzing"},
-            {"id": "arduino", "nombre": "Arduino IDE", "desc": "Programación Arduino", "icono": "arduino"},
-        ]
-    },
-    {
-        "categoria": "Creatividad y Multimedia",
-        "apps": [
-            {"id": "audacity", "nombre": "Audacity", "desc": "Editor de audio", "icono": "audacity"},
-            {"id": "inkscape", "nombre": "Inkscape", "desc": "Diseño vectorial", "icono": "inkscape"},
-            {"id": "blender", "nombre": "Blender", "desc": "Animación 3D", "icono": "blender"},
-            {"id": "kdenlive", "nombre": "Kdenlive", "desc": "Editor de vídeo", "icono": "kdenlive"},
-            {"id": "obs-studio", "nombre": "OBS Studio", "desc": "Grabación de pantalla", "icono": "obs"},
-            {"id": "lmms", "nombre": "LMMS", "desc": "Producción musical", "icono": "lmms"},
-        ]
-    },
-    {
-        "categoria": "Utilidades y Navegadores",
-        "apps": [
-            {"id": "google-chrome-stable", "nombre": "Google Chrome", "desc": "Navegador oficial Google", "icono": "google-chrome", "script_install": "instalar_chrome.sh"},
-            {"id": "smart-product-drivers", "nombre": "Drivers SMART Board", "desc": "Controladores para pizarras", "icono": "video-display", "script_install": "instalar_smartboard.sh"},
-            {"id": "gnome-network-displays", "nombre": "Pantallas Wifi", "desc": "Proyección inalámbrica", "icono": "preferences-desktop-display"},
-            {"id": "vlc", "nombre": "VLC", "desc": "Reproductor multimedia", "icono": "vlc"},
-            {"id": "chromium-browser", "nombre": "Chromium", "desc": "Navegador libre", "icono": "chromium-browser"},
-        ]
-    }
-]
 
 # --- AUTO-UPDATE CONFIG ---
-REPO_DIR = "/opt/guadamint"
-REPO_URL = "https://github.com/aosucas499/guadamint.git"
-REPO_BRANCH = "main"
+# El repositorio y sus fuentes se definen en guadamint_sync.py (compartido con el actualizador)
 SCRIPT_SRC = os.path.join(REPO_DIR, "src/apps-guadamint.py")
 SCRIPT_BIN = "/usr/bin/apps-guadamint.py"
-RUTA_SCRIPTS_REPO = "/opt/guadamint/src/scripts"
+# Lo que la tienda despliega al actualizarse: el script y los módulos (el catálogo y las
+# transacciones están en guadamint_tienda.py). El actualizador despliega lo mismo al iniciar sesión.
+ARCHIVOS_TIENDA = [
+    {"origen": "src/apps-guadamint.py", "destino": SCRIPT_BIN, "modo": 0o755},
+    {"origen": "src/", "patron": "guadamint_*.py", "destino": "/usr/lib/guadamint/", "modo": 0o644},
+]
 
-# ==============================================================================
-# SISTEMA DE LOGS
-# ==============================================================================
-def log(msg):
-    try:
-        # Añadimos print para que se vea en la terminal si se lanza con Terminal=true
-        print(msg)
-        
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(LOG_FILE, "a") as f:
-            f.write(f"[{timestamp}] {msg}\n")
-    except: pass
+# --- ESTADO DE PAQUETES ---
+INTERVALO_SONDEO_DPKG = 5  # Segundos entre comprobaciones si no hay monitor de ficheros
 
 # ==============================================================================
 # SEGURIDAD Y PERMISOS
@@ -138,39 +75,41 @@ def elevar_a_root():
                 f'XAUTHORITY={env.get("XAUTHORITY", "")}', 
                 sys.executable] + sys.argv
         try:
+            cerrar_log()
             os.execvpe('pkexec', args, env)
         except Exception as e:
             log(f"Error elevación: {e}")
             sys.exit(1)
 
-def hay_bloqueo_apt():
-    locks = ["/var/lib/dpkg/lock-frontend", "/var/lib/dpkg/lock"]
-    for lock in locks:
-        if subprocess.run(["fuser", lock], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
-            return True
-    return False
-
 # ==============================================================================
 # AUTO-UPDATE
 # ==============================================================================
-def auto_update():
-    if not os.access(SCRIPT_BIN, os.W_OK): return
+def auto_update(progreso=lambda mensaje: None):
+    """
+    Sincroniza el repositorio y actualiza el script y los módulos instalados. Se ejecuta en segundo plano:
+    devuelve True si se ha instalado una versión nueva (el reinicio lo decide la ventana).
+    """
+    if not os.access(SCRIPT_BIN, os.W_OK): return False
     try:
-        if not os.path.exists(REPO_DIR):
-            subprocess.run(["git", "clone", "-b", REPO_BRANCH, REPO_URL, REPO_DIR], check=True)
-        else:
-            os.chdir(REPO_DIR)
-            subprocess.run(["git", "fetch", "origin"], check=True, stderr=subprocess.DEVNULL)
-            subprocess.run(["git", "reset", "--hard", f"origin/{REPO_BRANCH}"], check=True, stderr=subprocess.DEVNULL)
+        progreso("Buscando actualizaciones...")
+        # Si el actualizador está sincronizando, se espera a que acabe y se reutiliza su resultado
+        sync = sincronizar_repositorio(log=log, al_esperar=lambda: progreso("Esperando a la actualización en curso..."))
+        if not sync["ok"]: return False
         
         if os.path.exists(SCRIPT_SRC) and os.path.realpath(__file__) != os.path.realpath(SCRIPT_SRC):
-            with open(SCRIPT_SRC, 'rb') as f1, open(SCRIPT_BIN, 'rb') as f2:
-                if f1.read() != f2.read():
-                    log("Actualizando script de la tienda...")
-                    shutil.copy2(SCRIPT_SRC, SCRIPT_BIN)
-                    os.chmod(SCRIPT_BIN, 0o755)
-                    os.execv(sys.executable, [sys.executable] + sys.argv)
-    except: pass
+            actualizada = False
+            with manifiesto_bloqueado() as manifiesto:
+                for entrada, origen, destino in expandir(ARCHIVOS_TIENDA, REPO_DIR):
+                    if desplegar(os.path.join(REPO_DIR, origen), destino, entrada["modo"], manifiesto):
+                        log(f"Tienda actualizada: {destino}")
+                        actualizada = True
+                for destino in retirar_obsoletos(ARCHIVOS_TIENDA, REPO_DIR, manifiesto, log):
+                    log(f"Tienda: retirado {destino}")
+                    actualizada = True
+            return actualizada
+    except Exception as e:
+        log(f"Error en auto-actualización: {e}")
+    return False
 
 # ==============================================================================
 # INTERFAZ GRÁFICA
@@ -181,6 +120,8 @@ class FilaApp(Gtk.ListBoxRow):
         self.app_data = app_data
         self.ventana_padre = ventana_padre
         self.pkg_name = app_data["id"]
+        self.ocupada = False  # True mientras hay una operación APT en curso para esta fila
+        self.no_disponible = False  # Ningún repositorio configurado tiene el paquete
 
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
         box.set_border_width(10)
@@ -203,8 +144,12 @@ class FilaApp(Gtk.ListBoxRow):
         lbl_desc.get_style_context().add_class("dim-label")
         lbl_desc.set_max_width_chars(40)
         lbl_desc.set_line_wrap(True)
+        self.lbl_info = Gtk.Label(xalign=0)
+        self.lbl_info.get_style_context().add_class("dim-label")
+        self.lbl_info.set_no_show_all(True)
         vbox_text.pack_start(lbl_name, True, True, 0)
         vbox_text.pack_start(lbl_desc, True, True, 0)
+        vbox_text.pack_start(self.lbl_info, True, True, 0)
         box.pack_start(vbox_text, True, True, 0)
 
         self.switch = Gtk.Switch()
@@ -212,24 +157,14 @@ class FilaApp(Gtk.ListBoxRow):
         self.handler_id = self.switch.connect("state-set", self.on_switch_activated)
         
         self.spinner = Gtk.Spinner()
+        self.lbl_pendiente = Gtk.Label(xalign=1)
+        self.lbl_pendiente.get_style_context().add_class("dim-label")
         
         box.pack_end(self.switch, False, False, 0)
         box.pack_end(self.spinner, False, False, 10)
+        box.pack_end(self.lbl_pendiente, False, False, 0)
         
         self.add(box)
-        threading.Thread(target=self.check_installed).start()
-
-    def check_installed(self):
-        try:
-            res = subprocess.run(
-                ["dpkg-query", "-W", "--showformat=${Status}", self.pkg_name], 
-                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
-            )
-            is_installed = "install ok installed" in res.stdout
-        except:
-            is_installed = False
-            
-        GLib.idle_add(self.update_switch_state, is_installed)
 
     def update_switch_state(self, state):
         self.switch.handler_block(self.handler_id)
@@ -237,110 +172,40 @@ class FilaApp(Gtk.ListBoxRow):
         self.switch.handler_unblock(self.handler_id)
         return False
 
+    def mostrar_disponibilidad(self, info, instalado):
+        """info: {"version", "tamano"} del repositorio, o None si no hay ninguno que lo tenga.
+        Una app instalada nunca se bloquea: aunque ya no esté en los repositorios se puede quitar."""
+        self.no_disponible = info is None and not instalado
+        self.set_sensitive(not self.no_disponible)
+        if info: texto = f"Versión {info['version'] or 'desconocida'} · {GLib.format_size(info['tamano'])}"
+        elif self.no_disponible: texto = "No disponible en los repositorios configurados"
+        else: texto = ""
+        self.lbl_info.set_text(texto)
+        self.lbl_info.set_visible(bool(texto))
+
     def on_switch_activated(self, switch, state):
-        self.switch.set_sensitive(False)
-        self.spinner.start()
-        
-        if hay_bloqueo_apt():
-            self.mostrar_error("Sistema ocupado (APT bloqueado).\nInténtalo en un minuto.")
-            self.spinner.stop()
-            self.switch.set_sensitive(True)
-            self.switch.handler_block(self.handler_id)
-            self.switch.set_active(not state)
-            self.switch.handler_unblock(self.handler_id)
-            return True 
-
-        # Cambiar el estado visualmente al instante para dar feedback al usuario
+        if self.ocupada: return True
+        # El cambio no se ejecuta aún: queda en la cola de la ventana hasta pulsar "Aplicar"
         self.switch.set_state(state)
-
-        action = "install" if state else "remove"
-        threading.Thread(target=self.run_apt_action, args=(action,)).start()
+        self.ventana_padre.marcar_cambio(self, state)
         return True
 
-    def mostrar_error(self, mensaje):
-        dialog = Gtk.MessageDialog(parent=self.ventana_padre, flags=Gtk.DialogFlags.MODAL, message_type=Gtk.MessageType.ERROR, buttons=Gtk.ButtonsType.OK, text="Aviso")
-        dialog.format_secondary_text(mensaje)
-        dialog.run()
-        dialog.destroy()
+    def marcar_pendiente(self, accion):
+        if accion == "install": self.lbl_pendiente.set_text("Se instalará")
+        elif accion == "remove": self.lbl_pendiente.set_text("Se desinstalará")
+        else: self.lbl_pendiente.set_text("")
 
-    def run_apt_action(self, action):
-        log(f"Iniciando acción: {action} {self.pkg_name}")
-        error_msg = ""
-        success = False
-        cmd = []
-        
-        if action == "install" and "script_install" in self.app_data:
-            nombre_script = self.app_data["script_install"]
-            ruta_script = os.path.join(RUTA_SCRIPTS_REPO, nombre_script)
-            if os.path.exists(ruta_script):
-                os.chmod(ruta_script, 0o755)
-                cmd = ["/bin/bash", ruta_script]
-            else:
-                error_msg = f"Script no encontrado: {ruta_script}"
-        else:
-            cmd = ["env", "DEBIAN_FRONTEND=noninteractive", "/usr/bin/apt-get", action, "-y", "-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold", self.pkg_name]
-
-        if cmd:
-            try:
-                process = subprocess.Popen(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.STDOUT, 
-                    text=True
-                )
-                
-                full_log = ""
-                for line in process.stdout:
-                    log(f"[APT] {line.strip()}")
-                    full_log += line
-                
-                process.wait()
-                
-                if process.returncode == 0:
-                    success = True
-                    log("Comando APT completado con éxito.")
-                else:
-                    log(f"Error (Código {process.returncode})")
-                    if "Unable to locate" in full_log: error_msg = f"Paquete no encontrado."
-                    elif "lock" in full_log: error_msg = "Bloqueo APT."
-                    else: error_msg = "Error en la ejecución. Ver logs."
-            except Exception as e:
-                log(f"Excepción Python: {e}")
-                error_msg = str(e)
-
-        # Validación final real con dpkg-query para evitar falsos positivos
-        try:
-            res = subprocess.run(
-                ["dpkg-query", "-W", "--showformat=${Status}", self.pkg_name], 
-                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
-            )
-            actual_state = "install ok installed" in res.stdout
-        except:
-            actual_state = False
-            
-        intended = (action == "install")
-        if success and (actual_state != intended):
-            log(f"AVISO: apt-get terminó bien, pero {self.pkg_name} no quedó en estado {action}. Revirtiendo.")
-            success = False
-            if not error_msg: error_msg = "El paquete no se instaló/desinstaló correctamente."
-
-        GLib.idle_add(self.finish_action, success, intended, error_msg)
+    def iniciar_operacion(self):
+        self.ocupada = True
+        self.marcar_pendiente(None)
+        self.switch.set_sensitive(False)
+        self.spinner.start()
 
-    def finish_action(self, success, intended_state, error_msg=""):
+    def finish_action(self, success, intended_state):
+        self.ocupada = False
         self.spinner.stop()
         self.switch.set_sensitive(True)
-        
-        if success:
-            user = os.environ.get('SUDO_USER', os.environ.get('USER'))
-            subprocess.Popen(['sudo', '-u', user, 'notify-send', '-i', 'system-software-update', 'GuadaMint Store', f'Operación completada: {self.app_data["nombre"]}'])
-        else:
-            self.switch.handler_block(self.handler_id)
-            self.switch.set_active(not intended_state)
-            self.switch.handler_unblock(self.handler_id)
-            
-            if error_msg: self.mostrar_error(error_msg)
-            else: self.mostrar_error("Operación fallida. Revise los logs.")
-        
+        if not success: self.update_switch_state(not intended_state)
         return False
 
 class GuadaStoreWindow(Gtk.Window):
@@ -353,8 +218,9 @@ class GuadaStoreWindow(Gtk.Window):
         header = Gtk.HeaderBar()
         header.set_show_close_button(True)
         header.set_title(TITULO_APP)
-        header.set_subtitle("Instalador de Software Escolar (Modo Admin)")
+        header.set_subtitle(SUBTITULO_APP)
         self.set_titlebar(header)
+        self.header = header
         
         btn_refresh = Gtk.Button()
         icon_refresh = Gtk.Image.new_from_icon_name("view-refresh-symbolic", Gtk.IconSize.BUTTON)
@@ -362,6 +228,34 @@ class GuadaStoreWindow(Gtk.Window):
         btn_refresh.connect("clicked", self.refresh_all)
         header.pack_start(btn_refresh)
 
+        self.btn_reiniciar = Gtk.Button(label="Reiniciar")
+        self.btn_reiniciar.set_tooltip_text("Hay una versión nueva de la tienda")
+        self.btn_reiniciar.set_no_show_all(True)
+        self.btn_reiniciar.connect("clicked", self.on_reiniciar)
+        header.pack_start(self.btn_reiniciar)
+        self.reinicio_solicitado = False
+
+        self.btn_aplicar = Gtk.Button(label="Aplicar")
+        self.btn_aplicar.get_style_context().add_class("suggested-action")
+        self.btn_aplicar.set_sensitive(False)
+        self.btn_aplicar.connect("clicked", self.on_aplicar)
+        header.pack_end(self.btn_aplicar)
+
+        self.btn_descartar = Gtk.Button()
+        self.btn_descartar.add(Gtk.Image.new_from_icon_name("edit-undo-symbolic", Gtk.IconSize.BUTTON))
+        self.btn_descartar.set_tooltip_text("Descartar cambios pendientes")
+        self.btn_descartar.set_sensitive(False)
+        self.btn_descartar.connect("clicked", self.on_descartar)
+        header.pack_end(self.btn_descartar)
+
+        # Solo visible mientras los cambios esperan a que otro proceso suelte APT
+        self.btn_cancelar_espera = Gtk.Button(label="Cancelar")
+        self.btn_cancelar_espera.set_tooltip_text("Dejar de esperar a APT y descartar los cambios en cola")
+        self.btn_cancelar_espera.set_no_show_all(True)
+        self.btn_cancelar_espera.connect("clicked", self.on_cancelar_espera)
+        header.pack_end(self.btn_cancelar_espera)
+        self.espera_cancelada = threading.Event()
+
         scrolled = Gtk.ScrolledWindow()
         scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         self.add(scrolled)
@@ -371,6 +265,14 @@ class GuadaStoreWindow(Gtk.Window):
         scrolled.add(self.main_box)
 
         self.rows = []
+        self.pendientes = {}  # FilaApp -> "install" | "remove"
+        self.transaccion_en_curso = False
+        self.cola_cambios = []  # Lotes aplicados mientras otra transacción está en marcha o esperando a APT
+        self.instalados = None
+        self.disponibles = None  # None hasta leer los índices de APT (o si no hay índices)
+        self.revision_en_curso = False
+        self.revision_pendiente = False
+        self.revision_programada = False
         for seccion in CATALOGO:
             lbl_sec = Gtk.Label(label=seccion["categoria"], xalign=0)
             lbl_sec.get_style_context().add_class("h3")
@@ -389,11 +291,256 @@ class GuadaStoreWindow(Gtk.Window):
             
             self.main_box.pack_start(listbox, False, False, 0)
 
+        self.refresh_all(None)
+        self.vigilar_dpkg()
+
     def refresh_all(self, widget):
+        # Un único hilo lee el índice de dpkg y actualiza todas las filas de golpe
+        threading.Thread(target=self.check_installed, args=(True,), daemon=True).start()
+
+    def check_installed(self, completo=False):
+        instalados = paquetes_instalados()
+        GLib.idle_add(self.aplicar_estados, instalados, completo)
+        if completo:
+            # Después del estado de dpkg, para no retrasar los interruptores la primera vez
+            paquetes = [row.pkg_name for row in self.rows if "script_install" not in row.app_data]
+            GLib.idle_add(self.aplicar_disponibilidad, paquetes_disponibles(paquetes))
+
+    def aplicar_estados(self, instalados, completo=False):
+        if completo or self.instalados is None:
+            cambiados = None
+        else:
+            cambiados = self.instalados ^ instalados
+        self.instalados = instalados
         for row in self.rows:
-            threading.Thread(target=row.check_installed).start()
+            if row.ocupada: continue
+            if row in self.pendientes:
+                # Respetamos lo que el usuario ha marcado salvo que ya se haya cumplido por otra vía
+                if (self.pendientes[row] == "install") == (row.pkg_name in instalados):
+                    del self.pendientes[row]
+                    row.marcar_pendiente(None)
+                continue
+            if cambiados is None or row.pkg_name in cambiados:
+                row.update_switch_state(row.pkg_name in instalados)
+        if self.disponibles is not None: self.aplicar_disponibilidad(self.disponibles)
+        self.actualizar_botones()
+        return False
+
+    def aplicar_disponibilidad(self, disponibles):
+        if disponibles is None: return False
+        self.disponibles = disponibles
+        for row in self.rows:
+            if "script_install" in row.app_data: continue
+            row.mostrar_disponibilidad(disponibles.get(row.pkg_name), self.instalados is not None and row.pkg_name in self.instalados)
+            # Lo marcado antes de conocer la disponibilidad no debe llegar a apt-get
+            if row.no_disponible and self.pendientes.get(row) == "install":
+                del self.pendientes[row]
+                row.marcar_pendiente(None)
+                row.update_switch_state(False)
+        self.actualizar_botones()
+        return False
+
+    # --- Cola de cambios pendientes ---
+    def marcar_cambio(self, row, state):
+        instalado = self.instalados is not None and row.pkg_name in self.instalados
+        if state == instalado:
+            self.pendientes.pop(row, None)
+            row.marcar_pendiente(None)
+        else:
+            self.pendientes[row] = "install" if state else "remove"
+            row.marcar_pendiente(self.pendientes[row])
+        self.actualizar_botones()
+
+    def actualizar_botones(self):
+        n = len(self.pendientes)
+        self.btn_aplicar.set_label(f"Aplicar ({n})" if n else "Aplicar")
+        self.btn_aplicar.set_sensitive(n > 0)
+        self.btn_descartar.set_sensitive(n > 0)
+
+    def on_descartar(self, widget):
+        for row in list(self.pendientes):
+            row.marcar_pendiente(None)
+            row.update_switch_state(self.instalados is not None and row.pkg_name in self.instalados)
+        self.pendientes.clear()
+        self.actualizar_botones()
+
+    def on_aplicar(self, widget):
+        if not self.pendientes: return
+        cambios = list(self.pendientes.items())
+        self.pendientes.clear()
+        for row, accion in cambios: row.iniciar_operacion()
+        # Con una transacción en marcha los cambios esperan su turno en la cola
+        self.cola_cambios.append(cambios)
+        if not self.transaccion_en_curso: self.siguiente_transaccion()
+        self.actualizar_botones()
+
+    def siguiente_transaccion(self):
+        self.transaccion_en_curso = True
+        self.espera_cancelada.clear()
+        threading.Thread(target=self.run_apt_action, args=(self.cola_cambios.pop(0),), daemon=True).start()
+
+    def run_apt_action(self, cambios):
+        # Si otro proceso (el actualizador, unattended-upgrades...) tiene APT, los cambios
+        # esperan en cola y se aplican solos cuando lo suelte
+        avisados = set()
+        def al_esperar(pid):
+            if pid in avisados: return
+            avisados.add(pid)
+            log(f"APT ocupado por {nombre_proceso(pid)} (PID {pid}): esperando para aplicar los cambios.")
+            GLib.idle_add(self.header.set_subtitle, f"Esperando a que termine {nombre_proceso(pid)}...")
+            GLib.idle_add(self.mostrar_cancelar_espera, True)
+        def al_empezar():
+            # Una vez en marcha, la transacción ya no se puede cancelar
+            if not avisados: return
+            GLib.idle_add(self.header.set_subtitle, SUBTITULO_APP)
+            GLib.idle_add(self.mostrar_cancelar_espera, False)
+        resultados = aplicar_cambios([(row.app_data, accion) for row, accion in cambios], al_esperar,
+                                     self.espera_cancelada, al_empezar)
+        if avisados:
+            GLib.idle_add(self.header.set_subtitle, SUBTITULO_APP)
+            GLib.idle_add(self.mostrar_cancelar_espera, False)
+        GLib.idle_add(self.finish_action, cambios, resultados)
+
+    def mostrar_cancelar_espera(self, visible):
+        self.btn_cancelar_espera.set_sensitive(True)
+        self.btn_cancelar_espera.set_visible(visible)
+        return False
+
+    def on_cancelar_espera(self, widget):
+        # La espera de run_apt_action lo ve enseguida; finish_action descarta además la cola
+        self.btn_cancelar_espera.set_sensitive(False)
+        self.espera_cancelada.set()
+
+    def finish_action(self, cambios, resultados):
+        self.transaccion_en_curso = False
+        if any(error == ERROR_CANCELADO for exito, error in resultados.values()):
+            # Lo que esperaba detrás tendría que volver a esperar al mismo proceso: se descarta también
+            for lote in self.cola_cambios:
+                for row, accion in lote: resultados[row.pkg_name] = (False, ERROR_CANCELADO)
+                cambios = cambios + lote
+            self.cola_cambios.clear()
+            log("Cambios cancelados mientras esperaban a APT.")
+        if self.cola_cambios: self.siguiente_transaccion()
+        fallidas, avisos = [], []
+        for row, accion in cambios:
+            exito, error_msg = resultados[row.pkg_name]
+            row.finish_action(exito, accion == "install")
+            nombre = row.app_data["nombre"]
+            if error_msg == ERROR_CANCELADO: continue  # Lo ha pedido el usuario: no es un error que mostrar
+            if not exito: fallidas.append(f"{nombre}: {error_msg}")
+            elif accion == "install": avisos.append((f"Instalada: {nombre}", "tienda-instaladas", nombre, "{n} apps instaladas"))
+            else: avisos.append((f"Desinstalada: {nombre}", "tienda-desinstaladas", nombre, "{n} apps desinstaladas"))
+        self.actualizar_botones()
+
+        # El broker de la sesión agrupa los avisos; se envían fuera del hilo de la interfaz
+        def notificar():
+            for mensaje, grupo, elemento, resumen in avisos:
+                with fase("aviso"):
+                    enviar_aviso('GuadaMint Store', mensaje, 'system-software-update', app='GuadaMint Store',
+                                 grupo=grupo, elemento=elemento, resumen=resumen)
+        hilo_avisos = threading.Thread(target=notificar, daemon=True) if avisos else None
+        if hilo_avisos: hilo_avisos.start()
+
+        if fallidas:
+            self.mostrar_error("\n".join(fallidas))
+        # El reinicio pedido durante la transacción va al final: mostrar_error ya ha vuelto
+        # (el usuario ha cerrado el diálogo) y solo queda esperar a que salgan los avisos
+        if self.reinicio_solicitado and not self.transaccion_en_curso:
+            def reiniciar_tras_avisos():
+                if hilo_avisos: hilo_avisos.join()
+                GLib.idle_add(self.reiniciar)
+            threading.Thread(target=reiniciar_tras_avisos, daemon=True).start()
+        return False
+
+    # --- Auto-actualización en segundo plano ---
+    def iniciar_auto_update(self):
+        threading.Thread(target=self.ejecutar_auto_update, daemon=True).start()
+
+    def ejecutar_auto_update(self):
+        progreso = lambda mensaje: GLib.idle_add(self.header.set_subtitle, mensaje)
+        hay_version_nueva = auto_update(progreso)
+        GLib.idle_add(self.fin_auto_update, hay_version_nueva)
+
+    def fin_auto_update(self, hay_version_nueva):
+        if hay_version_nueva:
+            self.header.set_subtitle("Nueva versión instalada: reinicie la tienda para usarla")
+            self.btn_reiniciar.show()
+        else:
+            self.header.set_subtitle(SUBTITULO_APP)
+        return False
+
+    def on_reiniciar(self, widget):
+        # Si hay una transacción en marcha, el reinicio se aplaza hasta que termine
+        if self.transaccion_en_curso:
+            self.reinicio_solicitado = True
+            self.btn_reiniciar.set_sensitive(False)
+            self.header.set_subtitle("Se reiniciará al terminar la operación en curso")
+        else:
+            self.reiniciar()
+
+    def reiniciar(self):
+        # Si mientras tanto ha empezado otra transacción, su finish_action volverá a pedirlo
+        if self.transaccion_en_curso: return False
+        log("Reiniciando la tienda con la versión nueva...")
+        cerrar_log()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def mostrar_error(self, mensaje):
+        dialog = Gtk.MessageDialog(parent=self, flags=Gtk.DialogFlags.MODAL, message_type=Gtk.MessageType.ERROR, buttons=Gtk.ButtonsType.OK, text="Aviso")
+        dialog.format_secondary_text(mensaje)
+        dialog.run()
+        dialog.destroy()
+
+    # --- Vigilancia de /var/lib/dpkg/status ---
+    def vigilar_dpkg(self):
+        """Detecta instalaciones hechas fuera de la tienda (actualizador, terminal...)."""
+        self.monitor_dpkg = None
+        try:
+            self.monitor_dpkg = Gio.File.new_for_path(DPKG_STATUS).monitor_file(Gio.FileMonitorFlags.NONE, None)
+            self.monitor_dpkg.connect("changed", lambda *args: self.programar_revision())
+        except Exception as e:
+            log(f"Sin monitor de ficheros para dpkg ({e}), se usará sondeo.")
+            try: self.firma_vigilada = firma_dpkg()
+            except: self.firma_vigilada = None
+            GLib.timeout_add_seconds(INTERVALO_SONDEO_DPKG, self.sondear_dpkg)
+
+    def sondear_dpkg(self):
+        try: firma = firma_dpkg()
+        except: firma = None
+        if firma != self.firma_vigilada:
+            self.firma_vigilada = firma
+            self.programar_revision()
+        return True
+
+    def programar_revision(self):
+        # dpkg escribe el fichero varias veces seguidas: agrupamos los eventos
+        if not self.revision_programada:
+            self.revision_programada = True
+            GLib.timeout_add(800, self.lanzar_revision)
+
+    def lanzar_revision(self):
+        self.revision_programada = False
+        if self.revision_en_curso:
+            self.revision_pendiente = True
+        else:
+            self.revision_en_curso = True
+            threading.Thread(target=self.revisar_cambios, daemon=True).start()
+        return False
+
+    def revisar_cambios(self):
+        instalados = paquetes_instalados()
+        GLib.idle_add(self.fin_revision, instalados)
+
+    def fin_revision(self, instalados):
+        self.aplicar_estados(instalados)
+        self.revision_en_curso = False
+        if self.revision_pendiente:
+            self.revision_pendiente = False
+            self.lanzar_revision()
+        return False
 
 def main():
+    configurar_log(LOG_FILE, "[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
     if not es_administrador():
         dialog = Gtk.MessageDialog(parent=None, flags=Gtk.DialogFlags.MODAL, message_type=Gtk.MessageType.ERROR, buttons=Gtk.ButtonsType.OK, text="Acceso Restringido")
         dialog.format_secondary_text("Esta aplicación es solo para administradores.\n\nContacte con su administrador/a TDE para instalar aplicaciones.")
@@ -404,12 +551,16 @@ def main():
         sys.exit(0)
 
     elevar_a_root()
-    try: auto_update()
-    except: pass
+    guadamint_perfil.iniciar("tienda", TIEMPOS_FILE)
     
     win = GuadaStoreWindow()
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
+    # La auto-actualización va en segundo plano: la ventana no espera a la red
+    win.iniciar_auto_update()
+    # Descarga anticipada de los paquetes de [precarga] mientras la tienda está abierta
+    try: lanzar_precarga()
+    except OSError as e: log(f"No se pudo lanzar la precarga: {e}")
     Gtk.main()
 
 if __name__ == "__main__":
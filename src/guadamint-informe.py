@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Informe de tiempos de toda un aula o centro a partir de los registros recogidos de cada equipo.
+
+Lee los archivos *-tiempos.jsonl (también rotados o comprimidos con gzip) que escriben el
+actualizador y la tienda, de uno o varios directorios, y muestra percentiles por fase.
+Señala además los equipos cuyo tiempo de actualización al iniciar sesión o cuya tasa
+de fallos de apt se salen de lo normal en el conjunto. Cuando el actualizador se reinicia
+a sí mismo, las dos ejecuciones cuentan como un único inicio de sesión.
+
+Los archivos se procesan línea a línea y los tiempos se acumulan en histogramas de
+tamaño fijo, así que meses de registros no ocupan más memoria que unos días.
+
+Uso:
+    guadamint-informe.py /srv/registros/aula1 /srv/registros/aula2
+    guadamint-informe.py --json /srv/registros > informe.json
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+
+# Histograma logarítmico: de 1 ms a ~3 horas con un 5% de error relativo como mucho
+MINIMO = 0.001
+FACTOR = 1.1
+NUM_CUBETAS = 170
+PERCENTILES = (50, 90, 95, 99)
+# Un equipo es atípico si su mediana se aleja más de UMBRAL_MAD desviaciones (MAD) de la del conjunto
+UMBRAL_MAD = 3.5
+MIN_MUESTRAS = 3
+
+# ==============================================================================
+# ACUMULADORES
+# ==============================================================================
+class Histograma:
+    """Cuenta duraciones en cubetas de crecimiento geométrico para estimar percentiles."""
+    def __init__(self):
+        self.cubetas = [0] * NUM_CUBETAS
+        self.total = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def anadir(self, valor):
+        indice = 0 if valor <= MINIMO else min(NUM_CUBETAS - 1, int(math.log(valor / MINIMO, FACTOR)) + 1)
+        self.cubetas[indice] += 1
+        self.total += 1
+        self.suma += valor
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p):
+        if not self.total: return None
+        objetivo = math.ceil(self.total * p / 100)
+        acumulado = 0
+        for indice, cuenta in enumerate(self.cubetas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                # Punto medio geométrico de la cubeta, sin pasar del máximo visto
+                if indice == 0: return min(MINIMO, self.maximo)
+                return min(MINIMO * FACTOR ** (indice - 0.5), self.maximo)
+        return self.maximo
+
+    def resumen(self):
+        datos = {"n": self.total, "media": self.suma / self.total if self.total else None, "max": self.maximo}
+        datos.update({f"p{p}": self.percentil(p) for p in PERCENTILES})
+        return datos
+
+class Equipo:
+    def __init__(self):
+        self.login = Histograma()
+        self.apt_total = 0
+        self.apt_fallos = 0
+
+# ==============================================================================
+# LECTURA
+# ==============================================================================
+def buscar_archivos(rutas):
+    for ruta in rutas:
+        if os.path.isfile(ruta):
+            yield ruta
+            continue
+        for directorio, subdirs, archivos in os.walk(ruta):
+            subdirs.sort()
+            for nombre in sorted(archivos):
+                if "-tiempos.jsonl" in nombre: yield os.path.join(directorio, nombre)
+
+def leer_registros(ruta, errores):
+    """Registros de un archivo, de uno en uno. El equipo por defecto es el directorio que lo contiene."""
+    equipo_defecto = os.path.basename(os.path.dirname(os.path.abspath(ruta)))
+    abrir = gzip.open if ruta.endswith(".gz") else open
+    try:
+        with abrir(ruta, "rt", encoding="utf-8", errors="replace") as f:
+            for linea in f:
+                try: registro = json.loads(linea)
+                except ValueError:
+                    errores["lineas"] += 1  # Líneas cortadas por un apagado a mitad de escritura
+                    continue
+                if not isinstance(registro, dict) or "fase" not in registro or "duracion" not in registro:
+                    errores["lineas"] += 1
+                    continue
+                try: registro["duracion"] = float(registro["duracion"])
+                except (TypeError, ValueError):
+                    errores["lineas"] += 1  # Duración nula o no numérica: también de una escritura a medias
+                    continue
+                if not math.isfinite(registro["duracion"]):
+                    errores["lineas"] += 1
+                    continue
+                registro.setdefault("equipo", equipo_defecto)
+                yield registro
+    except OSError as e:
+        print(f"!!! No se puede leer {ruta}: {e}", file=sys.stderr)
+        errores["archivos"] += 1
+
+def _unir_reinicio(pendientes, registro):
+    """Un inicio de sesión en que el actualizador se reinicia deja dos registros "total" con la
+    misma ejecución: el de antes del exec (reinicia) y el de después (reinicio). Devuelve el
+    registro con las dos partes sumadas, o None mientras falte la otra mitad."""
+    if not (registro.get("reinicia") or registro.get("reinicio")): return registro
+    clave = (registro["equipo"], registro.get("ejecucion"))
+    otra = pendientes.pop(clave, None)
+    if otra is None:
+        pendientes[clave] = registro
+        return None
+    return dict(registro, duracion=registro["duracion"] + otra["duracion"],
+                ok=registro.get("ok") is not False and otra.get("ok") is not False)
+
+def _anadir(fases, equipos, registro):
+    clave = (registro.get("programa") or "?", registro["fase"])
+    fase = fases.get(clave)
+    if fase is None: fase = fases[clave] = {"hist": Histograma(), "fallos": 0}
+    fase["hist"].anadir(registro["duracion"])
+    if registro.get("ok") is False: fase["fallos"] += 1
+
+    equipo = equipos.get(registro["equipo"])
+    if equipo is None: equipo = equipos[registro["equipo"]] = Equipo()
+    if clave == ("actualizador", "total"):
+        equipo.login.anadir(registro["duracion"])
+    elif registro["fase"] == "apt.install":
+        equipo.apt_total += 1
+        if registro.get("ok") is False: equipo.apt_fallos += 1
+
+def agregar(rutas):
+    fases, equipos = {}, {}
+    errores = {"lineas": 0, "archivos": 0}
+    # Mitades de inicios de sesión con reinicio a la espera de la otra (solo esas se guardan)
+    pendientes = {}
+    for ruta in buscar_archivos(rutas):
+        for registro in leer_registros(ruta, errores):
+            if (registro.get("programa"), registro["fase"]) == ("actualizador", "total"):
+                registro = _unir_reinicio(pendientes, registro)
+                if registro is None: continue
+            _anadir(fases, equipos, registro)
+    # Sin pareja (reinicio fallido o la otra mitad ya rotada): cuentan por separado
+    for registro in pendientes.values(): _anadir(fases, equipos, registro)
+    return fases, equipos, errores
+
+# ==============================================================================
+# EQUIPOS ATÍPICOS
+# ==============================================================================
+def _mediana(valores):
+    valores = sorted(valores)
+    mitad = len(valores) // 2
+    return valores[mitad] if len(valores) % 2 else (valores[mitad - 1] + valores[mitad]) / 2
+
+def equipos_atipicos(equipos):
+    """Lista de (equipo, motivo). Tiempo: desviación robusta (MAD) sobre las medianas de cada
+    equipo. Fallos de apt: tasa por encima de la global más tres desviaciones binomiales."""
+    atipicos = []
+    medianas = {nombre: e.login.percentil(50) for nombre, e in equipos.items() if e.login.total >= MIN_MUESTRAS}
+    if len(medianas) >= MIN_MUESTRAS:
+        centro = _mediana(medianas.values())
+        mad = 1.4826 * _mediana([abs(v - centro) for v in medianas.values()]) or centro * 0.1 or MINIMO
+        for nombre, valor in sorted(medianas.items()):
+            if (valor - centro) / mad > UMBRAL_MAD:
+                atipicos.append((nombre, f"actualización al iniciar sesión: mediana {valor:.1f}s (centro: {centro:.1f}s)"))
+
+    total = sum(e.apt_total for e in equipos.values())
+    fallos = sum(e.apt_fallos for e in equipos.values())
+    if total:
+        tasa = fallos / total
+        for nombre, e in sorted(equipos.items()):
+            if e.apt_fallos < 2: continue
+            limite = tasa + 3 * math.sqrt(max(tasa * (1 - tasa), 1e-6) / e.apt_total)
+            if e.apt_fallos / e.apt_total > limite:
+                atipicos.append((nombre, f"fallos de apt: {e.apt_fallos}/{e.apt_total} (global: {tasa:.0%})"))
+    return atipicos
+
+# ==============================================================================
+# SALIDA
+# ==============================================================================
+def _segundos(valor):
+    return "-" if valor is None else f"{valor:.3f}"
+
+def imprimir_informe(fases, equipos, atipicos, errores):
+    for programa in sorted({programa for programa, _ in fases}):
+        print(f"=== {programa.upper()} ===")
+        print(f"{'FASE':<22} {'N':>7} {'FALLOS':>6} " + " ".join(f"{'P' + str(p):>8}" for p in PERCENTILES) + f" {'MÁX':>9}")
+        filas = [(fase, datos) for (prog, fase), datos in fases.items() if prog == programa]
+        for fase, datos in sorted(filas, key=lambda fila: -fila[1]["hist"].suma):
+            h = datos["hist"]
+            print(f"{fase:<22} {h.total:>7} {datos['fallos']:>6} "
+                  + " ".join(f"{_segundos(h.percentil(p)):>8}" for p in PERCENTILES) + f" {_segundos(h.maximo):>9}")
+        print()
+    print(f"Equipos analizados: {len(equipos)}")
+    if atipicos:
+        print("Equipos atípicos:")
+        for nombre, motivo in atipicos: print(f"  - {nombre}: {motivo}")
+    else:
+        print("No se han detectado equipos atípicos.")
+    if errores["lineas"] or errores["archivos"]:
+        print(f"(Se han ignorado {errores['lineas']} líneas no válidas y {errores['archivos']} archivos ilegibles)")
+
+def informe_json(fases, equipos, atipicos, errores):
+    return {
+        "fases": [dict(programa=programa, fase=fase, fallos=datos["fallos"], **datos["hist"].resumen())
+                  for (programa, fase), datos in sorted(fases.items())],
+        "equipos": {nombre: {"login": e.login.resumen(), "apt_total": e.apt_total, "apt_fallos": e.apt_fallos}
+                    for nombre, e in sorted(equipos.items())},
+        "atipicos": [{"equipo": nombre, "motivo": motivo} for nombre, motivo in atipicos],
+        "ignorados": errores,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Percentiles de tiempos y equipos atípicos a partir de los registros de GuadaMint.")
+    parser.add_argument("rutas", nargs="+", help="Directorios (se recorren recursivamente) o archivos *-tiempos.jsonl[.gz]")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    fases, equipos, errores = agregar(args.rutas)
+    if not fases:
+        print("!!! No se han encontrado registros de tiempos.", file=sys.stderr)
+        sys.exit(1)
+    atipicos = equipos_atipicos(equipos)
+    if args.json:
+        json.dump(informe_json(fases, equipos, atipicos, errores), sys.stdout, indent=1, ensure_ascii=False)
+        print()
+    else:
+        imprimir_informe(fases, equipos, atipicos, errores)
+
+if __name__ == "__main__":
+    main()
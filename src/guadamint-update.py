@@ -4,31 +4,104 @@ import logging
 import os
 import sys
 import time
-import shutil
 import random
-import filecmp
+import threading
+import json
+import hashlib
+
+# Módulos compartidos de GuadaMint (guadamint_*.py): junto al script, instalados o en el repositorio
+for _ruta in ("/opt/guadamint/src", "/usr/lib/guadamint", os.path.dirname(os.path.realpath(__file__))):
+    if _ruta not in sys.path: sys.path.insert(0, _ruta)
+
+from guadamint_config import leer_config
+from guadamint_sync import REPO_DIR, REPO_BRANCH, sincronizar_repositorio, requiere_red, archivos_modificados, hash_de
+from guadamint_despliegue import manifiesto_bloqueado, desplegar, expandir, resolver_propietario, retirar_obsoletos
+from guadamint_apt import paquetes_instalados, paquetes_resolubles, antiguedad_listas_apt, lanzar_precarga, paquetes_precarga
+from guadamint_repo import preparar_instalacion, publicar_configurado
+from guadamint_sesion import obtener_usuario_real, obtener_entorno_usuario, enviar_aviso
+import guadamint_perfil
+from guadamint_perfil import fase
+from guadamint_log import configurar_log, cerrar_log
 
 # ==============================================================================
 # CONFIGURACIÓN
 # ==============================================================================
-LOG_FILE = "/var/log/guadamint/actualizador.log"
-LOCK_FILE = "/tmp/guadamint-updating.lock"
+# Sin root (pruebas, bench/) el log va a /tmp, igual que en la tienda
+if os.geteuid() == 0:
+    LOG_FILE = "/var/log/guadamint/actualizador.log"
+else:
+    LOG_FILE = f"/tmp/guadamint-actualizador-{os.getuid()}.log"
+# Tiempos por fase en JSON lines (uno por fase y ejecución); con --profile además se
+# imprime el desglose al terminar
+TIEMPOS_FILE = os.path.splitext(LOG_FILE)[0] + "-tiempos.jsonl"
 ICONO_DEFECTO = "/usr/share/icons/guadamintuz.svg"
 
 # --- CONFIGURACIÓN GIT ---
-REPO_URL = "https://github.com/aosucas499/guadamint.git"
-REPO_DIR = "/opt/guadamint"
-REPO_BRANCH = "main" 
+# El repositorio (/opt/guadamint), sus fuentes y el modo de sincronización se definen en
+# guadamint_sync.py, compartido con la tienda. Con --force se ignora la caché del remoto.
+# Espera aleatoria máxima (segundos) antes del primer acceso a red de cada ejecución (git,
+# APT o precarga, el que llegue antes), para que no arranquen a la vez todos los equipos
+# de un aula (sección [actualizador], clave jitter_max)
+JITTER_MAX = 10
+# Punto de control que deja el actualizador antes de reiniciarse tras actualizarse a sí
+# mismo: la versión nueva da por hechas las tareas ya completadas para ese commit (git y
+# despliegue incluidos) en lugar de repetir la sincronización. Solo vale una vez y poco tiempo.
+PUNTO_CONTROL = "/var/lib/guadamint/reinicio.json"
+VALIDEZ_PUNTO_CONTROL = 600
 
 # --- ARCHIVOS QUE SE DEBEN ACTUALIZAR DESDE GITHUB ---
+# Manifiesto declarativo de lo que se instala en el sistema. "origen" es relativo al repo;
+# si acaba en "/" es un árbol completo (filtrado opcionalmente con "patron") que se copia
+# bajo "destino". Claves opcionales: "modo" (0o755 por defecto), "propietario"
+# ("usuario:grupo"), "reinicia" (el actualizador se reinicia si cambia) y "validar"
+# (comando que debe aceptar el archivo nuevo antes de colocarlo).
 ARCHIVOS_A_SINCRONIZAR = [
     {
-        "origen": "src/guadamint-update.py", 
-        "destino": "/usr/bin/guadamint-update.py"
+        "origen": "src/guadamint-update.py",
+        "destino": "/usr/bin/guadamint-update.py",
+        "reinicia": True
     },
     {
-        "origen": "src/apps-guadamint.py",   
+        "origen": "src/apps-guadamint.py",
         "destino": "/usr/bin/apps-guadamint.py"
+    },
+    # Informe de tiempos para el coordinador TDE (agrega los registros de varios equipos)
+    {
+        "origen": "src/guadamint-informe.py",
+        "destino": "/usr/bin/guadamint-informe.py"
+    },
+    # Módulos compartidos por el actualizador y la tienda
+    {
+        "origen": "src/", "patron": "guadamint_*.py",
+        "destino": "/usr/lib/guadamint/",
+        "modo": 0o644, "reinicia": True
+    },
+    # Scripts de instalación de la tienda (copia de respaldo fuera del repositorio)
+    {
+        "origen": "src/scripts/",
+        "destino": "/usr/lib/guadamint/scripts/"
+    },
+    {
+        "origen": "src/guadamint-update.desktop",
+        "destino": "/etc/xdg/autostart/guadamint-update.desktop",
+        "modo": 0o644
+    },
+    {
+        "origen": "src/apps-guadamint.desktop",
+        "destino": "/usr/share/applications/apps-guadamint.desktop",
+        "modo": 0o644
+    },
+    {
+        "origen": "images/guadamintuz.svg",
+        "destino": "/usr/share/icons/guadamintuz.svg",
+        "modo": 0o644
+    },
+    # Un sudoers roto deja sin sudo a todo el equipo: se valida antes de colocarlo
+    {
+        "origen": "src/zz-guadamint-update",
+        "destino": "/etc/sudoers.d/zz-guadamint-update",
+        "modo": 0o440, "propietario": "root:root",
+        "validar": ["visudo", "-cf"]
     }
 ]
 
@@ -40,141 +113,201 @@ APPS_OBLIGATORIAS = [
     "openboard",    # Pizarra digital
      "screen"       # Multiplexor de terminal
 ]
+# No se repite 'apt-get update' si los índices tienen menos de estos segundos y ya
+# contienen los paquetes que faltan (sección [actualizador], clave edad_max_listas)
+EDAD_MAX_LISTAS_APT = 6 * 3600
 
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 TRAY_PROCESS = None
+REINICIO_PENDIENTE = False
+COMMIT_DESPLEGADO = None  # Commit del repositorio que se ha desplegado en esta ejecución
+_JITTER_APLICADO = threading.Event()
+_LOCK_JITTER = threading.Lock()
 
 # ==============================================================================
 # FUNCIONES BÁSICAS
 # ==============================================================================
 
+logger = logging.getLogger("guadamint")
+
 def log_y_print(mensaje):
     print(mensaje, flush=True)
-    logging.info(mensaje)
+    logger.info(mensaje)
+
+def esperar_jitter():
+    """Espera aleatoria, una sola vez por ejecución, justo antes de la primera fase que sale a
+    la red. Una tarea que llegue a la vez espera a que termine. Nunca se llama con el bloqueo
+    de la sincronización tomado: la tienda no tiene por qué esperar al reparto de carga."""
+    with _LOCK_JITTER:
+        if _JITTER_APLICADO.is_set() or '--restarted' in sys.argv: return
+        espera = random.uniform(0, leer_config().getfloat("actualizador", "jitter_max", fallback=JITTER_MAX))
+        log_y_print(f">>> Esperando {espera:.1f}s antes de conectar (reparto de carga)...")
+        time.sleep(espera)
+        _JITTER_APLICADO.set()
+
+def ejecutar_tareas(tareas, completadas=()):
+    """
+    Ejecuta en paralelo una lista de tareas {"nombre", "funcion", "depende", "condicion"}.
+    Cada tarea arranca en cuanto terminan aquellas de las que depende; si tiene
+    'condicion' y al llegar su turno devuelve False, se omite. Las de 'completadas' (punto
+    de control de un reinicio) se dan por hechas sin ejecutarlas. Devuelve {nombre: resultado}.
+    """
+    terminadas = {t["nombre"]: threading.Event() for t in tareas}
+    resultados = {}
+
+    def ejecutar(tarea):
+        try:
+            for dependencia in tarea.get("depende", []): terminadas[dependencia].wait()
+            if tarea["nombre"] in completadas:
+                log_y_print(f">>> Tarea ya completada antes del reinicio: {tarea['nombre']}")
+                resultados[tarea["nombre"]] = True
+            elif tarea.get("condicion", lambda: True)():
+                with fase(f"tarea.{tarea['nombre']}"):
+                    resultados[tarea["nombre"]] = tarea["funcion"]()
+            else:
+                log_y_print(f">>> Tarea omitida: {tarea['nombre']}")
+        except Exception as e:
+            log_y_print(f"!!! Error en la tarea {tarea['nombre']}: {e}")
+        finally:
+            terminadas[tarea["nombre"]].set()
+
+    # Cada hilo hereda las fases abiertas (p. ej. "total") para que cuenten sus subprocesos
+    hilos = [threading.Thread(target=guadamint_perfil.con_fases(ejecutar), args=(t,), name=t["nombre"])
+             for t in tareas]
+    for hilo in hilos: hilo.start()
+    for hilo in hilos: hilo.join()
+    return resultados
 
-def obtener_usuario_real():
-    return os.environ.get('SUDO_USER')
 
 # ==============================================================================
 # SISTEMA DE AUTO-ACTUALIZACIÓN (GIT MULTI-ARCHIVO)
 # ==============================================================================
 
 def auto_actualizar_desde_git():
+    """Sincroniza el repositorio y los archivos del sistema. Si el propio actualizador
+    cambia, marca REINICIO_PENDIENTE: el reinicio lo hace main() al acabar las tareas en curso.
+    Devuelve False si algo ha fallado (la tarea no cuenta entonces para el punto de control)."""
+    global REINICIO_PENDIENTE, COMMIT_DESPLEGADO
     log_y_print(f"--- Comprobando actualizaciones del repositorio (Rama: {REPO_BRANCH}) ---")
     
-    hay_cambios_git = False
-    mensaje_git = ""
     # Detectamos si el script acaba de reiniciarse automáticamente
     es_reinicio = '--restarted' in sys.argv
+    forzar = '--force' in sys.argv
     
-    # 1. Clonar o Actualizar el Repositorio en /opt
-    if not os.path.exists(REPO_DIR):
-        log_y_print(f">>> Clonando repositorio en {REPO_DIR}...")
-        try:
-            subprocess.run(["git", "clone", "-b", REPO_BRANCH, REPO_URL, REPO_DIR], check=True)
-            hay_cambios_git = True
-            mensaje_git = "Se ha descargado el sistema base por primera vez."
-        except Exception as e:
-            log_y_print(f"!!! Error al clonar: {e}")
-            mostrar_aviso("Error de Red", "No se pudo conectar con GitHub.", "error")
-            return 
-    else:
-        try:
-            os.chdir(REPO_DIR)
-            subprocess.run(["git", "fetch", "origin"], check=True, stderr=subprocess.DEVNULL)
-            subprocess.run(["git", "checkout", REPO_BRANCH], check=True, stderr=subprocess.DEVNULL)
-            
-            local_hash = subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
-            remote_hash = subprocess.check_output(["git", "rev-parse", f"origin/{REPO_BRANCH}"], text=True).strip()
-            
-            if local_hash != remote_hash:
-                log_y_print(f">>> Git: Actualización detectada ({local_hash[:7]} -> {remote_hash[:7]})")
-                
-                # Capturamos el resumen limitando a 3 líneas para que quepa bien en la notificación
-                try:
-                    # Usamos --pretty=format:"• %s" para quitar el hash (números) y dejar solo el texto del mensaje
-                    resumen_completo = subprocess.check_output(["git", "log", "--pretty=format:• %s", f"{local_hash}..{remote_hash}"], text=True).strip()
-                    lineas = resumen_completo.split('\n')
-                    if len(lineas) > 3:
-                        resumen = '\n'.join(lineas[:3]) + '\n... y más cambios.'
-                    else:
-                        resumen = resumen_completo
-                except:
-                    resumen = "Nuevos archivos sincronizados."
-                    
-                subprocess.run(["git", "reset", "--hard", f"origin/{REPO_BRANCH}"], check=True)
-                hay_cambios_git = True
-                mensaje_git = f"{resumen}"
-            else:
-                log_y_print(">>> Git: El repositorio está al día.")
-        except Exception as e:
-            log_y_print(f"!!! Error git: {e}")
-            mostrar_aviso("Error", "Fallo al comprobar actualizaciones.", "error")
-            return
+    # 1. Clonar o Actualizar el Repositorio en /opt (compartido con la tienda y protegido con flock)
+    if requiere_red(forzar): esperar_jitter()
+    sync = sincronizar_repositorio(forzar, log=log_y_print)
+    if not sync["ok"]:
+        if sync["primera_vez"]: mostrar_aviso("Error de Red", "No se pudo conectar con el repositorio.", "error", "sync")
+        else: mostrar_aviso("Error", "Fallo al comprobar actualizaciones.", "error", "sync")
+        return False
+    hay_cambios_git = sync["cambios"]
+    mensaje_git = sync["resumen"]
 
     # --- AVISO GRÁFICO (NOTIFICACIÓN DE ESCRITORIO NO INVASIVA) ---
     if hay_cambios_git:
-        mostrar_aviso("GuadaMint Actualizado", mensaje_git)
+        mostrar_aviso("GuadaMint Actualizado", mensaje_git, grupo="sync")
     elif not es_reinicio:
         # Solo mostramos que está al día si NO venimos de un reinicio automático
-        mostrar_aviso("Sistema al día", "No hay actualizaciones nuevas.")
+        mostrar_aviso("Sistema al día", "No hay actualizaciones nuevas.", grupo="sync")
 
     # 2. Sincronizar archivos al sistema
     se_requiere_reinicio = False
+    errores = 0
     
-    for item in ARCHIVOS_A_SINCRONIZAR:
-        ruta_origen = os.path.join(REPO_DIR, item["origen"])
-        ruta_destino = item["destino"]
-        
-        try:
-            if os.path.exists(ruta_origen):
-                if hay_cambios_git or not os.path.exists(ruta_destino) or \
-                   not filecmp.cmp(ruta_origen, ruta_destino, shallow=False):
-                    
-                    log_y_print(f">>> Actualizando archivo: {os.path.basename(ruta_destino)}")
-                    shutil.copy2(ruta_origen, ruta_destino)
-                    os.chmod(ruta_destino, 0o755)
-                    
-                    if ruta_destino == SCRIPT_BIN_PATH:
-                        se_requiere_reinicio = True
-            else:
-                log_y_print(f"!!! Aviso: Archivo fuente no encontrado en repo: {item['origen']}")
-        except Exception as e:
-            log_y_print(f"!!! Error sincronizando {ruta_destino}: {e}")
+    # Si el repositorio se ha movido solo se tocan los archivos que cambian entre los dos
+    # commits (git diff). Si no, se repasa todo el manifiesto: gracias a la caché de stat
+    # eso no lee ningún archivo y detecta los que se hayan modificado o borrado a mano.
+    modificados = archivos_modificados(sync["anterior"], sync["actual"]) if hay_cambios_git else None
+    if modificados is not None:
+        log_y_print(f">>> {len(modificados)} archivo(s) modificados en el repositorio.")
 
-    # 3. Reiniciar si el propio script cambió
+    # Los archivos que cambian se instalan con temporal + rename (nunca se ve uno a medias)
+    with fase("despliegue") as registro, manifiesto_bloqueado() as manifiesto:
+        registro["escritos"] = 0
+        for item, origen, ruta_destino in expandir(ARCHIVOS_A_SINCRONIZAR, REPO_DIR):
+            if modificados is not None and origen not in modificados and ruta_destino in manifiesto:
+                continue
+            ruta_origen = os.path.join(REPO_DIR, origen)
+            
+            try:
+                if os.path.exists(ruta_origen):
+                    if desplegar(ruta_origen, ruta_destino, item.get("modo", 0o755), manifiesto,
+                                 resolver_propietario(item.get("propietario")), item.get("validar")):
+                        log_y_print(f">>> Archivo actualizado: {ruta_destino}")
+                        registro["escritos"] += 1
+                        if ruta_destino == SCRIPT_BIN_PATH or item.get("reinicia"):
+                            se_requiere_reinicio = True
+                else:
+                    log_y_print(f"!!! Aviso: Archivo fuente no encontrado en repo: {origen}")
+            except Exception as e:
+                log_y_print(f"!!! Error sincronizando {ruta_destino}: {e}")
+                errores += 1
+        # Lo que se ha borrado del repositorio (un módulo, un script) sale también del sistema
+        borrados = retirar_obsoletos(ARCHIVOS_A_SINCRONIZAR, REPO_DIR, manifiesto, log_y_print)
+        for ruta_destino in borrados: log_y_print(f">>> Archivo retirado: {ruta_destino}")
+        registro["borrados"] = len(borrados)
+
+    # 3. El reinicio se deja pendiente para no cortar las tareas que corren en paralelo
     if se_requiere_reinicio:
-        log_y_print(">>> EL ACTUALIZADOR SE HA ACTUALIZADO. REINICIANDO PROCESO...")
-        try:
-            if TRAY_PROCESS: cerrar_tray_icon()
-            time.sleep(1)
-            # Añadimos la "palabra secreta" --restarted para que la próxima ejecución sea silenciosa
-            argumentos = sys.argv[:]
-            if '--restarted' not in argumentos:
-                argumentos.append('--restarted')
-            os.execv(sys.executable, ['python3'] + argumentos)
-        except Exception as e:
-            log_y_print(f"!!! Error crítico reinicio: {e}")
+        REINICIO_PENDIENTE = True
+    COMMIT_DESPLEGADO = sync["actual"]
+    return errores == 0
 
 # ==============================================================================
-# FUNCIONES DE INTERFAZ Y SISTEMA
+# PUNTO DE CONTROL DEL REINICIO
 # ==============================================================================
+def firma_despliegue():
+    """Cambia si la versión nueva del actualizador despliega otros archivos: en ese caso
+    el despliegue de la versión anterior no sirve y se repite."""
+    return hashlib.sha256(json.dumps(ARCHIVOS_A_SINCRONIZAR, sort_keys=True, default=str).encode()).hexdigest()
 
-def obtener_entorno_usuario(usuario):
-    env_vars = {'DISPLAY': ':0'}
+def guardar_punto_control(resultados):
+    """Anota las tareas terminadas sin error (las que no han devuelto False) para el commit desplegado."""
+    completadas = sorted(nombre for nombre, resultado in resultados.items() if resultado is not False)
+    datos = {"commit": COMMIT_DESPLEGADO, "firma": firma_despliegue(), "completadas": completadas, "fecha": time.time()}
     try:
-        pids = subprocess.check_output(["pgrep", "-u", usuario, "-f", "session"], text=True).split()
-        for pid in pids:
-            try:
-                with open(f"/proc/{pid}/environ", "rb") as f: content = f.read().decode("utf-8", errors="ignore")
-                for item in content.split('\0'):
-                    if item.startswith("DBUS") or item.startswith("DISPLAY"):
-                        k, v = item.split("=", 1)
-                        env_vars[k] = v
-                if 'DBUS_SESSION_BUS_ADDRESS' in env_vars: break
-            except: continue
-    except: pass
-    return env_vars
+        os.makedirs(os.path.dirname(PUNTO_CONTROL), exist_ok=True)
+        with open(PUNTO_CONTROL + ".tmp", "w") as f: json.dump(datos, f)
+        os.replace(PUNTO_CONTROL + ".tmp", PUNTO_CONTROL)
+    except OSError as e:
+        log_y_print(f"!!! No se pudo guardar el punto de control: {e}")
+
+def cargar_punto_control():
+    """Tareas que puede saltarse esta ejecución reiniciada. El punto de control se borra
+    siempre al leerlo y solo vale si el repositorio sigue en el mismo commit."""
+    try:
+        with open(PUNTO_CONTROL) as f: datos = json.load(f)
+        os.unlink(PUNTO_CONTROL)
+    except (OSError, ValueError):
+        return set()
+    try:
+        if time.time() - datos.get("fecha", 0) > VALIDEZ_PUNTO_CONTROL: return set()
+        if not datos.get("commit") or datos["commit"] != hash_de("HEAD"): return set()
+    except Exception:
+        return set()
+    completadas = set(datos.get("completadas", []))
+    if datos.get("firma") != firma_despliegue():
+        log_y_print(">>> La versión nueva despliega otros archivos: se repite la sincronización.")
+        completadas.discard("git")
+    return completadas
+
+def reiniciar_actualizador():
+    log_y_print(">>> EL ACTUALIZADOR SE HA ACTUALIZADO. REINICIANDO PROCESO...")
+    try:
+        if TRAY_PROCESS: cerrar_tray_icon()
+        # Añadimos la "palabra secreta" --restarted para que la próxima ejecución sea silenciosa
+        argumentos = sys.argv[:]
+        if '--restarted' not in argumentos:
+            argumentos.append('--restarted')
+        cerrar_log()  # exec no pasa por atexit: se vuelca el log antes
+        guadamint_perfil.conservar_ejecucion()  # Ambas mitades cuentan como un solo inicio de sesión
+        os.execv(sys.executable, ['python3'] + argumentos)
+    except Exception as e:
+        log_y_print(f"!!! Error crítico reinicio: {e}")
+
+# ==============================================================================
+# FUNCIONES DE INTERFAZ Y SISTEMA
+# ==============================================================================
 
 def iniciar_tray_icon():
     global TRAY_PROCESS
@@ -184,8 +317,8 @@ def iniciar_tray_icon():
     entorno.update(obtener_entorno_usuario(usuario))
     icono = ICONO_DEFECTO if os.path.exists(ICONO_DEFECTO) else "system-software-update"
     try:
-        TRAY_PROCESS = subprocess.Popen(['sudo', '-u', usuario, 'zenity', '--notification', '--listen', f'--window-icon={icono}'],
-                                      env=entorno, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True)
+        TRAY_PROCESS = guadamint_perfil.Popen(['sudo', '-u', usuario, 'zenity', '--notification', '--listen', f'--window-icon={icono}'],
+                                            env=entorno, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True)
         actualizar_tray('inicio', "GuadaMint Iniciando...")
     except: pass
 
@@ -205,23 +338,21 @@ def cerrar_tray_icon():
         try: TRAY_PROCESS.terminate(); TRAY_PROCESS = None
         except: pass
 
-def mostrar_aviso(titulo, mensaje, icono="info"):
+def mostrar_aviso(titulo, mensaje, icono="info", grupo=None):
     """
     Muestra una notificación de escritorio (burbuja flotante) en lugar de una ventana invasiva.
+    Se entrega al broker de avisos de la sesión, que agrupa las ráfagas del mismo 'grupo'
+    ("sync", "apps"...). Los errores van siempre en un grupo propio: nunca se mezclan con
+    un aviso informativo ni toman su título.
     """
-    usuario = obtener_usuario_real()
-    if not usuario: return
-    entorno = os.environ.copy()
-    entorno.update(obtener_entorno_usuario(usuario))
-    
     # Seleccionamos el icono para la notificación
     icono_notif = ICONO_DEFECTO if os.path.exists(ICONO_DEFECTO) else "dialog-information"
     if icono == "error":
         icono_notif = "dialog-error"
         
-    try: 
-        # Utilizamos notify-send para mostrar la burbuja de notificación
-        subprocess.Popen(['sudo', '-u', usuario, 'notify-send', '-a', 'GuadaMint Update', '-i', icono_notif, titulo, mensaje], env=entorno, stderr=subprocess.DEVNULL)
+    try:
+        clave = f"actualizador.{grupo or 'general'}" + (".error" if icono == "error" else "")
+        with fase("aviso"): enviar_aviso(titulo, mensaje, icono_notif, app='GuadaMint Update', grupo=clave)
     except: pass
 
 def detectar_escritorio():
@@ -232,19 +363,19 @@ def detectar_escritorio():
 def ejecutar_comando(comando, visible=False):
     try:
         env = os.environ.copy(); env['DEBIAN_FRONTEND'] = 'noninteractive'
-        if visible: subprocess.run(comando, text=True, env=env, check=True)
-        else: subprocess.run(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env, check=True)
+        if visible: guadamint_perfil.run(comando, text=True, env=env, check=True)
+        else: guadamint_perfil.run(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env, check=True)
         log_y_print(f"OK: {' '.join(comando)}")
         return True
     except: return False
 
 def verificar_crear_usuario_alumno():
-    try: subprocess.run(["id", "-u", "usuario"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try: guadamint_perfil.run(["id", "-u", "usuario"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except:
         log_y_print(">>> Creando usuario 'usuario'...")
         try:
-            subprocess.run(["useradd", "-m", "-s", "/bin/bash", "-c", "Usuario", "-U", "usuario"], check=True)
-            proc = subprocess.Popen(["chpasswd"], stdin=subprocess.PIPE, text=True)
+            guadamint_perfil.run(["useradd", "-m", "-s", "/bin/bash", "-c", "Usuario", "-U", "usuario"], check=True)
+            proc = guadamint_perfil.Popen(["chpasswd"], stdin=subprocess.PIPE, text=True)
             proc.communicate(input="usuario:usuario")
         except: pass
 
@@ -269,48 +400,85 @@ def eliminar_mint_welcome():
             except Exception as e:
                 log_y_print(f"!!! Error al eliminar {archivo}: {e}")
 
+def indices_apt_validos(faltantes):
+    """True si los índices de APT son recientes y ya resuelven todos los paquetes que faltan."""
+    edad_max = leer_config().getint("actualizador", "edad_max_listas", fallback=EDAD_MAX_LISTAS_APT)
+    antiguedad = antiguedad_listas_apt()
+    if antiguedad is None or antiguedad > edad_max: return False
+    return not set(faltantes) - paquetes_resolubles(faltantes)
+
 def verificar_e_instalar_apps():
-    faltantes = [app for app in APPS_OBLIGATORIAS if subprocess.run(["dpkg", "-s", app], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0]
+    # Una sola lectura del estado de dpkg para toda la lista, sin un proceso por paquete
+    with fase("dpkg.estado"): instalados = paquetes_instalados()
+    faltantes = [app for app in APPS_OBLIGATORIAS if app not in instalados]
     if faltantes:
         log_y_print(f">>> Faltan {len(faltantes)} apps.")
         actualizar_tray('trabajando', f"Instalando {len(faltantes)} apps...")
-        mostrar_aviso("Mantenimiento", f"Instalando apps base:\n{', '.join(faltantes)}")
-        ejecutar_comando(['apt-get', 'update'], visible=True)
-        if ejecutar_comando(['apt-get', 'install', '-y'] + faltantes, visible=True):
+        mostrar_aviso("Mantenimiento", f"Instalando apps base:\n{', '.join(faltantes)}", grupo="apps")
+        esperar_jitter()  # apt-get descarga: si git no ha salido a la red, el reparto de carga va aquí
+        with fase("apt.indices"): indices_validos = indices_apt_validos(faltantes)
+        if indices_validos:
+            log_y_print(">>> Índices APT recientes: se omite apt-get update.")
+        else:
+            with fase("apt.update"): ejecutar_comando(['apt-get', 'update'], visible=True)
+        with fase("aula.traer"): preparar_instalacion(faltantes, log_y_print)
+        with fase("apt.install", paquetes=len(faltantes)) as registro:
+            registro["ok"] = ejecutar_comando(['apt-get', 'install', '-y'] + faltantes, visible=True)
+        if registro["ok"]:
             actualizar_tray('ok', "Software actualizado")
         else: actualizar_tray('error', "Error al instalar")
     else:
         log_y_print(">>> Todo en orden.")
         actualizar_tray('ok', "Sistema listo")
 
+def lanzar_precarga_repartida():
+    if not paquetes_precarga(): return False
+    esperar_jitter()
+    return lanzar_precarga()
+
 # ==============================================================================
 # MAIN
 # ==============================================================================
+# Tareas de cada inicio de sesión. Las locales no esperan a la red; la instalación de apps
+# espera a git (puede traer una versión nueva de la lista o del propio actualizador) y a
+# la creación de usuarios (useradd y dpkg tocan /etc/passwd).
+TAREAS = [
+    {"nombre": "git", "funcion": auto_actualizar_desde_git},
+    {"nombre": "usuario", "funcion": verificar_crear_usuario_alumno},
+    {"nombre": "login", "funcion": ocultar_lista_usuarios_login},
+    {"nombre": "bienvenida", "funcion": eliminar_mint_welcome},
+    {"nombre": "apps", "funcion": verificar_e_instalar_apps, "depende": ["git", "usuario"],
+     "condicion": lambda: not REINICIO_PENDIENTE},
+    # Descarga en segundo plano (proceso aparte) de los paquetes de [precarga]; va después
+    # de las apps obligatorias para no competir con ellas por el bloqueo de APT
+    {"nombre": "precarga", "funcion": lanzar_precarga_repartida, "depende": ["apps"],
+     "condicion": lambda: not REINICIO_PENDIENTE},
+    # Solo en el equipo que publica el repositorio del aula ([aula] publicar)
+    {"nombre": "aula", "funcion": publicar_configurado, "depende": ["apps"],
+     "condicion": lambda: not REINICIO_PENDIENTE},
+]
+
 def main():
     if os.geteuid() != 0: sys.exit(1)
-    iniciar_tray_icon()
+    configurar_log(LOG_FILE)
+    guadamint_perfil.iniciar("actualizador", TIEMPOS_FILE)
+    # Incluye localizar la sesión gráfica del usuario (entorno de /proc)
+    with fase("bandeja"): iniciar_tray_icon()
     try:
-        auto_actualizar_desde_git()
-        
         escritorio = detectar_escritorio()
         log_y_print(f">>> Escritorio: {escritorio}")
         
-        # Mantenimiento
-        verificar_crear_usuario_alumno()
-        ocultar_lista_usuarios_login()
-        eliminar_mint_welcome()
-        verificar_e_instalar_apps()
+        completadas = cargar_punto_control() if '--restarted' in sys.argv else set()
+        with fase("total", reinicio='--restarted' in sys.argv, retomadas=len(completadas)) as total:
+            resultados = ejecutar_tareas(TAREAS, completadas)
+            if REINICIO_PENDIENTE: total["reinicia"] = True  # El informe la suma a la ejecución reiniciada
+        if '--profile' in sys.argv: print(guadamint_perfil.resumen(), flush=True)
+        if REINICIO_PENDIENTE:
+            guardar_punto_control(resultados)
+            reiniciar_actualizador()
         
         if escritorio == "XFCE": pass
         elif escritorio == "CINNAMON": pass
-        
-        time.sleep(random.randint(5, 10))
-        try:
-            with open(LOCK_FILE, 'w') as f: f.write("running")
-        except: pass
-        if os.path.exists(LOCK_FILE):
-            try: os.remove(LOCK_FILE)
-            except: pass
     finally:
         cerrar_tray_icon()
     log_y_print("=== FIN ===")
@@ -0,0 +1,550 @@
+"""
+Consultas de estado de paquetes compartidas por el actualizador y la tienda.
+
+Todo lo que se pueda saber leyendo ficheros de dpkg/APT se resuelve aquí sin lanzar
+un proceso por paquete: el coste no crece con el tamaño del catálogo.
+"""
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from guadamint_config import leer_config
+import guadamint_perfil
+
+DPKG_STATUS = "/var/lib/dpkg/status"
+APT_LISTS_DIR = "/var/lib/apt/lists"
+# Lo escribe el hook APT::Update::Post-Invoke-Success tras cada 'apt-get update' correcto
+APT_UPDATE_STAMP = "/var/lib/apt/periodic/update-success-stamp"
+
+CACHE_APT = "/var/cache/apt/archives"
+
+# Descarga anticipada (sección [precarga] de guadamint.conf)
+LIMITE_DESCARGA_KB = 1024  # KB/s de la descarga; 0 = sin límite
+LOTE_PRECARGA = 4          # Paquetes por cada consulta a apt-get --print-uris
+PRECARGA_LOCK = "/run/lock/guadamint-precarga.lock" if os.path.isdir("/run/lock") else "/tmp/guadamint-precarga.lock"
+PRECARGA_LOG = "/var/log/guadamint/precarga.log"
+PRECARGA_DIR = "/var/cache/guadamint/precarga"  # Descargas en curso o aún sin colocar en la caché de APT
+TIMEOUT_PRECARGA = 60
+
+logger = logging.getLogger("guadamint")
+
+# ==============================================================================
+# ÍNDICE DE PAQUETES INSTALADOS (DPKG)
+# ==============================================================================
+# Se lee /var/lib/dpkg/status una sola vez y se guarda en caché mientras el
+# fichero no cambie (dpkg lo reescribe con rename, así que cambian inodo/mtime).
+_CACHE_DPKG = {"firma": None, "instalados": frozenset()}
+_LOCK_DPKG = threading.Lock()
+
+def leer_estado_dpkg(ruta=None):
+    """Devuelve el conjunto de paquetes en estado 'install ok installed'."""
+    instalados = set()
+    paquete = None
+    with open(ruta or DPKG_STATUS, encoding="utf-8", errors="replace") as f:
+        for linea in f:
+            if linea.startswith("Package: "):
+                paquete = linea[9:].strip()
+            elif linea.startswith("Status: ") and paquete:
+                if "install ok installed" in linea: instalados.add(paquete)
+            elif linea == "\n":
+                paquete = None
+    return frozenset(instalados)
+
+def firma_dpkg():
+    st = os.stat(DPKG_STATUS)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def paquetes_instalados():
+    """Instantánea de paquetes instalados, reutilizando la caché si dpkg no ha escrito nada."""
+    with _LOCK_DPKG:
+        try:
+            firma = firma_dpkg()
+            if firma != _CACHE_DPKG["firma"]:
+                _CACHE_DPKG["instalados"] = leer_estado_dpkg()
+                _CACHE_DPKG["firma"] = firma
+        except Exception as e:
+            logger.warning(f"Error leyendo estado de dpkg: {e}")
+        return _CACHE_DPKG["instalados"]
+
+# ==============================================================================
+# ÍNDICES DE APT
+# ==============================================================================
+def antiguedad_listas_apt():
+    """Segundos desde el último 'apt-get update' (o None si no hay índices descargados)."""
+    marcas = glob.glob(os.path.join(APT_LISTS_DIR, "*_Packages*")) + [APT_UPDATE_STAMP]
+    mtimes = []
+    for ruta in marcas:
+        try: mtimes.append(os.stat(ruta).st_mtime)
+        except OSError: pass
+    return time.time() - max(mtimes) if mtimes else None
+
+def paquetes_resolubles(paquetes):
+    """Subconjunto de 'paquetes' con versión candidata en los índices ya descargados (un solo apt-cache)."""
+    if not paquetes: return set()
+    salida = guadamint_perfil.run(["apt-cache", "policy"] + list(paquetes), stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, text=True).stdout
+    resolubles = set()
+    paquete = None
+    for linea in salida.splitlines():
+        if linea and not linea[0].isspace() and linea.endswith(":"):
+            paquete = linea[:-1].split(":")[0]
+        elif linea.strip().startswith("Candidate:") and paquete:
+            if linea.split(":", 1)[1].strip() != "(none)": resolubles.add(paquete)
+    return resolubles
+
+# ==============================================================================
+# BLOQUEO DE DPKG/APT
+# ==============================================================================
+# apt y dpkg toman estos ficheros con bloqueos POSIX (fcntl F_SETLK). F_GETLK pregunta
+# quién lo tiene sin tomarlo ni lanzar procesos (antes: un 'fuser' por fichero).
+DPKG_LOCKS = ["/var/lib/dpkg/lock-frontend", "/var/lib/dpkg/lock"]
+ESPERA_MAX_BLOQUEO = 5  # Segundos máximos entre comprobaciones al esperar el bloqueo
+ESPERA_TOTAL_BLOQUEO = 600  # Segundos que se espera en total antes de rendirse ([tienda] espera_apt)
+
+def pid_bloqueo_apt():
+    """PID de quien tiene el bloqueo de dpkg/APT, 0 si no se sabe (otro espacio de PIDs) o None si está libre."""
+    for ruta in DPKG_LOCKS:
+        try: fd = os.open(ruta, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError: continue  # Sin el fichero (o sin permisos) no hay bloqueo que comprobar
+        try:
+            # struct flock de Linux de 64 bits: l_type, l_whence, l_start, l_len, l_pid
+            consulta = struct.pack("hhqqi", fcntl.F_WRLCK, os.SEEK_SET, 0, 0, 0)
+            l_type, _, _, _, l_pid = struct.unpack("hhqqi", fcntl.fcntl(fd, fcntl.F_GETLK, consulta))
+            if l_type != fcntl.F_UNLCK: return max(l_pid, 0)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    return None
+
+def nombre_proceso(pid):
+    try:
+        with open(f"/proc/{pid}/comm") as f: return f.read().strip()
+    except OSError:
+        return "otro proceso"
+
+def esperar_bloqueo_apt(al_esperar=None, espera_max=ESPERA_MAX_BLOQUEO, limite=ESPERA_TOTAL_BLOQUEO, cancelar=None):
+    """Espera a que el bloqueo de dpkg/APT quede libre, comprobando con espera creciente
+    (0,5 s, 1 s, 2 s... hasta espera_max). Llama a al_esperar(pid) cada vez que lo encuentra
+    ocupado. Se rinde al pasar 'limite' segundos (None: sin límite) o al activarse el evento
+    'cancelar'. Devuelve (segundos esperados, pid): pid es None si el bloqueo ha quedado libre
+    y, si no, el de quien lo sigue teniendo (0 si no se sabe)."""
+    inicio = time.monotonic()
+    espera = 0.5
+    while True:
+        pid = pid_bloqueo_apt()
+        esperado = time.monotonic() - inicio
+        if pid is None: return esperado, None
+        if (limite is not None and esperado >= limite) or (cancelar and cancelar.is_set()): return esperado, pid
+        if al_esperar: al_esperar(pid)
+        pausa = espera if limite is None else max(0, min(espera, limite - esperado))
+        if cancelar: cancelar.wait(pausa)
+        else: time.sleep(pausa)
+        espera = min(espera * 2, espera_max)
+
+# ==============================================================================
+# DISPONIBILIDAD EN LOS REPOSITORIOS
+# ==============================================================================
+# Versión candidata y tamaño de descarga de los paquetes del catálogo, sacados de una
+# sola pasada por /var/lib/apt/lists/*_Packages (también comprimidos) en lugar de un
+# apt-cache por app. El resultado se guarda en memoria y en disco mientras los índices
+# no cambien ('apt-get update' los reescribe), así que abrir la tienda no repite la lectura.
+CACHE_DISPONIBLES = "/var/cache/guadamint/disponibles.json"
+_CACHE_LISTAS = {"clave": None, "buscados": [], "disponibles": {}}
+_LOCK_LISTAS = threading.Lock()
+_ARQUITECTURA = []
+
+def arquitectura_nativa():
+    if not _ARQUITECTURA:
+        try: _ARQUITECTURA.append(guadamint_perfil.check_output(["dpkg", "--print-architecture"], text=True).strip())
+        except (OSError, subprocess.CalledProcessError): _ARQUITECTURA.append("amd64")
+    return _ARQUITECTURA[0]
+
+def _orden_caracter(c):
+    if c == "~": return -1
+    if c.isalpha(): return ord(c)
+    return ord(c) + 256
+
+def _comparar_fragmento(a, b):
+    """Comparación de dpkg para upstream_version o debian_revision."""
+    while a or b:
+        no_digitos_a = re.match(r"\D*", a).group()
+        no_digitos_b = re.match(r"\D*", b).group()
+        for i in range(max(len(no_digitos_a), len(no_digitos_b))):
+            ca = _orden_caracter(no_digitos_a[i]) if i < len(no_digitos_a) else 0
+            cb = _orden_caracter(no_digitos_b[i]) if i < len(no_digitos_b) else 0
+            if ca != cb: return -1 if ca < cb else 1
+        a, b = a[len(no_digitos_a):], b[len(no_digitos_b):]
+        digitos_a = re.match(r"\d*", a).group()
+        digitos_b = re.match(r"\d*", b).group()
+        if int(digitos_a or 0) != int(digitos_b or 0): return -1 if int(digitos_a or 0) < int(digitos_b or 0) else 1
+        a, b = a[len(digitos_a):], b[len(digitos_b):]
+    return 0
+
+def _partes_version(version):
+    """(epoch, upstream, revision). Como dpkg, el epoch acaba en los primeros dos puntos (el
+    upstream puede tener más) y la revisión empieza en el último guion. ValueError si no es válida."""
+    epoch, _, resto = version.partition(":") if ":" in version else ("0", "", version)
+    upstream, _, revision = resto.rpartition("-") if "-" in resto else (resto, "", "")
+    if not epoch.isdigit() or not upstream: raise ValueError(f"versión no válida: {version!r}")
+    return int(epoch), upstream, revision
+
+def version_valida(version):
+    try: return bool(_partes_version(version))
+    except ValueError: return False
+
+def comparar_versiones(a, b):
+    """-1, 0 o 1 según las reglas de dpkg (epoch:upstream-revision). ValueError si alguna no es válida."""
+    ea, ua, ra = _partes_version(a)
+    eb, ub, rb = _partes_version(b)
+    if ea != eb: return -1 if ea < eb else 1
+    return _comparar_fragmento(ua, ub) or _comparar_fragmento(ra, rb)
+
+# Índices que guarda APT: sin comprimir o, con Acquire::GzipIndexes, tal como los descarga
+_INDICE = re.compile(r"_Packages(\.(gz|xz|bz2|lz4|zst))?$")
+
+def firma_listas():
+    firma = []
+    for ruta in sorted(glob.glob(os.path.join(APT_LISTS_DIR, "*_Packages*"))):
+        if not _INDICE.search(ruta): continue
+        try:
+            st = os.stat(ruta)
+            firma.append([os.path.basename(ruta), st.st_mtime_ns, st.st_size])
+        except OSError: pass
+    return firma
+
+def _abridor_indice(ruta):
+    """Función para abrir el índice en binario, o None si falta el módulo que lo descomprime."""
+    if ruta.endswith(".gz"): return gzip.open
+    if ruta.endswith(".xz"):
+        import lzma
+        return lzma.open
+    if ruta.endswith(".bz2"):
+        import bz2
+        return bz2.open
+    try:
+        if ruta.endswith(".lz4"):
+            import lz4.frame  # python3-lz4
+            return lz4.frame.open
+        if ruta.endswith(".zst"):
+            from compression import zstd  # Python 3.14
+            return zstd.open
+    except ImportError:
+        return None
+    return open
+
+def _trozos_por_parrafos(f, tamano=1 << 20):
+    """El índice en trozos de ~'tamano' bytes que acaban siempre al final de un párrafo."""
+    resto = b""
+    for datos in iter(lambda: f.read(tamano), b""):
+        datos = resto + datos
+        corte = datos.rfind(b"\n\n")
+        if corte < 0:
+            resto = datos
+            continue
+        yield datos[:corte + 2]
+        resto = datos[corte + 2:]
+    if resto: yield resto
+
+def leer_listas(paquetes, rutas):
+    """{paquete: {"version", "tamano"}} con la versión más alta de cada uno en 'rutas'. Una
+    versión que no se puede interpretar queda como desconocida (None) y pierde ante cualquier otra.
+    Devuelve None si algún índice está comprimido en un formato que no se puede leer aquí."""
+    abridores = [(ruta, _abridor_indice(ruta)) for ruta in rutas]
+    ilegibles = [os.path.basename(ruta) for ruta, abrir in abridores if abrir is None]
+    if ilegibles:
+        logger.warning(f"!!! No se pueden leer los índices de APT {', '.join(ilegibles)}: falta el módulo para descomprimirlos")
+        return None
+    buscados = {p.encode() for p in paquetes}
+    arquitecturas = {arquitectura_nativa().encode(), b"all"}
+    disponibles = {}
+    for ruta, abrir in abridores:
+        try:
+            with abrir(ruta, "rb") as f:
+                # Se lee por trozos (los índices de universe ocupan decenas de MB) y en cada uno
+                # solo se miran los párrafos de los paquetes buscados: la búsqueda la hace re, en C
+                for datos in _trozos_por_parrafos(f):
+                    for encontrado in re.finditer(rb"^Package: (\S+)$", datos, re.M):
+                        if encontrado.group(1) not in buscados: continue
+                        fin = datos.find(b"\n\n", encontrado.end())
+                        campos = dict(re.findall(rb"^(Version|Architecture|Size): (.*)$", datos[encontrado.end():fin if fin >= 0 else None], re.M))
+                        if campos.get(b"Architecture") not in arquitecturas or b"Version" not in campos: continue
+                        nombre, version = encontrado.group(1).decode(), campos[b"Version"].decode(errors="replace")
+                        if not version_valida(version): version = None
+                        actual = disponibles.get(nombre)
+                        if actual is None or (version is not None and (actual["version"] is None
+                                                                       or comparar_versiones(version, actual["version"]) > 0)):
+                            disponibles[nombre] = {"version": version, "tamano": int(campos.get(b"Size", 0))}
+        except (OSError, EOFError, ValueError):
+            continue  # Índice borrado o truncado mientras apt-get update lo reescribe
+    return disponibles
+
+def paquetes_disponibles(paquetes):
+    """Versión candidata y tamaño de los 'paquetes' que tiene algún repositorio configurado.
+    Los que falten en el diccionario no se pueden instalar. Devuelve None si no hay índices
+    descargados o no se pueden leer (no se sabe nada). No tiene en cuenta el pinning de APT.
+
+    La caché depende solo de los índices: guarda todos los paquetes consultados hasta ahora
+    (la tienda pide el catálogo entero y el modo por línea de comandos unos pocos) y a cada
+    llamada se le devuelven los suyos."""
+    buscados = set(paquetes)
+    with _LOCK_LISTAS:
+        firma = firma_listas()
+        if not firma: return None
+        if not _cache_cubre(_CACHE_LISTAS, firma, buscados):
+            guardado = _leer_cache_disponibles()
+            if _cache_cubre(guardado, firma, buscados):
+                _CACHE_LISTAS.update(guardado)
+            else:
+                # Leer los índices cuesta lo mismo con más nombres: se conservan los de antes
+                todos = buscados | set(_CACHE_LISTAS["buscados"]) | set(guardado.get("buscados", []))
+                disponibles = leer_listas(todos, [os.path.join(APT_LISTS_DIR, nombre) for nombre, _, _ in firma])
+                if disponibles is None: return None
+                _CACHE_LISTAS.update(clave=firma, buscados=sorted(todos), disponibles=disponibles)
+                try:
+                    os.makedirs(os.path.dirname(CACHE_DISPONIBLES), exist_ok=True)
+                    with open(CACHE_DISPONIBLES + ".tmp", "w") as f: json.dump(_CACHE_LISTAS, f)
+                    os.replace(CACHE_DISPONIBLES + ".tmp", CACHE_DISPONIBLES)
+                except OSError:
+                    pass  # Sin permisos (p. ej. sin root): solo se pierde la caché entre ejecuciones
+        disponibles = _CACHE_LISTAS["disponibles"]
+        return {nombre: disponibles[nombre] for nombre in buscados if nombre in disponibles}
+
+def _cache_cubre(cache, firma, buscados):
+    return cache.get("clave") == firma and buscados <= set(cache.get("buscados", []))
+
+def _leer_cache_disponibles():
+    try:
+        with open(CACHE_DISPONIBLES) as f: guardado = json.load(f)
+        if isinstance(guardado, dict) and isinstance(guardado.get("buscados"), list) \
+                and isinstance(guardado.get("disponibles"), dict):
+            return guardado
+    except (OSError, ValueError):
+        pass
+    return {}
+
+# ==============================================================================
+# DESCARGA ANTICIPADA DE PAQUETES
+# ==============================================================================
+# Los paquetes pesados del catálogo (blender, kdenlive...) se bajan a la caché de APT
+# (/var/cache/apt/archives) en segundo plano, sin instalarlos: cuando luego se activan
+# en la tienda, apt-get ya los encuentra descargados y solo tiene que desempaquetar.
+# Se ejecuta como proceso aparte (guadamint_apt.py --precargar), con prioridad baja de
+# CPU y disco, límite de ancho de banda y una sola instancia a la vez (flock).
+#
+# No usa 'apt-get install --download-only': tomaría el bloqueo de dpkg durante toda la
+# descarga (minutos con el límite de ancho de banda) y el actualizador, unattended-upgrades
+# o un apt-get a mano fallarían con "could not get lock". apt-get --print-uris (sin
+# bloqueos) dice qué archivos bajar y con qué hash; se descargan a PRECARGA_DIR y cada uno,
+# ya comprobado, se mueve a la caché tomando solo un momento el bloqueo de esta.
+
+def paquetes_precarga(config=None):
+    config = config or leer_config()
+    return config.get("precarga", "paquetes", fallback="").split()
+
+def uris_necesarias(paquetes):
+    """[(uri, archivo, tamaño, algoritmo, hash)] que descargaría 'apt-get install paquetes'
+    (los que ya están en la caché de APT no aparecen). No toma ningún bloqueo."""
+    salida = guadamint_perfil.run(["apt-get", "install", "--print-uris", "-qq", "-y"] + list(paquetes),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    archivos = []
+    for linea in salida.splitlines():
+        partes = linea.split()
+        if len(partes) < 4 or not partes[0].startswith("'") or ":" not in partes[3]: continue
+        algoritmo, valor = partes[3].split(":", 1)
+        archivos.append((partes[0].strip("'"), partes[1], int(partes[2]), algoritmo.lower(), valor.lower()))
+    return archivos
+
+def _abridor_con_proxy_apt():
+    """urllib con el proxy que tenga configurado APT (Acquire::http(s)::Proxy), como apt-get."""
+    import urllib.request  # Solo en el proceso de precarga
+    try:
+        salida = guadamint_perfil.run(["apt-config", "shell", "HTTP", "Acquire::http::Proxy", "HTTPS", "Acquire::https::Proxy"],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    except OSError:
+        salida = ""
+    valores = dict(asignacion.split("=", 1) for asignacion in shlex.split(salida) if "=" in asignacion)
+    proxies = {esquema: valores[clave] for esquema, clave in (("http", "HTTP"), ("https", "HTTPS"))
+               if valores.get(clave, "").lower() not in ("", "direct", "false")}
+    return urllib.request.build_opener(*([urllib.request.ProxyHandler(proxies)] if proxies else []))
+
+def _hash_archivo(ruta, algoritmo):
+    comprobacion = hashlib.sha256() if algoritmo == "sha256" else hashlib.md5()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""): comprobacion.update(bloque)
+    return comprobacion.hexdigest()
+
+def descargar_limitado(abridor, uri, destino, tamano, algoritmo, valor, limite_kb, timeout=TIMEOUT_PRECARGA):
+    """Descarga 'uri' a 'destino' a no más de limite_kb KB/s y comprueba tamaño y hash.
+    ValueError si no coinciden (el archivo no se deja)."""
+    comprobacion = hashlib.sha256() if algoritmo == "sha256" else hashlib.md5()
+    recibidos, inicio = 0, time.monotonic()
+    try:
+        with abridor.open(uri, timeout=timeout) as respuesta, open(destino, "wb") as salida:
+            for bloque in iter(lambda: respuesta.read(1 << 16), b""):
+                comprobacion.update(bloque)
+                salida.write(bloque)
+                recibidos += len(bloque)
+                if limite_kb > 0:
+                    adelanto = recibidos / (limite_kb * 1024) - (time.monotonic() - inicio)
+                    if adelanto > 0: time.sleep(adelanto)
+        if recibidos != tamano or comprobacion.hexdigest() != valor:
+            raise ValueError("el tamaño o el hash no coinciden con los índices de APT")
+    except BaseException:
+        try: os.unlink(destino)
+        except OSError: pass
+        raise
+
+def colocar_en_cache(origen, archivo, intentos=10):
+    """Mueve un .deb ya comprobado a la caché de APT con el bloqueo de esta tomado (como apt
+    al terminar una descarga). Si un apt-get lo tiene, se reintenta un rato; devuelve False
+    si no se ha podido (el archivo sigue en PRECARGA_DIR para la próxima vez)."""
+    fd = os.open(os.path.join(CACHE_APT, "lock"), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o640)
+    try:
+        for _ in range(intentos):
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                time.sleep(1)
+        else:
+            return False
+        destino = os.path.join(CACHE_APT, archivo)
+        try:
+            os.replace(origen, destino)
+        except OSError:  # Otro sistema de archivos: copia a un temporal y rename
+            shutil.copyfile(origen, destino + ".guadamint")
+            os.replace(destino + ".guadamint", destino)
+            os.unlink(origen)
+        return True
+    finally:
+        os.close(fd)  # Libera el bloqueo
+
+def precargar(paquetes, limite_kb=LIMITE_DESCARGA_KB, lote=LOTE_PRECARGA, log=None):
+    """Descarga sin instalar los paquetes que falten, por lotes, sin tomar el bloqueo de dpkg.
+    Devuelve cuántos archivos se han dejado en la caché de APT (0 también si ya hay otra
+    precarga en marcha)."""
+    log = log or logger.info
+    fd = os.open(PRECARGA_LOCK, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log(">>> Precarga: ya hay otra en marcha.")
+            return 0
+        # El PID permite a la tienda detener la precarga antes de instalar (detener_precarga)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+
+        instalados = paquetes_instalados()
+        pendientes = [p for p in dict.fromkeys(paquetes) if p not in instalados]
+        # Un paquete desconocido haría fallar todo su lote: se filtran antes (apt-cache, sin red)
+        resolubles = paquetes_resolubles(pendientes)
+        pendientes = [p for p in pendientes if p in resolubles]
+        if not pendientes:
+            log(">>> Precarga: nada que descargar.")
+            return 0
+
+        log(f">>> Precarga: {len(pendientes)} paquete(s) en lotes de {lote}, límite {limite_kb} KB/s.")
+        os.makedirs(PRECARGA_DIR, exist_ok=True)
+        abridor = _abridor_con_proxy_apt()
+        descargados, vistos = 0, set()
+        for inicio in range(0, len(pendientes), max(1, lote)):
+            grupo = pendientes[inicio:inicio + max(1, lote)]
+            archivos = [a for a in uris_necesarias(grupo) if a[1] not in vistos]
+            vistos.update(a[1] for a in archivos)
+            for uri, archivo, tamano, algoritmo, valor in archivos:
+                if algoritmo not in ("sha256", "md5sum") or not uri.startswith(("http://", "https://")):
+                    continue  # Fuentes locales (file:, cdrom:) o sin hash que comprobar: ya las trae apt-get
+                temporal = os.path.join(PRECARGA_DIR, archivo)
+                try:
+                    # Uno descargado la vez anterior que no se pudo colocar no se vuelve a bajar
+                    if not (os.path.exists(temporal) and os.path.getsize(temporal) == tamano
+                            and _hash_archivo(temporal, algoritmo) == valor):
+                        descargar_limitado(abridor, uri, temporal, tamano, algoritmo, valor, limite_kb)
+                    if colocar_en_cache(temporal, archivo): descargados += 1
+                    else: log(f"!!! Precarga: caché de APT ocupada, {archivo} queda para la próxima vez.")
+                except (OSError, ValueError) as e:
+                    log(f"!!! Precarga fallida ({archivo}): {e}")
+            if archivos: log(f">>> Precarga: lote {' '.join(grupo)} terminado.")
+        return descargados
+    finally:
+        os.close(fd)
+
+def lanzar_precarga():
+    """Arranca la precarga en un proceso independiente si hay paquetes configurados."""
+    if not paquetes_precarga(): return False
+    guadamint_perfil.Popen([sys.executable, os.path.abspath(__file__), "--precargar"], stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    return True
+
+def _pid_precarga(fd):
+    """PID de la precarga en curso, o None si nadie tiene el bloqueo."""
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    except BlockingIOError:
+        try: return int(os.pread(fd, 32, 0)) or None
+        except ValueError: return None
+
+def precarga_en_curso():
+    try: fd = os.open(PRECARGA_LOCK, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError: return False
+    try: return _pid_precarga(fd) is not None
+    finally: os.close(fd)
+
+def detener_precarga():
+    """Detiene una precarga en curso, p. ej. para que la tienda tenga todo el ancho de banda al
+    instalar. Lo ya descargado se conserva en la caché y el resto se retoma en la siguiente precarga."""
+    try:
+        fd = os.open(PRECARGA_LOCK, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return False
+    try:
+        pid = _pid_precarga(fd)
+        if pid is None: return False
+        # Lanzada con lanzar_precarga es líder de su grupo: se detienen también sus subprocesos
+        if os.getpgid(pid) == pid: os.killpg(pid, signal.SIGTERM)
+        else: os.kill(pid, signal.SIGTERM)
+        # Se espera a que suelte el bloqueo
+        for _ in range(100):
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                time.sleep(0.1)
+        return False
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+if __name__ == "__main__":
+    if "--precargar" in sys.argv:
+        from guadamint_log import configurar_log
+        configurar_log(PRECARGA_LOG)
+        # Prioridad baja de CPU y disco para todo el proceso (antes se lanzaba apt-get con nice/ionice)
+        os.nice(19)
+        if shutil.which("ionice"): guadamint_perfil.run(["ionice", "-c", "3", "-p", str(os.getpid())])
+        from guadamint_repo import preparar_instalacion, publicar_configurado
+        config = leer_config()
+        # Lo que ya tenga el repositorio del aula se copia por la red local, no se descarga
+        preparar_instalacion(paquetes_precarga(config))
+        precargar(paquetes_precarga(config),
+                  config.getint("precarga", "limite_kb", fallback=LIMITE_DESCARGA_KB),
+                  config.getint("precarga", "lote", fallback=LOTE_PRECARGA))
+        publicar_configurado()
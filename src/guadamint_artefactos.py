@@ -0,0 +1,176 @@
+"""
+Caché de lo que descargan los instaladores por script (src/scripts).
+
+Cada artefacto se guarda en /var/cache/guadamint/artefactos y se reutiliza en los
+siguientes intentos:
+  - Archivos por HTTP: petición condicional (If-None-Match / If-Modified-Since) con
+    el ETag y la fecha de la descarga anterior; si el servidor responde 304 se usa la
+    copia local tras comprobar su SHA256. Sin red, también se usa la copia local.
+    ETag y fecha se guardan por URL (espejo y original) junto con el SHA256 al que se
+    refieren, así que pasar de una fuente a otra no obliga a descargarlo todo de nuevo.
+  - Repositorios git: checkout de profundidad 1 que se actualiza con fetch y se deja
+    limpio (reset + clean) en vez de clonarlo entero y borrarlo en cada intento.
+
+La ruta de cada artefacto se pasa al script en una variable de entorno (p. ej.
+GUADAMINT_CHROME_DEB); los scripts siguen funcionando solos si no la reciben.
+Con [artefactos] espejo, los archivos se piden antes a ese servidor del aula
+(p. ej. otro equipo sirviendo su caché con guadamint_repo.py --servir).
+"""
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from guadamint_config import leer_config
+import guadamint_perfil
+from guadamint_perfil import fase
+
+CACHE_DIR = "/var/cache/guadamint/artefactos"
+TIMEOUT_DESCARGA = 30
+
+# nombre -> descripción. "variable" es la que recibe el script con la ruta local
+ARTEFACTOS = {
+    "chrome": {"tipo": "http", "url": "https://dl.google.com/linux/direct/google-chrome-stable_current_amd64.deb",
+               "archivo": "google-chrome-stable_current_amd64.deb", "variable": "GUADAMINT_CHROME_DEB"},
+    "smartdre": {"tipo": "git", "url": "https://github.com/aosucas499/smartdre.git",
+                 "directorio": "smartdre", "variable": "GUADAMINT_SMARTDRE_DIR"},
+}
+
+logger = logging.getLogger("guadamint")
+
+# ==============================================================================
+# ARCHIVOS POR HTTP
+# ==============================================================================
+def _sha256(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""): h.update(bloque)
+    return h.hexdigest()
+
+def _leer_meta(ruta):
+    try:
+        with open(ruta + ".meta") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def copia_valida(destino):
+    """True si 'destino' existe y coincide con el SHA256 anotado al descargarlo."""
+    meta = _leer_meta(destino)
+    return os.path.exists(destino) and meta.get("sha256") is not None and _sha256(destino) == meta["sha256"]
+
+def _fuentes(meta):
+    """{url: {"sha256", "etag", "fecha"}} de la meta (la antigua guardaba una sola url)."""
+    if "fuentes" in meta: return meta["fuentes"]
+    if not meta.get("url"): return {}
+    return {meta["url"]: {"sha256": meta.get("sha256"), "etag": meta.get("etag"), "fecha": meta.get("fecha")}}
+
+def descargar(url, destino, timeout=TIMEOUT_DESCARGA, log=None, local_si_falla=True):
+    """Trae 'url' a 'destino' salvo que el servidor confirme que no ha cambiado. Devuelve True
+    si hay una copia válida al terminar (nueva o reutilizada; si la petición falla, solo
+    con local_si_falla)."""
+    import email.utils, urllib.error, urllib.request  # Solo al descargar: la tienda arranca sin ellos
+    log = log or logger.info
+    meta = _leer_meta(destino)
+    valida = copia_valida(destino)
+    fuentes = _fuentes(meta)
+    peticion = urllib.request.Request(url, headers={"User-Agent": "GuadaMint"})
+    # Los validadores de esta URL solo sirven si se refieren al contenido de la copia actual
+    previa = fuentes.get(url, {})
+    if valida and previa.get("sha256") == meta["sha256"]:
+        if previa.get("etag"): peticion.add_header("If-None-Match", previa["etag"])
+        if previa.get("fecha"): peticion.add_header("If-Modified-Since", previa["fecha"])
+    temporal = destino + ".parcial"
+    try:
+        with urllib.request.urlopen(peticion, timeout=timeout) as respuesta:
+            h = hashlib.sha256()
+            with open(temporal, "wb") as f:
+                for bloque in iter(lambda: respuesta.read(1 << 16), b""):
+                    h.update(bloque)
+                    f.write(bloque)
+            cabeceras = respuesta.headers
+        os.replace(temporal, destino)
+        fuentes[url] = {"sha256": h.hexdigest(), "etag": cabeceras.get("ETag"),
+                        "fecha": cabeceras.get("Last-Modified") or email.utils.formatdate(usegmt=True)}
+        meta = {"sha256": h.hexdigest(), "fuentes": fuentes}
+        with open(destino + ".meta", "w") as f: json.dump(meta, f)
+        log(f">>> Artefacto descargado: {os.path.basename(destino)} (sha256 {meta['sha256'][:12]})")
+        return True
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            log(f">>> Artefacto sin cambios, se reutiliza: {os.path.basename(destino)}")
+            return True
+        log(f"!!! Descarga fallida ({url}): HTTP {e.code}")
+    except (OSError, ValueError) as e:
+        log(f"!!! Descarga fallida ({url}): {e}")
+    try: os.unlink(temporal)
+    except OSError: pass
+    if valida and local_si_falla: log(f">>> Se usa la copia local de {os.path.basename(destino)}.")
+    return valida and local_si_falla
+
+# ==============================================================================
+# REPOSITORIOS GIT
+# ==============================================================================
+def checkout_git(url, destino, rama=None, log=None):
+    """Deja en 'destino' la última versión de 'url' (profundidad 1), reutilizando el checkout
+    anterior. Devuelve True si hay un checkout utilizable."""
+    log = log or logger.info
+    git = ["git", "-C", destino]
+    try:
+        if os.path.isdir(os.path.join(destino, ".git")):
+            guadamint_perfil.run(git + ["remote", "set-url", "origin", url], check=True)
+            try:
+                guadamint_perfil.run(git + ["fetch", "--depth", "1", "origin", rama or "HEAD"], check=True,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                referencia = "FETCH_HEAD"
+            except subprocess.CalledProcessError as e:
+                log(f"!!! Fetch fallido ({url}), se usa el checkout local: {e.stderr.decode(errors='replace').strip()}")
+                referencia = "HEAD"
+            # Lo que dejara el instalador anterior se descarta: siempre se parte de la versión limpia
+            guadamint_perfil.run(git + ["reset", "--hard", "-q", referencia], check=True)
+            guadamint_perfil.run(git + ["clean", "-ffdxq"], check=True)
+        else:
+            guadamint_perfil.run(["git", "clone", "--depth", "1", "-q"] + (["-b", rama] if rama else []) + [url, destino], check=True)
+        commit = guadamint_perfil.check_output(git + ["rev-parse", "--short", "HEAD"], text=True).strip()
+        log(f">>> Artefacto git listo: {os.path.basename(destino)} ({commit})")
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        log(f"!!! No se pudo preparar {url}: {e}")
+        return False
+
+# ==============================================================================
+# PUNTO DE ENTRADA
+# ==============================================================================
+def preparar_artefactos(nombres, log=None):
+    """Prepara los artefactos indicados y devuelve {variable: ruta} con los que estén listos."""
+    log = log or logger.info
+    config = leer_config()
+    espejo = config.get("artefactos", "espejo", fallback="").strip().rstrip("/")
+    timeout = config.getint("artefactos", "timeout", fallback=TIMEOUT_DESCARGA)
+    entorno = {}
+    for nombre in nombres:
+        artefacto = ARTEFACTOS.get(nombre)
+        if artefacto is None:
+            log(f"!!! Artefacto desconocido: {nombre}")
+            continue
+        with fase(f"artefacto.{nombre}") as registro:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            if artefacto["tipo"] == "git":
+                destino = os.path.join(CACHE_DIR, artefacto["directorio"])
+                listo = checkout_git(config.get("artefactos", nombre, fallback=artefacto["url"]), destino,
+                                     artefacto.get("rama"), log)
+            else:
+                destino = os.path.join(CACHE_DIR, artefacto["archivo"])
+                listo = False
+                if espejo:
+                    listo = descargar(f"{espejo}/{artefacto['archivo']}", destino, min(timeout, 5), log, local_si_falla=False)
+                listo = listo or descargar(config.get("artefactos", nombre, fallback=artefacto["url"]), destino, timeout, log)
+            registro["ok"] = listo
+        if listo: entorno[artefacto["variable"]] = destino
+    return entorno
+
+if __name__ == "__main__":
+    # Uso manual: guadamint_artefactos.py chrome smartdre -> imprime VARIABLE=ruta
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+    for variable, ruta in preparar_artefactos(sys.argv[1:]).items(): print(f"{variable}={ruta}")
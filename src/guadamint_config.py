@@ -0,0 +1,20 @@
+"""
+Configuración común de GuadaMint.
+
+Se lee de /etc/guadamint/guadamint.conf (formato INI). Todas las claves son opcionales:
+si el fichero no existe, cada script usa sus valores por defecto.
+"""
+import configparser
+import logging
+
+CONFIG_FILE = "/etc/guadamint/guadamint.conf"
+
+logger = logging.getLogger("guadamint")
+
+def leer_config(ruta=None):
+    config = configparser.ConfigParser()
+    try:
+        config.read(ruta or CONFIG_FILE)
+    except configparser.Error as e:
+        logger.warning(f"!!! Error leyendo {ruta or CONFIG_FILE}: {e}")
+    return config
@@ -0,0 +1,161 @@
+"""
+Instalación de archivos del repositorio en el sistema (/usr/bin, /usr/lib/guadamint...).
+
+Se guarda un manifiesto con el hash y los datos de stat de cada archivo desplegado: si ni
+el origen ni el destino han cambiado desde la última vez, no se lee ninguno de los dos.
+Los cambios se escriben en un temporal del mismo directorio y se colocan con rename,
+de modo que un intérprete que esté arrancando nunca ve un script a medio escribir.
+
+Las entradas a desplegar se declaran como diccionarios (ver ARCHIVOS_A_SINCRONIZAR en
+guadamint-update.py): un archivo, o un árbol si "origen" acaba en "/" (opcionalmente
+filtrado por "patron"), con "modo", "propietario" y "validar" opcionales. Lo que se
+despliega desde un árbol y desaparece del repositorio se borra también del sistema.
+"""
+import contextlib
+import fcntl
+import fnmatch
+import grp
+import hashlib
+import json
+import logging
+import os
+import pwd
+import shutil
+import subprocess
+import tempfile
+
+import guadamint_perfil
+
+MANIFIESTO = "/var/lib/guadamint/manifiesto.json"
+
+logger = logging.getLogger("guadamint")
+
+def _firma(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode & 0o7777, st.st_uid, st.st_gid]
+
+def resolver_propietario(texto):
+    """'usuario:grupo' -> (uid, gid). None si no se pide propietario."""
+    if not texto: return None
+    usuario, _, grupo = texto.partition(":")
+    return pwd.getpwnam(usuario).pw_uid, grp.getgrnam(grupo or usuario).gr_gid
+
+def expandir(entradas, raiz):
+    """Convierte las entradas del manifiesto en (entrada, origen relativo, destino) por archivo."""
+    for entrada in entradas:
+        origen = entrada["origen"]
+        if not origen.endswith("/"):
+            yield entrada, origen, entrada["destino"]
+            continue
+        base = os.path.join(raiz, origen)
+        for directorio, subdirs, archivos in os.walk(base):
+            subdirs.sort()
+            for nombre in sorted(archivos):
+                if not fnmatch.fnmatch(nombre, entrada.get("patron", "*")): continue
+                relativa = os.path.relpath(os.path.join(directorio, nombre), base)
+                yield entrada, os.path.join(origen, relativa), os.path.join(entrada["destino"], relativa)
+
+def hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""): h.update(bloque)
+    return h.hexdigest()
+
+@contextlib.contextmanager
+def manifiesto_bloqueado():
+    """Carga el manifiesto con un flock (lo comparten actualizador y tienda) y lo guarda al salir."""
+    os.makedirs(os.path.dirname(MANIFIESTO), exist_ok=True)
+    fd = os.open(MANIFIESTO + ".lock", os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            with open(MANIFIESTO) as f: manifiesto = json.load(f)
+        except (OSError, ValueError):
+            manifiesto = {}
+        original = json.dumps(manifiesto, sort_keys=True)
+        yield manifiesto
+        if json.dumps(manifiesto, sort_keys=True) != original:
+            with open(MANIFIESTO + ".tmp", "w") as f: json.dump(manifiesto, f, indent=1, sort_keys=True)
+            os.replace(MANIFIESTO + ".tmp", MANIFIESTO)
+    finally:
+        os.close(fd)
+
+def instalar_atomico(origen, destino, modo, propietario=None, validar=None):
+    """'validar' es un comando (lista) que recibe el temporal como último argumento y debe
+    aceptarlo antes de colocarlo, p. ej. ["visudo", "-cf"] para sudoers."""
+    directorio = os.path.dirname(destino)
+    os.makedirs(directorio, exist_ok=True)
+    # El temporal empieza por punto y lleva un punto en el nombre: ni sudo (sudoers.d) ni
+    # los menús (.desktop) lo tienen en cuenta mientras existe
+    fd, temporal = tempfile.mkstemp(dir=directorio, prefix=f".{os.path.basename(destino)}.")
+    try:
+        with os.fdopen(fd, "wb") as salida, open(origen, "rb") as entrada:
+            shutil.copyfileobj(entrada, salida)
+            salida.flush()
+            if propietario: os.fchown(salida.fileno(), *propietario)
+            os.fchmod(salida.fileno(), modo)
+            os.fsync(salida.fileno())
+        if validar:
+            comprobacion = guadamint_perfil.run(validar + [temporal], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            if comprobacion.returncode != 0:
+                raise RuntimeError(f"{' '.join(validar)} rechaza el archivo: {comprobacion.stdout.strip()}")
+        os.replace(temporal, destino)
+    except BaseException:
+        try: os.unlink(temporal)
+        except OSError: pass
+        raise
+
+def desplegar(origen, destino, modo, manifiesto, propietario=None, validar=None):
+    """Instala 'origen' en 'destino' si hace falta. Devuelve True si se ha escrito el destino."""
+    entrada = manifiesto.get(destino)
+    dueno = list(propietario) if propietario else None
+    st_origen = os.stat(origen)
+    try: st_destino = os.stat(destino)
+    except FileNotFoundError: st_destino = None
+
+    destino_intacto = st_destino is not None and entrada is not None and entrada["destino"] == _firma(st_destino)
+    if destino_intacto and entrada["origen"] == _firma(st_origen) and entrada["modo"] == modo \
+       and entrada.get("propietario") == dueno:
+        return False  # Nada ha cambiado: ni siquiera se leen los archivos
+
+    contenido = hash_archivo(origen)
+    permisos_ok = st_destino is not None and (st_destino.st_mode & 0o7777) == modo and \
+        (dueno is None or [st_destino.st_uid, st_destino.st_gid] == dueno)
+    if permisos_ok:
+        # El origen se ha reescrito (p. ej. por git) o no hay registro: basta con comparar hashes
+        if (destino_intacto and entrada["sha256"] == contenido) or \
+           (not destino_intacto and hash_archivo(destino) == contenido):
+            manifiesto[destino] = {"sha256": contenido, "modo": modo, "propietario": dueno,
+                                   "origen": _firma(st_origen), "destino": _firma(st_destino)}
+            return False
+
+    instalar_atomico(origen, destino, modo, propietario, validar)
+    manifiesto[destino] = {"sha256": contenido, "modo": modo, "propietario": dueno,
+                           "origen": _firma(st_origen), "destino": _firma(os.stat(destino))}
+    return True
+
+def retirar_obsoletos(entradas, raiz, manifiesto, log=None):
+    """Borra los archivos desplegados desde un árbol de 'entradas' cuyo origen ya no está en el
+    repositorio (un módulo guadamint_*.py que quedara en /usr/lib/guadamint seguiría siendo
+    importable) y los quita del manifiesto. Solo toca lo que figura en el manifiesto: lo que se
+    haya puesto a mano en esos directorios se respeta. Devuelve las rutas borradas."""
+    log = log or logger.info
+    # Si falta el árbol entero en el repositorio es que el checkout está mal, no que se haya vaciado
+    arboles = [e for e in entradas if e["origen"].endswith("/") and os.path.isdir(os.path.join(raiz, e["origen"]))]
+    if not arboles: return []
+    vigentes = {destino for _, _, destino in expandir(entradas, raiz)}
+    borrados = []
+    for destino in sorted(manifiesto):
+        if destino in vigentes: continue
+        if not any(destino.startswith(e["destino"]) and fnmatch.fnmatch(os.path.basename(destino), e.get("patron", "*"))
+                   for e in arboles):
+            continue
+        try:
+            os.unlink(destino)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log(f"!!! No se pudo borrar {destino}: {e}")
+            continue  # Sigue en el manifiesto: se reintenta en la próxima sincronización
+        del manifiesto[destino]
+        borrados.append(destino)
+    return borrados
@@ -0,0 +1,64 @@
+"""
+Cadena de fuentes (mirrors) del repositorio GuadaMint.
+
+En la sección [fuentes] de guadamint.conf se declara una fuente por línea, en orden
+de preferencia, con un timeout opcional en segundos:
+
+    [fuentes]
+    urls =
+        git://servidor-aula/guadamint.git 3
+        file:///srv/nfs/guadamint.git 2
+        https://github.com/aosucas499/guadamint.git 15
+
+Sirve cualquier URL que entienda git (git daemon, HTTP smart server, file://...).
+La primera fuente que responde dentro de su timeout es la que se usa; si falla
+la descarga desde ella se pasa a la siguiente.
+"""
+import os
+import subprocess
+
+from guadamint_config import leer_config
+import guadamint_perfil
+from guadamint_perfil import fase
+
+TIMEOUT_DEFECTO = 10
+
+def leer_fuentes(url_defecto, config=None):
+    """Lista ordenada de (url, timeout). Si no hay fuentes configuradas, solo url_defecto."""
+    config = config or leer_config()
+    timeout_defecto = config.getint("fuentes", "timeout", fallback=TIMEOUT_DEFECTO)
+    fuentes = []
+    for linea in config.get("fuentes", "urls", fallback="").splitlines():
+        partes = linea.split()
+        if not partes or partes[0].startswith("#"): continue
+        try: timeout = int(partes[1]) if len(partes) > 1 else timeout_defecto
+        except ValueError: timeout = timeout_defecto
+        fuentes.append((partes[0], timeout))
+    return fuentes or [(url_defecto, timeout_defecto)]
+
+def entorno_git():
+    env = os.environ.copy()
+    env["GIT_TERMINAL_PROMPT"] = "0"  # Nunca esperar credenciales de una fuente mal configurada
+    return env
+
+def consultar_fuente(url, rama, timeout):
+    """Hash de refs/heads/<rama> en la fuente, o None si no responde a tiempo o no tiene la rama."""
+    with fase("git.ls-remote", fuente=url) as registro:
+        try:
+            salida = guadamint_perfil.run(["git", "ls-remote", url, f"refs/heads/{rama}"], stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, timeout=timeout, env=entorno_git())
+            if salida.returncode == 0 and salida.stdout.split():
+                return salida.stdout.split()[0]
+        except (subprocess.TimeoutExpired, OSError):
+            pass
+        registro["ok"] = False
+        return None
+
+def fuentes_disponibles(rama, url_defecto, aviso=None):
+    """Generador de (url, timeout, hash) de las fuentes que responden, en orden de preferencia."""
+    for url, timeout in leer_fuentes(url_defecto):
+        remote_hash = consultar_fuente(url, rama, timeout)
+        if remote_hash:
+            yield url, timeout, remote_hash
+        elif aviso:
+            aviso(f"!!! Fuente sin respuesta ({timeout}s): {url}")
@@ -0,0 +1,77 @@
+"""
+Log común del actualizador y la tienda.
+
+Quien escribe solo deja el mensaje en una cola (QueueHandler); un hilo aparte lo vuelca
+al archivo, que se mantiene abierto y rota por tamaño (RotatingFileHandler). El buffer
+no se vacía en cada línea sino cuando la cola se queda vacía, así que una instalación
+que suelta miles de líneas de apt-get no cuesta una apertura y una escritura por línea.
+
+Todos los módulos escriben en el logger "guadamint".
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+TAMANO_MAX = 2 * 1024 * 1024
+COPIAS = 3
+
+logger = logging.getLogger("guadamint")
+_escritor = None
+
+class _ArchivoDiferido(logging.handlers.RotatingFileHandler):
+    """No vacía el buffer tras cada registro: lo hace el hilo escritor cuando no queda nada en cola."""
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        self.acquire()
+        try:
+            if self.stream: self.stream.flush()
+        finally:
+            self.release()
+
+class _Entrada(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Solo se fija el texto del mensaje (sus argumentos podrían cambiar después); el
+        # formato completo, con la fecha, lo aplica el hilo escritor. Este handler es el
+        # único del logger, así que no hace falta copiar el registro.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class _Escritor(logging.handlers.QueueListener):
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers: handler.vaciar()
+        return self.queue.get(block)
+
+def configurar_log(archivo, formato="%(asctime)s - %(levelname)s - %(message)s", fecha=None):
+    """Envía el logger "guadamint" a 'archivo' a través del hilo escritor. Devuelve el logger."""
+    global _escritor
+    if _escritor: return logger
+    try:
+        os.makedirs(os.path.dirname(archivo), exist_ok=True)
+        handler = _ArchivoDiferido(archivo, maxBytes=TAMANO_MAX, backupCount=COPIAS, encoding="utf-8")
+    except OSError:
+        return logger  # Sin permisos sobre el log: los mensajes siguen saliendo por pantalla
+    handler.setFormatter(logging.Formatter(formato, fecha))
+    cola = queue.SimpleQueue()
+    _escritor = _Escritor(cola, handler)
+    _escritor.entrada = _Entrada(cola)
+    logger.addHandler(_escritor.entrada)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _escritor.start()
+    atexit.register(cerrar_log)
+    return logger
+
+def cerrar_log():
+    """Vuelca lo pendiente y cierra el archivo. Hay que llamarla antes de un exec()."""
+    global _escritor
+    if not _escritor: return
+    logger.removeHandler(_escritor.entrada)
+    _escritor.stop()
+    for handler in _escritor.handlers: handler.close()
+    _escritor = None
@@ -0,0 +1,144 @@
+"""
+Tiempos por fase del actualizador y de la tienda.
+
+Cada fase medida con fase() se escribe como una línea JSON en un archivo junto al log de
+texto (p. ej. /var/log/guadamint/actualizador-tiempos.jsonl), con su duración y el número
+de subprocesos lanzados dentro de ella. El archivo rota por tamaño igual que el log de
+texto. Con varios equipos basta juntar esos archivos para saber si un inicio de sesión
+lento se debe a git, a dpkg, a apt o a las notificaciones.
+
+Los subprocesos se cuentan cuando se lanzan con run(), check_output() o Popen de este
+módulo (mismos argumentos que los de subprocess), que es lo que usan los módulos de
+GuadaMint; subprocess queda intacto para el resto del proceso.
+
+Las fases se pueden anidar y usar desde varios hilos: cada hilo lleva su propia pila. Un
+hilo lanzado con con_fases() parte de una copia de la pila de quien lo crea, de modo que
+sus subprocesos cuentan también en las fases que lo envuelven (p. ej. "total").
+"""
+import contextlib
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+
+from guadamint_log import TAMANO_MAX, COPIAS
+
+logger = logging.getLogger("guadamint")
+
+_local = threading.local()
+_cerrojo = threading.Lock()
+_registros = []
+_config = {"programa": None, "archivo": None, "ejecucion": None, "equipo": socket.gethostname()}
+_subprocesos = 0
+# Identificador de ejecución heredado a través de un exec (reinicio del actualizador)
+ENTORNO_EJECUCION = "GUADAMINT_EJECUCION"
+
+def _pila():
+    if not hasattr(_local, "pila"): _local.pila = []
+    return _local.pila
+
+def con_fases(funcion):
+    """Envuelve 'funcion' para ejecutarla en otro hilo heredando las fases abiertas ahora."""
+    heredada = list(_pila())
+    def envoltura(*args, **kwargs):
+        _local.pila = list(heredada)
+        return funcion(*args, **kwargs)
+    return envoltura
+
+# ==============================================================================
+# SUBPROCESOS
+# ==============================================================================
+def _contar_subproceso():
+    """Anota un proceso lanzado en las fases abiertas del hilo actual."""
+    global _subprocesos
+    with _cerrojo:
+        _subprocesos += 1
+        for registro in _pila(): registro["subprocesos"] += 1
+
+class Popen(subprocess.Popen):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _contar_subproceso()
+
+def run(*args, **kwargs):
+    _contar_subproceso()
+    return subprocess.run(*args, **kwargs)
+
+def check_output(*args, **kwargs):
+    _contar_subproceso()
+    return subprocess.check_output(*args, **kwargs)
+
+# ==============================================================================
+# REGISTROS
+# ==============================================================================
+def iniciar(programa, archivo):
+    """Activa la escritura de registros en 'archivo'. Tras conservar_ejecucion() y un exec,
+    sigue con el mismo identificador de ejecución que el proceso anterior."""
+    ejecucion = os.environ.pop(ENTORNO_EJECUCION, None) or f"{_config['equipo']}-{os.getpid()}-{int(time.time())}"
+    _config.update(programa=programa, archivo=archivo, ejecucion=ejecucion)
+
+def conservar_ejecucion():
+    """Pasa el identificador de ejecución al proceso que sustituya a este con exec."""
+    if _config["ejecucion"]: os.environ[ENTORNO_EJECUCION] = _config["ejecucion"]
+
+def _rotar(archivo):
+    """archivo -> archivo.1 -> ... -> archivo.COPIAS, como el RotatingFileHandler del log de texto."""
+    for n in range(COPIAS - 1, 0, -1):
+        if os.path.exists(f"{archivo}.{n}"): os.replace(f"{archivo}.{n}", f"{archivo}.{n + 1}")
+    os.replace(archivo, f"{archivo}.1")
+
+def registrar(registro):
+    registro.update(ts=round(time.time(), 3), programa=_config["programa"], equipo=_config["equipo"],
+                    ejecucion=_config["ejecucion"], hilo=threading.current_thread().name)
+    with _cerrojo:
+        _registros.append(registro)
+        if not _config["archivo"]: return
+        try:
+            linea = json.dumps(registro, ensure_ascii=False) + "\n"
+            try:
+                if os.path.getsize(_config["archivo"]) + len(linea) > TAMANO_MAX: _rotar(_config["archivo"])
+            except FileNotFoundError:
+                pass
+            with open(_config["archivo"], "a") as f: f.write(linea)
+        except OSError as e:
+            logger.warning(f"!!! No se pueden guardar los tiempos en {_config['archivo']}: {e}")
+            _config["archivo"] = None
+
+@contextlib.contextmanager
+def fase(nombre, **datos):
+    """Mide el bloque. El registro se entrega al bloque por si quiere añadir datos."""
+    registro = {"fase": nombre, "subprocesos": 0}
+    registro.update(datos)
+    pila = _pila()
+    pila.append(registro)
+    inicio = time.monotonic()
+    try:
+        yield registro
+        registro.setdefault("ok", True)
+    except BaseException as e:
+        registro.update(ok=False, error=type(e).__name__)
+        raise
+    finally:
+        pila.pop()
+        registro["duracion"] = round(time.monotonic() - inicio, 4)
+        registrar(registro)
+
+def resumen():
+    """Tabla de texto con el tiempo y los subprocesos de cada fase de esta ejecución."""
+    fases = {}
+    with _cerrojo:
+        for r in _registros:
+            f = fases.setdefault(r["fase"], {"veces": 0, "total": 0.0, "maximo": 0.0, "subprocesos": 0})
+            f["veces"] += 1
+            f["total"] += r["duracion"]
+            f["maximo"] = max(f["maximo"], r["duracion"])
+            f["subprocesos"] += r["subprocesos"]
+        total_subprocesos = _subprocesos
+    lineas = [f"{'FASE':<24} {'VECES':>5} {'TOTAL (s)':>10} {'MÁX (s)':>9} {'SUBPROC':>8}"]
+    for nombre, f in sorted(fases.items(), key=lambda item: -item[1]["total"]):
+        lineas.append(f"{nombre:<24} {f['veces']:>5} {f['total']:>10.3f} {f['maximo']:>9.3f} {f['subprocesos']:>8}")
+    lineas.append(f"Subprocesos lanzados en total: {total_subprocesos}")
+    return "\n".join(lineas)
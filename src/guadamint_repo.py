@@ -0,0 +1,212 @@
+"""
+Repositorio de paquetes del aula.
+
+Un equipo (el del profesor o un servidor del centro) publica los .deb que ya tiene en su
+caché de APT en un directorio con índice Packages, Packages.gz y Release: un repositorio
+"plano" que además sirve tal cual como fuente de APT (deb [trusted=yes] URL ./). El
+índice se regenera de forma incremental: solo se abre con dpkg-deb y se calcula el hash
+de los .deb nuevos.
+
+Los demás equipos, antes de cada apt-get install, preguntan a APT qué archivos exactos
+va a descargar (--print-uris) y copian a su caché los que el aula tenga con el mismo
+hash. apt-get ya no los descarga y lo que falte sigue llegando de Internet, así que un
+aula de 25 equipos baja cada paquete una sola vez y nunca se instala una versión
+distinta de la que APT habría elegido.
+
+Configuración en la sección [aula] de guadamint.conf. Para servirlo por HTTP basta con:
+    python3 guadamint_repo.py --servir /srv/guadamint/debs 8080
+"""
+import contextlib
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+import urllib.parse
+
+from guadamint_config import leer_config
+from guadamint_apt import CACHE_APT, uris_necesarias
+import guadamint_perfil
+
+TIMEOUT_AULA = 5
+INDICE_CACHE = ".guadamint-indice.json"  # Campos de control y hashes ya calculados, por .deb
+
+logger = logging.getLogger("guadamint")
+
+# ==============================================================================
+# PUBLICACIÓN
+# ==============================================================================
+def _hashes(ruta):
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""):
+            md5.update(bloque)
+            sha256.update(bloque)
+    return md5.hexdigest(), sha256.hexdigest()
+
+def _escribir(ruta, datos):
+    with open(ruta + ".tmp", "wb") as f: f.write(datos)
+    os.replace(ruta + ".tmp", ruta)
+
+@contextlib.contextmanager
+def _bloqueo(directorio):
+    fd = os.open(os.path.join(directorio, ".lock"), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def reindexar(directorio, log=None):
+    """Regenera Packages, Packages.gz y Release si ha cambiado algún .deb. Devuelve el nº de paquetes."""
+    log = log or logger.info
+    ruta_cache = os.path.join(directorio, INDICE_CACHE)
+    try:
+        with open(ruta_cache) as f: cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    nuevo, cambios = {}, False
+    for ruta in sorted(glob.glob(os.path.join(directorio, "*.deb"))):
+        nombre = os.path.basename(ruta)
+        st = os.stat(ruta)
+        firma = [st.st_size, st.st_mtime_ns]
+        entrada = cache.get(nombre)
+        if entrada is None or entrada["firma"] != firma:
+            try:
+                control = guadamint_perfil.check_output(["dpkg-deb", "--field", ruta], text=True, stderr=subprocess.DEVNULL)
+            except (subprocess.CalledProcessError, OSError):
+                log(f"!!! Aula: {nombre} no es un paquete válido, se omite.")
+                continue
+            md5, sha256 = _hashes(ruta)
+            entrada = {"firma": firma, "stanza": control.strip() + f"\nFilename: ./{nombre}\nSize: {st.st_size}"
+                       f"\nMD5sum: {md5}\nSHA256: {sha256}\n"}
+            cambios = True
+        nuevo[nombre] = entrada
+    cambios = cambios or set(nuevo) != set(cache)
+    if not cambios and os.path.exists(os.path.join(directorio, "Release")):
+        return len(nuevo)
+
+    packages = "\n".join(e["stanza"] for e in nuevo.values()).encode("utf-8")
+    packages_gz = gzip.compress(packages, mtime=0)
+    _escribir(os.path.join(directorio, "Packages"), packages)
+    _escribir(os.path.join(directorio, "Packages.gz"), packages_gz)
+    release = ["Origin: GuadaMint", "Label: GuadaMint aula",
+               "Date: " + time.strftime("%a, %d %b %Y %H:%M:%S UTC", time.gmtime())]
+    for campo, algoritmo in (("MD5Sum", hashlib.md5), ("SHA256", hashlib.sha256)):
+        release.append(f"{campo}:")
+        for nombre, datos in (("Packages", packages), ("Packages.gz", packages_gz)):
+            release.append(f" {algoritmo(datos).hexdigest()} {len(datos)} {nombre}")
+    _escribir(os.path.join(directorio, "Release"), ("\n".join(release) + "\n").encode("utf-8"))
+    _escribir(ruta_cache, json.dumps(nuevo).encode("utf-8"))
+    log(f">>> Aula: índice regenerado ({len(nuevo)} paquetes).")
+    return len(nuevo)
+
+def publicar(directorio, origen=CACHE_APT, log=None):
+    """Añade al repositorio del aula los .deb de la caché de APT que aún no tenga y reindexa."""
+    log = log or logger.info
+    os.makedirs(directorio, exist_ok=True)
+    with _bloqueo(directorio):
+        nuevos = 0
+        for ruta in glob.glob(os.path.join(origen, "*.deb")):
+            destino = os.path.join(directorio, os.path.basename(ruta))
+            if os.path.exists(destino): continue
+            temporal = os.path.join(directorio, ".nuevo-" + os.path.basename(ruta))
+            try:
+                try: os.link(ruta, temporal)  # Mismo sistema de archivos: sin copiar datos
+                except OSError: shutil.copy2(ruta, temporal)
+                os.replace(temporal, destino)
+                nuevos += 1
+            except OSError as e:
+                log(f"!!! Aula: no se pudo publicar {ruta}: {e}")
+        if nuevos: log(f">>> Aula: {nuevos} paquete(s) nuevos publicados en {directorio}.")
+        return reindexar(directorio, log)
+
+# ==============================================================================
+# CONSUMO
+# ==============================================================================
+def _abrir(fuente, nombre, timeout):
+    """Abre un archivo del repositorio del aula, sea una ruta, file:// o http(s)://."""
+    if fuente.startswith(("http://", "https://")):
+        from urllib.request import urlopen  # Solo aquí: cuesta más de 20 ms y la tienda por línea de comandos arranca sin él
+        return urlopen(fuente.rstrip("/") + "/" + urllib.parse.quote(nombre), timeout=timeout)
+    ruta = urllib.parse.urlparse(fuente).path if fuente.startswith("file://") else fuente
+    return open(os.path.join(ruta, nombre), "rb")
+
+def leer_indice(fuente, timeout=TIMEOUT_AULA):
+    """{hash: archivo} con los SHA256 y MD5 de todos los paquetes del aula."""
+    with _abrir(fuente, "Packages.gz", timeout) as f:
+        texto = gzip.decompress(f.read()).decode("utf-8", errors="replace")
+    indice = {}
+    for stanza in texto.split("\n\n"):
+        campos = dict(linea.split(": ", 1) for linea in stanza.splitlines() if ": " in linea and not linea[0].isspace())
+        if "Filename" not in campos: continue
+        archivo = campos["Filename"][2:] if campos["Filename"].startswith("./") else campos["Filename"]
+        for campo in ("SHA256", "MD5sum"):
+            if campo in campos: indice[campos[campo].lower()] = archivo
+    return indice
+
+def traer_del_aula(paquetes, fuente, destino=CACHE_APT, timeout=TIMEOUT_AULA, log=None):
+    """Copia a la caché de APT los .deb que 'paquetes' necesita y el aula tiene. Devuelve cuántos."""
+    log = log or logger.info
+    necesarios = [(archivo, tamano, algoritmo, valor) for uri, archivo, tamano, algoritmo, valor in uris_necesarias(paquetes)]
+    if not necesarios: return 0
+    try:
+        indice = leer_indice(fuente, timeout)
+    except (OSError, ValueError) as e:
+        log(f"!!! Aula: repositorio no disponible ({fuente}): {e}")
+        return 0
+
+    copiados = 0
+    for archivo, tamano, algoritmo, valor in necesarios:
+        if algoritmo not in ("sha256", "md5sum") or valor not in indice: continue
+        temporal = os.path.join(destino, "partial", archivo + ".aula")
+        comprobacion = hashlib.sha256() if algoritmo == "sha256" else hashlib.md5()
+        try:
+            os.makedirs(os.path.dirname(temporal), exist_ok=True)
+            with _abrir(fuente, indice[valor], timeout) as entrada, open(temporal, "wb") as salida:
+                for bloque in iter(lambda: entrada.read(1 << 16), b""):
+                    comprobacion.update(bloque)
+                    salida.write(bloque)
+            if comprobacion.hexdigest() != valor or os.path.getsize(temporal) != tamano:
+                raise ValueError("el hash no coincide")
+            os.replace(temporal, os.path.join(destino, archivo))
+            copiados += 1
+        except (OSError, ValueError) as e:
+            log(f"!!! Aula: no se pudo traer {archivo}: {e}")
+            try: os.unlink(temporal)
+            except OSError: pass
+    if copiados: log(f">>> Aula: {copiados} de {len(necesarios)} paquete(s) copiados del repositorio del aula.")
+    return copiados
+
+def preparar_instalacion(paquetes, log=None):
+    """Punto de entrada antes de un apt-get install: no hace nada si no hay [aula] fuente."""
+    config = leer_config()
+    fuente = config.get("aula", "fuente", fallback="").strip()
+    if not fuente or not paquetes: return 0
+    try:
+        return traer_del_aula(paquetes, fuente, timeout=config.getint("aula", "timeout", fallback=TIMEOUT_AULA), log=log)
+    except Exception as e:
+        (log or logger.warning)(f"!!! Aula: {e}")
+        return 0
+
+def publicar_configurado(log=None):
+    """Publica la caché de APT si este equipo tiene [aula] publicar."""
+    directorio = leer_config().get("aula", "publicar", fallback="").strip()
+    if directorio: publicar(directorio, log=log)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "--servir":
+        import functools, http.server
+        puerto = int(sys.argv[3]) if len(sys.argv) > 3 else 8080
+        manejador = functools.partial(http.server.SimpleHTTPRequestHandler, directory=sys.argv[2])
+        http.server.ThreadingHTTPServer(("", puerto), manejador).serve_forever()
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--publicar":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        publicar(sys.argv[2])
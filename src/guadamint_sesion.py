@@ -0,0 +1,230 @@
+"""
+Acceso a la sesión gráfica del usuario real desde procesos que corren como root.
+
+El entorno de la sesión (DBUS_SESSION_BUS_ADDRESS, DISPLAY) se busca una sola vez
+recorriendo /proc y se memoriza mientras el proceso del que se sacó siga vivo.
+Los avisos de escritorio pasan por un broker que corre dentro de la sesión.
+"""
+import json
+import os
+import pwd
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import guadamint_perfil
+
+_CACHE_ENTORNO = {}  # usuario -> (pid, inicio del proceso, entorno)
+_LOCK_ENTORNO = threading.Lock()
+_LOCK_BROKER = threading.Lock()
+
+def obtener_usuario_real():
+    """Usuario que lanzó el proceso con sudo o pkexec."""
+    usuario = os.environ.get('SUDO_USER')
+    if not usuario and os.environ.get('PKEXEC_UID'):
+        try: usuario = pwd.getpwuid(int(os.environ['PKEXEC_UID'])).pw_name
+        except (KeyError, ValueError): pass
+    return usuario
+
+def _inicio_proceso(pid):
+    """Instante de arranque del proceso (campo 22 de /proc/<pid>/stat): distingue PIDs reutilizados."""
+    with open(f"/proc/{pid}/stat", "rb") as f:
+        campos = f.read().rsplit(b")", 1)[1].split()
+    if campos[0] in (b"Z", b"X"): raise ProcessLookupError(pid)
+    return campos[19]
+
+def _leer_entorno_sesion(pid):
+    with open(f"/proc/{pid}/environ", "rb") as f: content = f.read().decode("utf-8", errors="ignore")
+    env_vars = {}
+    for item in content.split('\0'):
+        if item.startswith("DBUS") or item.startswith("DISPLAY"):
+            k, v = item.split("=", 1)
+            env_vars[k] = v
+    return env_vars
+
+def _buscar_sesion(uid):
+    """Equivale a 'pgrep -u <uid> -f session' + lectura de environ, sin lanzar procesos."""
+    env_vars = {}
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit(): continue
+        try:
+            if os.stat(f"/proc/{entrada}").st_uid != uid: continue
+            with open(f"/proc/{entrada}/cmdline", "rb") as f:
+                if b"session" not in f.read(): continue
+            env_vars.update(_leer_entorno_sesion(entrada))
+            if 'DBUS_SESSION_BUS_ADDRESS' in env_vars:
+                return int(entrada), env_vars
+        except OSError:
+            continue
+    return None, env_vars
+
+def obtener_entorno_usuario(usuario):
+    """Variables DISPLAY/DBUS de la sesión de 'usuario' (DISPLAY=:0 si no se encuentra)."""
+    with _LOCK_ENTORNO:
+        if usuario in _CACHE_ENTORNO:
+            pid, inicio, env_vars = _CACHE_ENTORNO[usuario]
+            try:
+                if _inicio_proceso(pid) == inicio: return dict(env_vars)
+            except OSError:
+                pass
+            del _CACHE_ENTORNO[usuario]
+
+        env_vars = {'DISPLAY': ':0'}
+        try:
+            pid, encontradas = _buscar_sesion(pwd.getpwnam(usuario).pw_uid)
+            env_vars.update(encontradas)
+            if pid: _CACHE_ENTORNO[usuario] = (pid, _inicio_proceso(pid), dict(env_vars))
+        except (KeyError, OSError):
+            pass
+        return env_vars
+
+# ==============================================================================
+# AVISOS DE ESCRITORIO (BROKER POR SESIÓN)
+# ==============================================================================
+# En la sesión del usuario corre un único proceso ("broker") que escucha en un socket
+# Unix. El actualizador y la tienda le envían los avisos como líneas JSON; así solo se
+# paga un 'sudo -u' por sesión y las ráfagas se agrupan en una sola burbuja.
+VENTANA_AGRUPACION = 1.5   # Segundos que se esperan a más avisos antes de mostrar
+INACTIVIDAD_BROKER = 3600  # El broker termina tras este tiempo sin avisos
+MAX_AVISOS_RESUMEN = 4     # Elementos que se listan en un aviso agrupado
+
+def ruta_socket(uid):
+    runtime = f"/run/user/{uid}"
+    if os.path.isdir(runtime): return os.path.join(runtime, "guadamint-avisos.sock")
+    return f"/tmp/guadamint-avisos-{uid}.sock"
+
+def agrupar_avisos(avisos):
+    """Une los avisos de un mismo 'grupo' en uno solo ("3 apps instaladas: ..."). Conserva el orden.
+    Solo se unen si además llevan el mismo icono: un error no se esconde bajo un aviso informativo."""
+    grupos = {}
+    for aviso in avisos:
+        clave = (aviso["grupo"], aviso.get("icono")) if aviso.get("grupo") else id(aviso)
+        grupos.setdefault(clave, []).append(aviso)
+    resultado = []
+    for lista in grupos.values():
+        primero = lista[0]
+        if len(lista) == 1:
+            resultado.append(primero)
+            continue
+        elementos = [a.get("elemento") or a["mensaje"] for a in lista]
+        mensaje = ", ".join(elementos[:MAX_AVISOS_RESUMEN])
+        if len(elementos) > MAX_AVISOS_RESUMEN: mensaje += f" y {len(elementos) - MAX_AVISOS_RESUMEN} más"
+        resumen = primero.get("resumen") or "{n} avisos nuevos"
+        resultado.append(dict(primero, mensaje=f"{resumen.format(n=len(lista))}:\n{mensaje}"))
+    return resultado
+
+def _mostrar_burbuja(aviso):
+    try:
+        guadamint_perfil.Popen(['notify-send', '-a', aviso.get("app", "GuadaMint"), '-i', aviso.get("icono", "dialog-information"),
+                                aviso["titulo"], aviso["mensaje"]], stderr=subprocess.DEVNULL)
+    except OSError:
+        pass
+
+def _cliente_autorizado(conexion):
+    # Solo se aceptan avisos de root o del propio usuario de la sesión
+    pid, uid, gid = struct.unpack("3i", conexion.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    return uid in (0, os.getuid())
+
+def servir_avisos():
+    """Bucle del broker. Se ejecuta como el usuario de la sesión: guadamint_sesion.py --broker"""
+    ruta = ruta_socket(os.getuid())
+    if _enviar(ruta, None): return  # Ya hay un broker atendiendo esta sesión
+    try: os.unlink(ruta)
+    except FileNotFoundError: pass
+    os.umask(0o077)
+    servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    servidor.bind(ruta)
+    servidor.listen(16)
+
+    pendientes = []
+    primero = None
+    try:
+        while True:
+            if pendientes: servidor.settimeout(max(0, primero + VENTANA_AGRUPACION - time.monotonic()))
+            else: servidor.settimeout(INACTIVIDAD_BROKER)
+            try:
+                conexion, _ = servidor.accept()
+            except socket.timeout:
+                if not pendientes: break
+                for aviso in agrupar_avisos(pendientes): _mostrar_burbuja(aviso)
+                pendientes, primero = [], None
+                continue
+            with conexion:
+                try:
+                    if not _cliente_autorizado(conexion): continue
+                    conexion.settimeout(2)
+                    datos = b""
+                    while len(datos) < 65536:
+                        bloque = conexion.recv(4096)
+                        if not bloque: break
+                        datos += bloque
+                except OSError:
+                    continue
+            for linea in datos.decode("utf-8", errors="replace").splitlines():
+                try: aviso = json.loads(linea)
+                except ValueError: continue
+                if isinstance(aviso, dict) and "titulo" in aviso and "mensaje" in aviso:
+                    pendientes.append(aviso)
+            if pendientes and primero is None: primero = time.monotonic()
+    finally:
+        servidor.close()
+        try: os.unlink(ruta)
+        except OSError: pass
+
+def _enviar(ruta, aviso, uid=None):
+    """Envía un aviso al broker (o solo comprueba que responde si aviso es None)."""
+    try:
+        if uid is not None and os.stat(ruta).st_uid != uid: return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as cliente:
+            cliente.settimeout(2)
+            cliente.connect(ruta)
+            if aviso is not None: cliente.sendall((json.dumps(aviso) + "\n").encode("utf-8"))
+        return True
+    except OSError:
+        return False
+
+def _lanzar_broker(usuario, uid):
+    entorno = obtener_entorno_usuario(usuario)
+    variables = [f"{k}={v}" for k, v in entorno.items()] + [f"XDG_RUNTIME_DIR=/run/user/{uid}"]
+    guadamint_perfil.Popen(['sudo', '-u', usuario, 'env'] + variables + [sys.executable, os.path.abspath(__file__), '--broker'],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def enviar_aviso(titulo, mensaje, icono="dialog-information", app="GuadaMint", grupo=None, elemento=None, resumen=None):
+    """
+    Muestra una notificación en la sesión del usuario real. Los avisos con el mismo 'grupo'
+    que lleguen casi a la vez se agrupan; 'resumen' es la cabecera del aviso agrupado
+    (p. ej. "{n} apps instaladas") y 'elemento' lo que aporta cada aviso a la lista.
+    """
+    usuario = obtener_usuario_real()
+    if not usuario: return False
+    try: uid = pwd.getpwnam(usuario).pw_uid
+    except KeyError: return False
+    aviso = {"titulo": titulo, "mensaje": mensaje, "icono": icono, "app": app,
+             "grupo": grupo, "elemento": elemento, "resumen": resumen}
+    ruta = ruta_socket(uid)
+    if _enviar(ruta, aviso, uid): return True
+
+    with _LOCK_BROKER:
+        if _enviar(ruta, aviso, uid): return True
+        try:
+            _lanzar_broker(usuario, uid)
+            for _ in range(30):
+                time.sleep(0.1)
+                if _enviar(ruta, aviso, uid): return True
+        except OSError:
+            pass
+
+    # Último recurso: notificación directa, como antes del broker
+    entorno = os.environ.copy()
+    entorno.update(obtener_entorno_usuario(usuario))
+    try:
+        guadamint_perfil.Popen(['sudo', '-u', usuario, 'notify-send', '-a', app, '-i', icono, titulo, mensaje], env=entorno, stderr=subprocess.DEVNULL)
+    except OSError:
+        return False
+    return True
+
+if __name__ == "__main__":
+    if "--broker" in sys.argv: servir_avisos()
@@ -0,0 +1,286 @@
+"""
+Sincronización del repositorio GuadaMint en /opt/guadamint.
+
+La usan el actualizador y la tienda. Todo el trabajo sobre el árbol se hace con un
+flock: si llega una segunda petición mientras otra está en marcha, espera a que
+termine y reutiliza su resultado en lugar de repetir el fetch.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from guadamint_config import leer_config
+from guadamint_fuentes import fuentes_disponibles
+import guadamint_perfil
+from guadamint_perfil import fase
+
+# Fuente por defecto. Se pueden anteponer mirrors locales en guadamint.conf, sección [fuentes]
+REPO_URL = "https://github.com/aosucas499/guadamint.git"
+REPO_DIR = "/opt/guadamint"
+REPO_BRANCH = "main"
+
+# Modo de sincronización del repositorio:
+#   "ligero"   -> clon de profundidad 1, sin blobs (partial clone) y con checkout parcial (sparse)
+#   "completo" -> clon tradicional con todo el historial y todos los archivos
+MODO_SYNC = "ligero"
+# Patrones (no-cone) del checkout parcial: todo src/ (scripts, módulos y src/scripts), de
+# modo que un archivo nuevo llega siempre junto a la versión que lo usa, y el icono que
+# se despliega en el sistema. El resto de images/ y vendors/ no se descargan.
+RUTAS_SPARSE = ["/src/", "/images/guadamintuz.svg"]
+# Segundos durante los que se confía en la última consulta al remoto (configurable en
+# guadamint.conf, sección [actualizador], clave ttl_comprobacion). Con forzar se ignora.
+TTL_COMPROBACION = 3600
+
+ESTADO_DIR = "/var/lib/guadamint"
+ESTADO_REMOTO = os.path.join(ESTADO_DIR, "estado-remoto.json")
+ULTIMA_SYNC = os.path.join(ESTADO_DIR, "ultima-sync.json")
+LOCK_SYNC = "/run/lock/guadamint-sync.lock" if os.path.isdir("/run/lock") else "/tmp/guadamint-sync.lock"
+
+logger = logging.getLogger("guadamint")
+
+# ==============================================================================
+# OPERACIONES GIT
+# ==============================================================================
+def clonar_repositorio(destino, log):
+    """Clona desde la primera fuente que responda; si la descarga falla se prueba la siguiente."""
+    for url, timeout, remote_hash in fuentes_disponibles(REPO_BRANCH, REPO_URL, log):
+        try:
+            with fase("git.clone", fuente=url):
+                if MODO_SYNC != "ligero":
+                    guadamint_perfil.run(["git", "clone", "-b", REPO_BRANCH, url, destino], check=True)
+                else:
+                    guadamint_perfil.run(["git", "clone", "--depth", "1", "--filter=blob:none", "--no-checkout",
+                                          "-b", REPO_BRANCH, url, destino], check=True)
+                    guadamint_perfil.run(["git", "sparse-checkout", "set", "--no-cone"] + RUTAS_SPARSE, cwd=destino, check=True)
+                    # El checkout descarga de una vez solo los blobs de las rutas seleccionadas
+                    guadamint_perfil.run(["git", "checkout", REPO_BRANCH], cwd=destino, check=True, stderr=subprocess.DEVNULL)
+            log(f">>> Git: Fuente utilizada: {url}")
+            guardar_estado_remoto(remote_hash, url)
+            return
+        except subprocess.CalledProcessError as e:
+            log(f"!!! Error clonando desde {url}: {e}")
+            shutil.rmtree(destino, ignore_errors=True)
+    raise RuntimeError("Ninguna fuente del repositorio está disponible")
+
+def es_clon_ligero(repo):
+    try:
+        filtro = guadamint_perfil.run(["git", "config", "--get", "remote.origin.partialclonefilter"],
+                                      cwd=repo, stdout=subprocess.PIPE, text=True).stdout.strip()
+        return bool(filtro) and os.path.exists(os.path.join(repo, ".git/shallow"))
+    except Exception:
+        return False
+
+def patrones_sparse(repo):
+    try:
+        with open(os.path.join(repo, ".git/info/sparse-checkout")) as f:
+            return [l.strip() for l in f if l.strip()]
+    except OSError:
+        return []
+
+def ajustar_sparse(log):
+    """Si RUTAS_SPARSE ha cambiado se aplica sobre el clon existente: git pide al remoto solo
+    los blobs de las rutas nuevas, sin volver a clonar."""
+    log(">>> Git: Actualizando las rutas del checkout parcial...")
+    guadamint_perfil.run(["git", "sparse-checkout", "set", "--no-cone"] + RUTAS_SPARSE, cwd=REPO_DIR, check=True)
+
+def migrar_a_clon_ligero(log):
+    """Sustituye un clon completo antiguo por uno ligero. Si algo falla se conserva el antiguo."""
+    log(">>> Migrando el repositorio a clon ligero (shallow + sparse)...")
+    nuevo = REPO_DIR + ".nuevo"
+    antiguo = REPO_DIR + ".antiguo"
+    for ruta in (nuevo, antiguo):
+        if os.path.exists(ruta): shutil.rmtree(ruta)
+    clonar_repositorio(nuevo, log)
+    os.rename(REPO_DIR, antiguo)
+    os.rename(nuevo, REPO_DIR)
+    shutil.rmtree(antiguo, ignore_errors=True)
+
+def traer_cambios_remotos(url):
+    # 'origin' apunta siempre a la fuente elegida: en un partial clone los blobs que falten
+    # se piden a ese remoto, así que deben salir del mismo mirror
+    with fase("git.fetch", fuente=url):
+        guadamint_perfil.run(["git", "remote", "set-url", "origin", url], cwd=REPO_DIR, check=True)
+        if MODO_SYNC == "ligero":
+            guadamint_perfil.run(["git", "fetch", "--depth", "1", "--filter=blob:none", "origin", REPO_BRANCH],
+                                 cwd=REPO_DIR, check=True, stderr=subprocess.DEVNULL)
+        else:
+            guadamint_perfil.run(["git", "fetch", "origin"], cwd=REPO_DIR, check=True, stderr=subprocess.DEVNULL)
+
+def hash_de(referencia):
+    with fase("git.rev-parse"):
+        return guadamint_perfil.check_output(["git", "rev-parse", referencia], cwd=REPO_DIR, text=True).strip()
+
+def archivos_modificados(anterior, actual):
+    """Rutas (relativas al repo) que cambian entre dos commits, o None si no se puede saber
+    (primer clon, commit anterior ya no disponible...). Solo necesita los árboles, que el
+    clon ligero sí descarga."""
+    if not anterior or not actual: return None
+    try:
+        salida = guadamint_perfil.check_output(["git", "diff", "--name-only", "--no-renames", anterior, actual],
+                                               cwd=REPO_DIR, text=True, stderr=subprocess.DEVNULL)
+        return set(salida.splitlines())
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+# ==============================================================================
+# ESTADO PERSISTENTE
+# ==============================================================================
+def _leer_json(ruta):
+    try:
+        with open(ruta) as f: return json.load(f)
+    except Exception:
+        return {}
+
+def _guardar_json(ruta, datos):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + ".tmp", "w") as f: json.dump(datos, f)
+    os.replace(ruta + ".tmp", ruta)
+
+def leer_estado_remoto():
+    return _leer_json(ESTADO_REMOTO)
+
+def guardar_estado_remoto(remote_hash, fuente=None):
+    try:
+        _guardar_json(ESTADO_REMOTO, {"hash": remote_hash, "comprobado": time.time(), "fuente": fuente})
+    except Exception as e:
+        logger.warning(f"!!! No se pudo guardar el estado remoto: {e}")
+
+def _consulta_vigente(local_hash, forzar):
+    """Segundos desde la última consulta al remoto si aún vale (más reciente que el TTL y
+    coincide con HEAD), o None si hay que volver a consultar."""
+    ttl = leer_config().getint("actualizador", "ttl_comprobacion", fallback=TTL_COMPROBACION)
+    estado = leer_estado_remoto()
+    antiguedad = time.time() - estado.get("comprobado", 0)
+    if not forzar and estado.get("hash") == local_hash and 0 <= antiguedad < ttl: return antiguedad
+    return None
+
+def actualizar_desde_fuentes(local_hash, forzar, log):
+    """
+    Devuelve el hash de la rama remota. Si la última consulta es más reciente que el TTL y
+    coincide con HEAD, no se toca la red; si no, se consulta la cadena de fuentes con
+    'git ls-remote' (no descarga objetos) y solo se hace fetch si la rama se ha movido.
+    """
+    antiguedad = _consulta_vigente(local_hash, forzar)
+    if antiguedad is not None:
+        log(f">>> Git: Comprobado hace {int(antiguedad // 60)} min, se omite la consulta remota.")
+        return local_hash
+
+    for url, timeout, remote_hash in fuentes_disponibles(REPO_BRANCH, REPO_URL, log):
+        if remote_hash != local_hash:
+            try:
+                traer_cambios_remotos(url)
+            except subprocess.CalledProcessError as e:
+                log(f"!!! Error descargando desde {url}: {e}")
+                continue
+        log(f">>> Git: Fuente utilizada: {url}")
+        guardar_estado_remoto(remote_hash, url)
+        return remote_hash
+    raise RuntimeError("Ninguna fuente del repositorio está disponible")
+
+# ==============================================================================
+# SINCRONIZACIÓN
+# ==============================================================================
+def resumen_cambios(anterior, actual):
+    """Mensajes de commit entre dos versiones, limitado a 3 líneas para que quepa en una notificación.
+    (en modo ligero solo se conoce el último commit: el historial no se descarga)"""
+    try:
+        # Usamos --pretty=format:"• %s" para quitar el hash (números) y dejar solo el texto del mensaje
+        resumen_completo = guadamint_perfil.check_output(["git", "log", "--pretty=format:• %s", f"{anterior}..{actual}"], cwd=REPO_DIR, text=True).strip()
+        lineas = resumen_completo.split('\n')
+        if len(lineas) > 3:
+            return '\n'.join(lineas[:3]) + '\n... y más cambios.'
+        return resumen_completo
+    except Exception:
+        return "Nuevos archivos sincronizados."
+
+def requiere_red(forzar=False):
+    """True si sincronizar_repositorio va a salir a la red. No toma el bloqueo: sirve para
+    esperar antes (p. ej. el reparto de carga del actualizador) sin retener a la tienda."""
+    if not os.path.exists(REPO_DIR): return True
+    try:
+        if MODO_SYNC == "ligero" and (not es_clon_ligero(REPO_DIR) or patrones_sparse(REPO_DIR) != RUTAS_SPARSE):
+            return True
+        return _consulta_vigente(hash_de("HEAD"), forzar) is None
+    except Exception:
+        return True
+
+def _sincronizar(forzar, log):
+    resultado = {"ok": False, "anterior": None, "actual": None, "cambios": False,
+                 "primera_vez": False, "resumen": "", "error": ""}
+
+    # 1. Clonar si no existe
+    if not os.path.exists(REPO_DIR):
+        log(f">>> Clonando repositorio en {REPO_DIR}...")
+        resultado["primera_vez"] = True
+        try:
+            clonar_repositorio(REPO_DIR, log)
+            resultado.update(ok=True, cambios=True, actual=hash_de("HEAD"),
+                             resumen="Se ha descargado el sistema base por primera vez.")
+        except Exception as e:
+            log(f"!!! Error al clonar: {e}")
+            resultado["error"] = str(e)
+        return resultado
+
+    # 2. Actualizar el existente
+    try:
+        local_hash = hash_de("HEAD")
+        resultado["anterior"] = local_hash
+        if MODO_SYNC == "ligero" and not es_clon_ligero(REPO_DIR):
+            migrar_a_clon_ligero(log)
+            remote_hash = hash_de(f"origin/{REPO_BRANCH}")
+        else:
+            # Solo se descargan objetos si la rama remota se ha movido de verdad
+            remote_hash = actualizar_desde_fuentes(local_hash, forzar, log)
+            if MODO_SYNC == "ligero" and patrones_sparse(REPO_DIR) != RUTAS_SPARSE:
+                ajustar_sparse(log)
+            if remote_hash != local_hash:
+                with fase("git.checkout"):
+                    guadamint_perfil.run(["git", "checkout", REPO_BRANCH], cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                remote_hash = hash_de(f"origin/{REPO_BRANCH}")
+
+        if local_hash != remote_hash:
+            log(f">>> Git: Actualización detectada ({local_hash[:7]} -> {remote_hash[:7]})")
+            resultado["resumen"] = resumen_cambios(local_hash, remote_hash)
+            with fase("git.checkout"):
+                guadamint_perfil.run(["git", "reset", "--hard", f"origin/{REPO_BRANCH}"], cwd=REPO_DIR, check=True)
+            resultado["cambios"] = True
+        else:
+            log(">>> Git: El repositorio está al día.")
+        resultado.update(ok=True, actual=remote_hash)
+    except Exception as e:
+        log(f"!!! Error git: {e}")
+        resultado["error"] = str(e)
+    return resultado
+
+def sincronizar_repositorio(forzar=False, log=None, al_esperar=None):
+    """
+    Clona o actualiza REPO_DIR. Devuelve un dict con 'ok', 'anterior', 'actual', 'cambios',
+    'primera_vez', 'resumen', 'error' y 'reutilizado' (True si el trabajo lo hizo otro proceso
+    que ya estaba sincronizando). 'al_esperar' se llama si hay que esperar a otra sincronización.
+    """
+    log = log or logger.info
+    inicio = time.time()
+    fd = os.open(LOCK_SYNC, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log(">>> Hay otra sincronización en curso: esperando su resultado...")
+            if al_esperar: al_esperar()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            anterior = _leer_json(ULTIMA_SYNC)
+            if anterior.get("terminado", 0) >= inicio and anterior.get("ok"):
+                log(">>> Se reutiliza la sincronización que acaba de terminar.")
+                return dict(anterior, reutilizado=True)
+
+        resultado = _sincronizar(forzar, log)
+        resultado.update(terminado=time.time(), reutilizado=False)
+        try: _guardar_json(ULTIMA_SYNC, resultado)
+        except Exception as e: log(f"!!! No se pudo guardar el resultado de la sincronización: {e}")
+        return resultado
+    finally:
+        os.close(fd)  # Libera el flock
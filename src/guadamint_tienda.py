@@ -0,0 +1,305 @@
+"""
+Parte de la tienda (apps-guadamint.py) que no depende de GTK: el catálogo, las
+transacciones de APT y de los scripts de instalación, y el modo por línea de comandos
+para aplicar cambios en los equipos de un aula sin abrir la ventana:
+
+    apps-guadamint.py --install gcompris-qt,geogebra --remove vlc [--json]
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from guadamint_sync import REPO_DIR
+from guadamint_apt import (paquetes_instalados, paquetes_disponibles, detener_precarga, esperar_bloqueo_apt, nombre_proceso,
+                           ESPERA_TOTAL_BLOQUEO)
+from guadamint_config import leer_config
+from guadamint_repo import preparar_instalacion
+from guadamint_artefactos import preparar_artefactos
+import guadamint_perfil
+from guadamint_perfil import fase
+from guadamint_log import configurar_log
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+# Configuración de Logs
+if os.geteuid() == 0:
+    LOG_FILE = "/var/log/guadamint/tienda.log"
+else:
+    LOG_FILE = f"/tmp/guadamint-tienda-{os.getuid()}.log"
+# Tiempos por fase de las transacciones (JSON lines), junto al log
+TIEMPOS_FILE = os.path.splitext(LOG_FILE)[0] + "-tiempos.jsonl"
+
+# --- CATÁLOGO DE APLICACIONES ---
+CATALOGO = [
+    {
+        "categoria": "Educación Infantil y Primaria",
+        "apps": [
+            {"id": "gcompris-qt", "nombre": "GCompris", "desc": "Suite educativa (2-10 años)", "icono": "gcompris-qt"},
+            {"id": "tuxtype", "nombre": "Tux Typing", "desc": "Mecanografía infantil", "icono": "tuxtype"},
+            {"id": "tuxmath", "nombre": "Tux Math", "desc": "Matemáticas arcade", "icono": "tuxmath"},
+            {"id": "tuxpaint", "nombre": "Tux Paint", "desc": "Dibujo para niños", "icono": "tuxpaint"},
+            {"id": "kanagram", "nombre": "Kanagram", "desc": "Anagramas y vocabulario", "icono": "kanagram"},
+            {"id": "khangman", "nombre": "KHangMan", "desc": "Juego del ahorcado", "icono": "khangman"},
+        ]
+    },
+    {
+        "categoria": "Educación Secundaria y Bachillerato",
+        "apps": [
+            {"id": "geogebra", "nombre": "GeoGebra", "desc": "Matemáticas dinámicas", "icono": "geogebra"},
+            {"id": "stellarium", "nombre": "Stellarium", "desc": "Planetario virtual", "icono": "stellarium"},
+            {"id": "kalzium", "nombre": "Kalzium", "desc": "Tabla periódica", "icono": "kalzium"},
+            {"id": "step", "nombre": "Step", "desc": "Simulador físico", "icono": "step"},
+            {"id": "marble", "nombre": "Marble", "desc": "Globo terráqueo virtual", "icono": "marble"},
+            {"id": "kgeography", "nombre": "KGeography", "desc": "Geografía mundial", "icono": "kgeography"},
+            {"id": "kwordquiz", "nombre": "KWordQuiz", "desc": "Tarjetas de vocabulario", "icono": "kwordquiz"},
+            {"id": "celestia", "nombre": "Celestia", "desc": "Simulador espacial 3D", "icono": "celestia"},
+            {"id": "klavaro", "nombre": "Klavaro", "desc": "Curso de mecanografía", "icono": "klavaro"},
+            {"id": "gbrainy", "nombre": "GBrainy", "desc": "Juegos de lógica", "icono": "gbrainy"},
+        ]
+    },
+    {
+        "categoria": "Programación y Robótica",
+        "apps": [
+            {"id": "scratch", "nombre": "Scratch", "desc": "Programación visual", "icono": "scratch"},
+            {"id": "kturtle", "nombre": "KTurtle", "desc": "Programación Logo", "icono": "kturtle"},
+            {"id": "thonny", "nombre": "Thonny", "desc": "Python para principiantes", "icono": "thonny"},
+            {"id": "minetest", "nombre": "Minetest", "desc": "Mundo abierto (Minecraft libre)", "icono": "minetest"},
+            {"id": "fritzing", "nombre": "Fritzing", "desc": "Diseño de circuitos", "icono": "fritzing"},
+            {"id": "arduino", "nombre": "Arduino IDE", "desc": "Programación Arduino", "icono": "arduino"},
+        ]
+    },
+    {
+        "categoria": "Creatividad y Multimedia",
+        "apps": [
+            {"id": "audacity", "nombre": "Audacity", "desc": "Editor de audio", "icono": "audacity"},
+            {"id": "inkscape", "nombre": "Inkscape", "desc": "Diseño vectorial", "icono": "inkscape"},
+            {"id": "blender", "nombre": "Blender", "desc": "Animación 3D", "icono": "blender"},
+            {"id": "kdenlive", "nombre": "Kdenlive", "desc": "Editor de vídeo", "icono": "kdenlive"},
+            {"id": "obs-studio", "nombre": "OBS Studio", "desc": "Grabación de pantalla", "icono": "obs"},
+            {"id": "lmms", "nombre": "LMMS", "desc": "Producción musical", "icono": "lmms"},
+        ]
+    },
+    {
+        "categoria": "Utilidades y Navegadores",
+        "apps": [
+            {"id": "google-chrome-stable", "nombre": "Google Chrome", "desc": "Navegador oficial Google", "icono": "google-chrome", "script_install": "instalar_chrome.sh", "artefactos": ["chrome"]},
+            {"id": "smart-product-drivers", "nombre": "Drivers SMART Board", "desc": "Controladores para pizarras", "icono": "video-display", "script_install": "instalar_smartboard.sh", "artefactos": ["smartdre"]},
+            {"id": "gnome-network-displays", "nombre": "Pantallas Wifi", "desc": "Proyección inalámbrica", "icono": "preferences-desktop-display"},
+            {"id": "vlc", "nombre": "VLC", "desc": "Reproductor multimedia", "icono": "vlc"},
+            {"id": "chromium-browser", "nombre": "Chromium", "desc": "Navegador libre", "icono": "chromium-browser"},
+        ]
+    }
+]
+
+RUTA_SCRIPTS_REPO = "/opt/guadamint/src/scripts"
+# Copia que despliega el actualizador; se usa si el repositorio no tiene el script
+RUTA_SCRIPTS_SISTEMA = "/usr/lib/guadamint/scripts"
+
+# ==============================================================================
+# SISTEMA DE LOGS
+# ==============================================================================
+# El archivo lo escribe en segundo plano guadamint_log (configurado en main)
+logger = logging.getLogger("guadamint")
+
+# En modo línea de comandos los mensajes van a stderr: stdout queda para los resultados
+SALIDA_LOG = sys.stdout
+
+def log(msg):
+    # Añadimos print para que se vea en la terminal si se lanza con Terminal=true
+    try: print(msg, file=SALIDA_LOG)
+    except: pass
+    logger.info(msg)
+
+# ==============================================================================
+# TRANSACCIONES APT
+# ==============================================================================
+# Líneas finales de la salida de apt-get que se conservan para clasificar errores
+LINEAS_COLA_APT = 200
+# Segundos que apt-get espera por su cuenta al bloqueo de dpkg (DPkg::Lock::Timeout)
+ESPERA_LOCK_APT_GET = 120
+APT_GET = ["env", "DEBIAN_FRONTEND=noninteractive", "/usr/bin/apt-get", "-y", "-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold",
+           # Si otro proceso toma el bloqueo entre la comprobación y apt-get, apt-get espera en vez de fallar
+           "-o", f"DPkg::Lock::Timeout={ESPERA_LOCK_APT_GET}"]
+# Error de los cambios descartados desde la ventana mientras esperaban a APT
+ERROR_CANCELADO = "Cancelado mientras esperaba a APT."
+
+def ejecutar_con_log(cmd, **kwargs):
+    """Ejecuta un comando volcando su salida al log. Devuelve (código, últimas líneas de la salida):
+    la transcripción completa queda en el log, en memoria solo hace falta el final para
+    clasificar el error (apt escribe los "E: ..." al terminar)."""
+    process = guadamint_perfil.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs)
+    cola = collections.deque(maxlen=LINEAS_COLA_APT)
+    for line in process.stdout:
+        log(f"[APT] {line.strip()}")
+        cola.append(line)
+    process.wait()
+    return process.returncode, "".join(cola)
+
+def clasificar_error_apt(full_log):
+    if "Unable to locate" in full_log: return "Paquete no encontrado."
+    elif "lock" in full_log: return "Bloqueo APT."
+    return "Error en la ejecución. Ver logs."
+
+def ejecutar_transaccion(cambios):
+    """
+    Aplica una lista de (app_data, "install"|"remove") con una sola ejecución de apt-get.
+    Las apps con 'script_install' se instalan después, en orden. Devuelve {id: (exito, error)}.
+    """
+    errores = {}
+    por_apt = [(app, accion) for app, accion in cambios if not (accion == "install" and "script_install" in app)]
+    por_script = [app for app, accion in cambios if accion == "install" and "script_install" in app]
+
+    if por_apt:
+        # apt-get install admite el sufijo '-' para desinstalar dentro de la misma transacción
+        paquetes = [app["id"] if accion == "install" else f"{app['id']}-" for app, accion in por_apt]
+        log(f"Iniciando transacción APT: {' '.join(paquetes)}")
+        try:
+            instalar = [app["id"] for app, accion in por_apt if accion == "install"]
+            with fase("aula.traer"): preparar_instalacion(instalar, log)
+            with fase("apt.install", paquetes=len(paquetes)) as registro:
+                codigo, full_log = ejecutar_con_log(APT_GET + ["install"] + paquetes)
+                registro["ok"] = codigo == 0
+            if codigo == 0:
+                log("Comando APT completado con éxito.")
+            else:
+                log(f"Error (Código {codigo})")
+                no_encontrados = {l.split()[-1] for l in full_log.splitlines() if "Unable to locate package" in l}
+                for app, accion in por_apt:
+                    if app["id"] in no_encontrados: errores[app["id"]] = "Paquete no encontrado."
+                    elif no_encontrados: errores[app["id"]] = "Transacción cancelada por otro paquete no encontrado."
+                    else: errores[app["id"]] = clasificar_error_apt(full_log)
+        except Exception as e:
+            log(f"Excepción Python: {e}")
+            for app, accion in por_apt: errores[app["id"]] = str(e)
+
+    for app in por_script:
+        ruta_script = os.path.join(RUTA_SCRIPTS_REPO, app["script_install"])
+        if not os.path.exists(ruta_script) and os.path.exists(os.path.join(RUTA_SCRIPTS_SISTEMA, app["script_install"])):
+            ruta_script = os.path.join(RUTA_SCRIPTS_SISTEMA, app["script_install"])
+        log(f"Iniciando instalación por script: {app['id']} ({app['script_install']})")
+        if not os.path.exists(ruta_script):
+            errores[app["id"]] = f"Script no encontrado: {ruta_script}"
+            continue
+        try:
+            os.chmod(ruta_script, 0o755)
+            # Descargas del script servidas desde la caché de artefactos (rutas en variables de entorno)
+            entorno = dict(os.environ, **preparar_artefactos(app.get("artefactos", []), log))
+            with fase("script", app=app["id"]) as registro:
+                codigo, full_log = ejecutar_con_log(["/bin/bash", ruta_script], cwd=REPO_DIR if os.path.isdir(REPO_DIR) else None,
+                                                    env=entorno)
+                registro["ok"] = codigo == 0
+            if codigo != 0:
+                log(f"Error (Código {codigo})")
+                errores[app["id"]] = clasificar_error_apt(full_log)
+        except Exception as e:
+            log(f"Excepción Python: {e}")
+            errores[app["id"]] = str(e)
+
+    # Validación final real contra el estado de dpkg, una sola vez para toda la transacción
+    with fase("dpkg.estado"): instalados = paquetes_instalados()
+    resultados = {}
+    for app, accion in cambios:
+        intended = (accion == "install")
+        if (app["id"] in instalados) == intended:
+            resultados[app["id"]] = (True, "")
+        else:
+            error_msg = errores.get(app["id"], "")
+            if not error_msg:
+                log(f"AVISO: la transacción terminó bien, pero {app['id']} no quedó en estado {accion}.")
+                error_msg = "El paquete no se instaló/desinstaló correctamente."
+            resultados[app["id"]] = (False, error_msg)
+    return resultados
+
+def aplicar_cambios(cambios, al_esperar=None, cancelar=None, al_empezar=None):
+    """Detiene la precarga, espera a que APT quede libre y ejecuta la transacción (antes llama
+    a al_empezar()). Si APT sigue ocupado al pasar [tienda] espera_apt segundos, o se activa
+    el evento 'cancelar', no se ejecuta nada y todos los cambios fallan con el motivo."""
+    if detener_precarga(): log("Precarga en segundo plano detenida para instalar.")
+    limite = leer_config().getint("tienda", "espera_apt", fallback=ESPERA_TOTAL_BLOQUEO)
+    with fase("espera_apt") as registro:
+        registro["espera"], pid = esperar_bloqueo_apt(al_esperar, limite=limite if limite > 0 else None, cancelar=cancelar)
+        registro["ok"] = pid is None
+    if pid is not None:
+        if cancelar and cancelar.is_set(): error = ERROR_CANCELADO
+        else: error = f"APT ocupado por {nombre_proceso(pid)}" + (f" (PID {pid})" if pid else "") + f" desde hace más de {limite} s."
+        log(f"!!! {error} No se aplican los cambios.")
+        return {app["id"]: (False, error) for app, accion in cambios}
+    if al_empezar: al_empezar()
+    with fase("transaccion", cambios=len(cambios)) as registro:
+        resultados = ejecutar_transaccion(cambios)
+        registro["ok"] = all(exito for exito, error in resultados.values())
+    return resultados
+
+# ==============================================================================
+# MODO LÍNEA DE COMANDOS
+# ==============================================================================
+def buscar_app(app_id):
+    for seccion in CATALOGO:
+        for app in seccion["apps"]:
+            if app["id"] == app_id: return app
+    return None
+
+def _lista(valores):
+    return [x for valor in valores for x in valor.split(",") if x]
+
+def main_cli(argv=None):
+    """Aplica --install/--remove sin interfaz. Código de salida: 0 si todo ha ido bien,
+    1 si ha fallado algún paquete y 2 si la orden no es válida."""
+    global SALIDA_LOG
+    parser = argparse.ArgumentParser(prog="apps-guadamint.py", description="Instala o desinstala apps del catálogo de GuadaMint sin interfaz gráfica.")
+    parser.add_argument("--install", action="append", default=[], metavar="ID[,ID...]", help="Apps del catálogo a instalar")
+    parser.add_argument("--remove", action="append", default=[], metavar="ID[,ID...]", help="Apps del catálogo a desinstalar")
+    parser.add_argument("--json", action="store_true", help="Resultados en JSON por la salida estándar")
+    args = parser.parse_args(argv)
+    SALIDA_LOG = sys.stderr
+
+    pedidos = [(app_id, "install") for app_id in _lista(args.install)] + [(app_id, "remove") for app_id in _lista(args.remove)]
+    if not pedidos: parser.error("indique al menos un --install o --remove")
+    en_conflicto = sorted(set(_lista(args.install)) & set(_lista(args.remove)))
+    if en_conflicto: parser.error(f"no se puede instalar y desinstalar a la vez: {', '.join(en_conflicto)}")
+    if os.geteuid() != 0:
+        print("!!! El modo por línea de comandos necesita root (sudo).", file=sys.stderr)
+        return 2
+    configurar_log(LOG_FILE, "[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+    guadamint_perfil.iniciar("tienda-cli", TIEMPOS_FILE)
+
+    # Lo que no se puede o no hace falta hacer no llega a apt-get
+    instalados = paquetes_instalados()
+    disponibles = paquetes_disponibles([app_id for app_id, accion in pedidos if accion == "install"])
+    resultados, cambios = {}, []
+    for app_id, accion in dict(pedidos).items():
+        app = buscar_app(app_id)
+        if app is None:
+            resultados[app_id] = {"accion": accion, "ok": False, "error": "No está en el catálogo.", "sin_cambios": False}
+        elif (app_id in instalados) == (accion == "install"):
+            resultados[app_id] = {"accion": accion, "ok": True, "error": "", "sin_cambios": True}
+        elif accion == "install" and "script_install" not in app and disponibles is not None and app_id not in disponibles:
+            resultados[app_id] = {"accion": accion, "ok": False, "error": "Paquete no encontrado.", "sin_cambios": False}
+        else:
+            cambios.append((app, accion))
+
+    if cambios:
+        avisados = set()
+        def al_esperar(pid):
+            if pid not in avisados:
+                avisados.add(pid)
+                log(f"APT ocupado por {nombre_proceso(pid)} (PID {pid}): esperando...")
+        for app_id, (exito, error) in aplicar_cambios(cambios, al_esperar).items():
+            accion = next(accion for app, accion in cambios if app["id"] == app_id)
+            resultados[app_id] = {"accion": accion, "ok": exito, "error": error, "sin_cambios": False}
+
+    ok = all(r["ok"] for r in resultados.values())
+    if args.json:
+        json.dump({"ok": ok, "resultados": resultados}, sys.stdout, indent=1, ensure_ascii=False)
+        print()
+    else:
+        for app_id, r in resultados.items():
+            estado = "OK" if r["ok"] else "ERROR"
+            detalle = " (sin cambios)" if r.get("sin_cambios") else (f": {r['error']}" if r["error"] else "")
+            print(f"{estado} {r['accion']} {app_id}{detalle}")
+    return 0 if ok else 1
@@ -18,8 +18,13 @@ URL_CHROME="https://dl.google.com/linux/direct/google-chrome-stable_current_amd6
 TEMP_DEB="/tmp/google-chrome-stable_current_amd64.deb"
 
 # 3. Descargar el paquete
+# Desde la tienda, el paquete llega ya descargado (y reutilizado entre intentos) desde la
+# caché de artefactos de GuadaMint, en GUADAMINT_CHROME_DEB: no se descarga ni se borra.
+if [ -n "$GUADAMINT_CHROME_DEB" ] && [ -f "$GUADAMINT_CHROME_DEB" ]; then
+    echo "-> Usando el paquete de la caché: $GUADAMINT_CHROME_DEB"
+    TEMP_DEB="$GUADAMINT_CHROME_DEB"
 # Usamos wget con -q (quiet) pero --show-progress para ver algo si se ejecuta en terminal
-if command -v wget >/dev/null 2>&1; then
+elif command -v wget >/dev/null 2>&1; then
     echo "-> Descargando paquete oficial..."
     wget -q --show-progress "$URL_CHROME" -O "$TEMP_DEB"
 else
@@ -39,14 +44,20 @@ fi
 # Esto es mejor que 'dpkg -i' porque apt resuelve y descarga las dependencias automáticamente.
 echo "-> Instalando paquete y dependencias..."
 
-apt-get update  # Actualizamos índices por si acaso faltan dependencias nuevas
 apt-get install -y "$TEMP_DEB"
-
 STATUS=$?
+if [ $STATUS -ne 0 ]; then
+    # Solo si falla: puede que falten en los índices dependencias nuevas
+    apt-get update
+    apt-get install -y "$TEMP_DEB"
+    STATUS=$?
+fi
 
-# 5. Limpieza
-echo "-> Limpiando archivos temporales..."
-rm -f "$TEMP_DEB"
+# 5. Limpieza (la copia de la caché se conserva para la próxima vez)
+if [ "$TEMP_DEB" != "$GUADAMINT_CHROME_DEB" ]; then
+    echo "-> Limpiando archivos temporales..."
+    rm -f "$TEMP_DEB"
+fi
 
 # 6. Verificación final
 if [ $STATUS -eq 0 ]; then
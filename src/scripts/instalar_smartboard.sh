@@ -34,10 +34,19 @@ function installSmartdre {
 }
 
 # 2. Ejecutar la función
-installSmartdre
+# Desde la tienda, GUADAMINT_SMARTDRE_DIR apunta a un checkout ya actualizado y limpio de la
+# caché de artefactos de GuadaMint, que se conserva para el próximo intento.
+if [ -n "$GUADAMINT_SMARTDRE_DIR" ] && [ -d "$GUADAMINT_SMARTDRE_DIR" ]; then
+    echo -e "${VERDE}Usando smartdre de la caché: $GUADAMINT_SMARTDRE_DIR${NORMAL}"
+    cd "$GUADAMINT_SMARTDRE_DIR" || { echo "Error: No se pudo acceder a la carpeta"; exit 1; }
+    chmod +x install-noble
+    ./install-noble
+else
+    installSmartdre
 
-# 3. Borrar la carpeta para que si falla o actualizamos el codigo la descargue otra vez en el próximo intento
-rm -r /opt/guadamint/smartdre
+    # 3. Borrar la carpeta para que si falla o actualizamos el codigo la descargue otra vez en el próximo intento
+    rm -r /opt/guadamint/smartdre
+fi
 
 echo -e "${AZUL}====================================================${NORMAL}"
 echo -e "${VERDE}PROCESO FINALIZADO${NORMAL}"